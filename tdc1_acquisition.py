@@ -0,0 +1,334 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Acquisition and logging loops for the TDC1, independent of the GUI. Nothing in here imports Qt.
+
+    Usage:
+    The GUI's logWorker is an Acquisition that turns the on_* hooks into Qt signals; tdc1_headless runs an Acquisition
+    directly. Settings (int_time, ch_start, ...) are plain attributes and may be changed while a loop is running;
+    setting active_flag to False ends the loop after the current acquisition.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from tdc1_logging import LogWriter, BinaryLogWriter, RawTimestampWriter, BINARY_LOG_EXTENSION, RAW_LOG_EXTENSION, \
+    LOG_HEADERS, LOG_FLUSH_ROWS, LOG_FLUSH_INTERVAL, LOG_FSYNC, LOG_ROTATE_BYTES, LOG_ROTATE_INTERVAL, LOG_COMPRESS
+from tdc1_analysis import TIMESTAMP_RESOLUTION
+from tdc1_stream import TimestampStream, StreamAnalyser, CountsPipeline
+from tdc1_metrics import METRICS
+
+
+class Acquisition:
+    """[summary]
+    Runs one singles/pairs/g2 acquisition loop on a TimeStampTDC1 until active_flag is cleared, optionally logging every
+    acquisition. Results are passed to the on_* hooks, which do nothing here; override them to display or count data.
+    """
+
+    def __init__(self, **kwargs):
+        super(Acquisition, self).__init__(**kwargs)
+        self.active_flag = False
+        self.int_time = 1
+        self.ch_start = 1
+        self.ch_stop = 3
+        self.bin_width = 2
+        self.bins = 501
+        self.offset = 0
+        self.runtime = 0
+        self.log_flush_rows = LOG_FLUSH_ROWS
+        self.log_flush_interval = LOG_FLUSH_INTERVAL
+        self.log_fsync = LOG_FSYNC
+        self.log_rotate_bytes = LOG_ROTATE_BYTES # Logfile rotation and compression of completed segments, see LogWriter
+        self.log_rotate_interval = LOG_ROTATE_INTERVAL
+        self.log_compress = LOG_COMPRESS
+        self.stream = False # g2 from a continuous timestamp stream instead of repeated count_g2 calls
+        self.pipelined = False # Singles/pairs with the next window requested before the last one is handled
+        self._window_end = None
+        self.pair_delays = np.zeros((4, 4), dtype=np.int64) # Stop delay per (start, stop) pair for the continuous g2
+
+    # Hooks
+    def on_counts(self, start: float, now: float, data: tuple, dev_mode: str):
+        """[summary]
+        Called after every singles/pairs acquisition with the run's start time, the current time and the counts.
+        """
+
+    def on_histogram(self, g2_dict: dict, bins: int, bin_width: int):
+        """[summary]
+        Called after every g2 acquisition with the histogram dict (as returned by count_g2).
+        """
+
+    def on_message(self, message: str):
+        """[summary]
+        Called with logfile problems, eg. the file is locked by another program.
+        """
+        print(message)
+
+    def on_finished(self, tdc1_dev: object):
+        """[summary]
+        Called when the loop has ended and the logfile is closed.
+        """
+
+    def log_which_data(self, int_time: float, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object, start: int, stop: int, offset: int, bin_width: int):
+        self.int_time = int_time
+        self.ch_start = start
+        self.ch_stop = stop
+        self.offset = offset
+        self.bin_width = bin_width
+        self.active_flag = True
+        self._window_end = None
+        if (dev_mode == 'singles' or dev_mode == 'pairs') and self.pipelined == True:
+            print(f'initiating pipelined {dev_mode} log...')
+            self.log_counts_pipelined(file_name, device_path, log_flag, dev_mode, tdc1_dev)
+        elif dev_mode == 'singles':
+            print('initiating singles log...')
+            self.log_counts_data(file_name, \
+        device_path, log_flag, dev_mode, tdc1_dev)
+        elif dev_mode == 'g2' and self.stream == True:
+            print('initiating continuous g2 log...')
+            self.log_g2_stream(file_name, device_path, log_flag, dev_mode, \
+                tdc1_dev)
+        elif dev_mode == 'g2':
+            print('initiating g2 log...')
+            self.log_g2(file_name, device_path, log_flag, dev_mode, \
+                tdc1_dev)
+        elif dev_mode == 'pairs':
+            print('initiating pairs log')
+            self.log_coincidences_data(file_name, \
+        device_path, log_flag, dev_mode, tdc1_dev)
+
+    def open_logfile(self, file_name: str, dev_mode: str):
+        """[summary]
+        Starts a LogWriter for file_name (a BinaryLogWriter for '.tdc1log' files). Rows are written from the writer's own
+        thread so that file I/O does not add dead time between acquisition windows.
+        """
+        kwargs = dict(flush_rows = self.log_flush_rows, flush_interval = self.log_flush_interval, fsync = self.log_fsync, \
+            on_error = self.on_message, **self.log_rotation())
+        try:
+            if file_name.endswith(BINARY_LOG_EXTENSION):
+                writer = BinaryLogWriter(file_name, self.log_settings(dev_mode), **kwargs)
+            else:
+                writer = LogWriter(file_name, LOG_HEADERS[dev_mode], **kwargs)
+        except ValueError as e:
+            self.on_message(str(e) + ' Data will not be logged.')
+            return None
+        writer.start()
+        return writer
+
+    def log_rotation(self):
+        """[summary]
+        Rotation and compression arguments for the LogWriters of a run.
+        """
+        return dict(rotate_bytes = self.log_rotate_bytes, rotate_interval = self.log_rotate_interval, \
+            compress = self.log_compress)
+
+    def log_settings(self, dev_mode: str):
+        """[summary]
+        Acquisition settings recorded in binary logs alongside the data.
+        """
+        if dev_mode == 'singles':
+            channels = ['1', '2', '3', '4']
+        elif dev_mode == 'pairs':
+            channels = ['1', '2', '3', '4', '1-3', '1-4', '2-3', '2-4']
+        else:
+            channels = [str(self.ch_start), str(self.ch_stop)]
+        return {'mode': dev_mode, 'channels': channels, 'int_time': self.int_time, 'bin_width': self.bin_width, \
+            'offset': self.offset, 'bins': self.bins}
+
+    def record_window(self, int_time: float):
+        """[summary]
+        Records a counts window that has just been answered in METRICS: 'window' (whose busy fraction is the duty cycle)
+        and 'dead_time' since the previous window. The TDC1 times the window itself and answers when it ends, so the
+        window is taken as the int_time before its answer; the serial transfer delays both ends alike.
+        """
+        end = time.perf_counter()
+        METRICS.record('window', int_time, end)
+        if self._window_end is not None:
+            METRICS.record('dead_time', max(0.0, end - int_time - self._window_end), end)
+        self._window_end = end
+
+    def log_counts_data(self, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object):
+        start = time.time()
+        now = start
+        # If log file is selected, hand each sample to the writer in addition to displaying counts
+        writer = None
+        if log_flag == True and self.active_flag == True:
+            writer = self.open_logfile(file_name, dev_mode)
+            settings = self.log_settings(dev_mode)
+        while self.active_flag == True:
+            int_time = self.int_time
+            with METRICS.timer('acquire'):
+                counts = tdc1_dev.get_counts(int_time)
+            self.record_window(int_time)
+            now = time.time()
+            self.on_counts(start, now, counts, dev_mode)
+            if writer:
+                if self.log_settings(dev_mode) != settings:
+                    settings = self.log_settings(dev_mode)
+                    writer.put_metadata(**settings)
+                writer.put(now, counts)
+        if writer:
+            writer.close()
+        print('terminating singles log.')
+        self.on_finished(tdc1_dev)
+
+    def log_coincidences_data(self, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object):
+        """[summary]
+        Logs the data from TDC1 Timestamp unit when in Coincidences mode. See log_counts_data function for more information.
+        """
+        start = time.time()
+        now = start
+        writer = None
+        if log_flag == True and self.active_flag == True:
+            writer = self.open_logfile(file_name, dev_mode)
+            settings = self.log_settings(dev_mode)
+        while self.active_flag == True:
+            int_time = self.int_time
+            with METRICS.timer('acquire'):
+                coincidences = tdc1_dev.get_counts_and_coincidences(int_time)
+            self.record_window(int_time)
+            now = time.time()
+            self.on_counts(start, now, coincidences, dev_mode)
+            if writer:
+                if self.log_settings(dev_mode) != settings:
+                    settings = self.log_settings(dev_mode)
+                    writer.put_metadata(**settings)
+                writer.put(now, coincidences)
+        if writer:
+            writer.close()
+        print('terminating pairs log.')
+        self.on_finished(tdc1_dev)
+
+    def log_counts_pipelined(self, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object):
+        """[summary]
+        Singles or pairs as log_counts_data and log_coincidences_data, but with the next window already requested from
+        the device (CountsPipeline) while the last one is handed on and logged, so there is no dead time between windows
+        for the processing. An int_time change applies from the window requested next.
+        """
+        start = time.time()
+        now = start
+        writer = None
+        if log_flag == True and self.active_flag == True:
+            writer = self.open_logfile(file_name, dev_mode)
+            settings = self.log_settings(dev_mode)
+        pipeline = CountsPipeline(tdc1_dev)
+        pipeline.start(self.int_time)
+        unanswered = False
+        while self.active_flag == True:
+            with METRICS.timer('acquire'):
+                counts, int_time = pipeline.read(self.int_time)
+            if counts is None:
+                # Once per outage, not for every window
+                if unanswered == False:
+                    self.on_message(f'No answer from {device_path} within the integration time.')
+                unanswered = True
+                continue
+            if unanswered == True:
+                self.on_message(f'{device_path} is answering again ({pipeline.lost} windows lost so far).')
+                unanswered = False
+            self.record_window(int_time)
+            now = time.time()
+            self.on_counts(start, now, counts, dev_mode)
+            if writer:
+                if self.log_settings(dev_mode) != settings:
+                    settings = self.log_settings(dev_mode)
+                    writer.put_metadata(**settings)
+                writer.put(now, counts)
+        pipeline.stop()
+        if writer:
+            writer.close()
+        print(f'terminating pipelined {dev_mode} log ({pipeline.lost} lost windows).')
+        self.on_finished(tdc1_dev)
+
+    def log_g2(self, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object):
+        start = time.time()
+        now = start
+        writer = None
+        if log_flag == True and self.active_flag == True:
+            writer = self.open_logfile(file_name, dev_mode)
+            settings = self.log_settings(dev_mode)
+        while self.active_flag == True:
+            #print(f'calling g2_dict({self.int_time}, START: {self.ch_start}, STOP: {self.ch_stop}, {self.bin_width}, {self.bins}, {self.offset})')
+            with METRICS.timer('acquire'):
+                g2_dict = tdc1_dev.count_g2(t_acq = self.int_time, ch_start = self.ch_start, ch_stop = self.ch_stop, \
+                    bin_width = self.bin_width, bins = self.bins, ch_stop_delay = self.offset)
+            now = time.time()
+            self.on_histogram(g2_dict, self.bins, self.bin_width)
+            if writer:
+                if self.log_settings(dev_mode) != settings:
+                    settings = self.log_settings(dev_mode)
+                    writer.put_metadata(**settings)
+                writer.put(now, g2_dict['histogram'])
+        if writer:
+            writer.close()
+        print('terminating g2 log.')
+        self.on_finished(tdc1_dev)
+
+    def log_g2_stream(self, file_name: str, device_path: str, log_flag: bool, \
+        dev_mode: str, tdc1_dev: object):
+        """[summary]
+        g2 without gaps between acquisitions. The TDC1 stays in timestamp mode and this loop only drains the serial port;
+        a StreamAnalyser thread builds one histogram per integration time and calls on_histogram as log_g2 does.
+        If logging, the raw events also go to '<logfile>.tdc1raw' so they can be re-analysed later
+        (tdc1_analysis.g2_from_raw_log), and the histograms to the logfile as usual.
+        """
+        writer = None
+        raw_writer = None
+        settings = None
+        if log_flag == True and self.active_flag == True:
+            writer = self.open_logfile(file_name, dev_mode)
+            settings = self.log_settings(dev_mode)
+            raw_writer = RawTimestampWriter(os.path.splitext(file_name)[0] + RAW_LOG_EXTENSION, \
+                {'mode': 'timestamps', 'device': device_path, 'resolution': TIMESTAMP_RESOLUTION}, \
+                on_error = self.on_message, **self.log_rotation())
+            raw_writer.start()
+
+        def window_done(g2_dict):
+            # Called from the analyser thread
+            nonlocal settings
+            self.on_histogram(g2_dict, len(g2_dict['histogram']), self.bin_width)
+            if writer:
+                if self.log_settings(dev_mode) != settings:
+                    settings = self.log_settings(dev_mode)
+                    writer.put_metadata(**settings)
+                writer.put(time.time(), g2_dict['histogram'])
+
+        analyser = StreamAnalyser(self, window_done)
+        analyser.start()
+        stream = TimestampStream(tdc1_dev)
+        stream.start()
+        while self.active_flag == True:
+            with METRICS.timer('stream_read'):
+                raw = stream.read()
+            if raw:
+                if raw_writer:
+                    raw_writer.put(time.time(), raw)
+                analyser.put(raw)
+        stream.stop()
+        analyser.close()
+        for w in (writer, raw_writer):
+            if w:
+                w.close()
+        print(f'terminating continuous g2 log ({analyser.events} events, {stream.rearms} re-arms).')
+        self.on_finished(tdc1_dev)
@@ -0,0 +1,445 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Software analysis of raw TDC1 timestamps. Nothing in here depends on Qt.
+
+    Timestamps are handled as two arrays of equal length: event times in ns (int64, increasing) and channel patterns
+    (uint8, bit 0 = channel 1 ... bit 3 = channel 4; simultaneous events set several bits).
+"""
+
+import numpy as np
+
+
+TIMESTAMP_RESOLUTION = 2 # ns per TDC1 timestamp tick
+_COUNTER_PERIOD = 1 << 27 # The 27-bit timestamp counter wraps after this many ticks
+
+
+def channel_mask(channel: int) -> int:
+    return 1 << (channel - 1)
+
+
+class TimestampDecoder:
+    """[summary]
+    Vectorised decoder for the 32-bit little-endian words the TDC1 sends in timestamp mode: the upper 27 bits are the
+    timestamp counter, the lower 5 bits the event pattern. Pattern bit 4 marks a counter-wrap marker rather than an
+    event. Wraps are also detected from the counter going backwards. The wrap count is carried between calls, so a
+    continuous stream can be decoded in arbitrary pieces.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._periods = 0
+        self._last = -1
+
+    def decode(self, raw):
+        """[summary]
+        Args:
+            raw (bytes or np.ndarray): Whole words; bytes are interpreted as '<u4'.
+
+        Returns:
+            (np.ndarray, np.ndarray): Event times in ns (int64) and channel patterns (uint8).
+        """
+        words = np.frombuffer(raw, dtype='<u4') if isinstance(raw, (bytes, bytearray, memoryview)) else raw
+        if len(words) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint8)
+        ticks = (words >> 5).astype(np.int64)
+        pattern = (words & 0x1F).astype(np.uint8)
+        wrapped = np.empty(len(ticks), dtype=np.int64)
+        wrapped[0] = 1 if (self._last >= 0 and ticks[0] < self._last) else 0
+        np.less(ticks[1:], ticks[:-1], out=wrapped[1:])
+        periods = np.cumsum(wrapped) + self._periods
+        self._periods = int(periods[-1])
+        self._last = int(ticks[-1])
+        events = (pattern & 0x10) == 0
+        times = (ticks[events] + periods[events] * _COUNTER_PERIOD) * TIMESTAMP_RESOLUTION
+        return times, pattern[events] & 0x0F
+
+
+def g2_histogram(times, patterns, ch_start: int, ch_stop: int, bin_width: int, bins: int, ch_stop_delay: int = 0, \
+    start_range = None):
+    """[summary]
+    Start-stop histogram in the same form as TimeStampTDC1.count_g2: for every start event, every stop event with
+    0 <= t_stop + ch_stop_delay - t_start < bins * bin_width is counted in bin (difference // bin_width).
+
+    Args:
+        times, patterns (np.ndarray): Events, see module docstring.
+        start_range (tuple): Optional (first, last) time; only start events in first <= t < last are counted. Used
+            for streams, so that starts near the end of a batch wait for their stops in the next one.
+
+    Returns:
+        np.ndarray: int64 counts per bin.
+    """
+    if bin_width <= 0 or bins <= 0:
+        return np.zeros(max(bins, 0), dtype=np.int64)
+    starts = times[(patterns & channel_mask(ch_start)) != 0]
+    stops = times[(patterns & channel_mask(ch_stop)) != 0] + ch_stop_delay
+    if start_range is not None:
+        starts = starts[(starts >= start_range[0]) & (starts < start_range[1])]
+    window = bins * bin_width
+    # Same channel: an event is not its own stop
+    lo = np.searchsorted(stops, starts, side='right' if ch_start == ch_stop and ch_stop_delay == 0 else 'left')
+    hi = np.searchsorted(stops, starts + window, side='left')
+    n = hi - lo
+    total = int(n.sum())
+    if total == 0:
+        return np.zeros(bins, dtype=np.int64)
+    # Expand every start into its stops without a Python loop
+    first = np.repeat(lo, n)
+    within = np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+    delays = stops[first + within] - np.repeat(starts, n)
+    return np.bincount(delays // bin_width, minlength=bins)[:bins].astype(np.int64)
+
+
+CHANNEL_PAIRS = [(a, b) for a in range(1, 5) for b in range(1, 5) if a != b] # The 12 ordered (start, stop) pairs
+
+# Lookup tables for splitting 4-bit channel patterns into single-channel events
+_POPCOUNT = np.array([bin(p).count('1') for p in range(16)], dtype=np.int64)
+_NTH_CHANNEL = np.array([[[c for c in range(4) if p >> c & 1][k] if k < _POPCOUNT[p] else -1 for k in range(4)] \
+    for p in range(16)], dtype=np.int8)
+
+
+def split_channels(times, patterns):
+    """[summary]
+    One event per channel: patterns with several bits set (simultaneous events) are expanded.
+
+    Returns:
+        (np.ndarray, np.ndarray): Event times (still in order) and channel indices 0-3.
+    """
+    counts = _POPCOUNT[patterns]
+    if np.all(counts == 1):
+        return times, _NTH_CHANNEL[patterns, 0]
+    index = np.repeat(np.arange(len(times)), counts)
+    k = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return times[index], _NTH_CHANNEL[patterns[index], k]
+
+
+def all_pairs_histograms(times, patterns, bin_width: int, bins: int, delays = None, start_range = None, \
+    block: int = 1 << 18):
+    """[summary]
+    g2_histogram for all 12 ordered channel pairs in one pass over the merged event stream. For every start event the
+    candidate stops of all channels are found with one searchsorted window, each candidate gets the delay of its
+    (start, stop) pair, and a single bincount fills every histogram.
+
+    Args:
+        times, patterns (np.ndarray): Events, see module docstring.
+        delays (np.ndarray): Optional (4, 4) stop delays in ns, delays[start - 1, stop - 1]. Default all 0.
+        start_range (tuple): See g2_histogram.
+        block (int): Start events processed per step, to bound memory.
+
+    Returns:
+        np.ndarray: int64 counts, shape (12, bins), rows in CHANNEL_PAIRS order.
+    """
+    if bin_width <= 0 or bins <= 0:
+        return np.zeros((len(CHANNEL_PAIRS), max(bins, 0)), dtype=np.int64)
+    t, ch = split_channels(times, patterns)
+    delays = np.zeros((4, 4), dtype=np.int64) if delays is None else np.asarray(delays, dtype=np.int64)
+    window = bins * bin_width
+    # Over all pairs, a stop can be between t_start - max(delay) and t_start + window - min(delay)
+    lo_offset = -int(delays.max())
+    hi_offset = window - int(delays.min())
+    first, last = 0, len(t)
+    if start_range is not None:
+        first = np.searchsorted(t, start_range[0], side='left')
+        last = np.searchsorted(t, start_range[1], side='left')
+    hist = np.zeros(16 * bins, dtype=np.int64)
+    for i in range(first, last, block):
+        starts = t[i:min(i + block, last)]
+        start_ch = ch[i:min(i + block, last)].astype(np.int64)
+        lo = np.searchsorted(t, starts + lo_offset, side='left')
+        hi = np.searchsorted(t, starts + hi_offset, side='left')
+        n = hi - lo
+        total = int(n.sum())
+        if total == 0:
+            continue
+        stop = np.repeat(lo, n) + (np.arange(total) - np.repeat(np.cumsum(n) - n, n))
+        a = np.repeat(start_ch, n)
+        b = ch[stop].astype(np.int64)
+        delta = t[stop] + delays[a, b] - np.repeat(starts, n)
+        valid = (a != b) & (delta >= 0) & (delta < window)
+        key = (a[valid] * 4 + b[valid]) * bins + delta[valid] // bin_width
+        hist += np.bincount(key, minlength=16 * bins)
+    hist = hist.reshape(4, 4, bins)
+    return np.stack([hist[a - 1, b - 1] for a, b in CHANNEL_PAIRS])
+
+
+class _StreamingCorrelation:
+    # Hold-back logic shared by the streaming histograms. Subclasses give the histogram function and how far before
+    # (lookback) and after (reach) a start its stops can be.
+
+    def __init__(self):
+        self._times = np.empty(0, dtype=np.int64)
+        self._patterns = np.empty(0, dtype=np.uint8)
+        self._next_start = None # Start events before this time have been counted
+
+    def push(self, times, patterns):
+        """[summary]
+        Adds a batch of events (later than all previous ones) and returns the histogram of the starts that are now
+        complete.
+        """
+        if len(times) == 0:
+            return self._histogram(times, patterns, (0, 0))
+        times = np.concatenate((self._times, times))
+        patterns = np.concatenate((self._patterns, patterns))
+        if self._next_start is None:
+            self._next_start = int(times[0])
+        ready = int(times[-1]) - max(self._reach(), 0)
+        hist = self._histogram(times, patterns, (self._next_start, ready))
+        self._next_start = max(self._next_start, ready)
+        # Keep the pending starts and every stop they may still pair with
+        keep = np.searchsorted(times, self._next_start - max(self._lookback(), 0), side='left')
+        self._times = times[keep:]
+        self._patterns = patterns[keep:]
+        return hist
+
+    def flush(self):
+        """[summary]
+        Counts the held-back starts against the events received so far, e.g. at the end of a run.
+        """
+        if len(self._times) == 0 or self._next_start is None:
+            return self._histogram(self._times[:0], self._patterns[:0], (0, 0))
+        hist = self._histogram(self._times, self._patterns, (self._next_start, int(self._times[-1]) + 1))
+        self._times = self._times[:0]
+        self._patterns = self._patterns[:0]
+        self._next_start = None
+        return hist
+
+
+class StreamingG2(_StreamingCorrelation):
+    """[summary]
+    g2_histogram for a stream of event batches. Start events whose stop window reaches past the newest event are held
+    back until the next batch arrives, so nothing is lost or double counted at batch boundaries.
+
+    Args:
+        ch_start, ch_stop, bin_width, bins, ch_stop_delay: See g2_histogram. Change them with configure().
+    """
+
+    def __init__(self, ch_start: int = 1, ch_stop: int = 3, bin_width: int = 2, bins: int = 501, ch_stop_delay: int = 0):
+        super(StreamingG2, self).__init__()
+        self.configure(ch_start, ch_stop, bin_width, bins, ch_stop_delay)
+
+    def configure(self, ch_start: int, ch_stop: int, bin_width: int, bins: int, ch_stop_delay: int):
+        self.ch_start = ch_start
+        self.ch_stop = ch_stop
+        self.bin_width = bin_width
+        self.bins = bins
+        self.ch_stop_delay = ch_stop_delay
+
+    def _reach(self):
+        return self.bins * self.bin_width - self.ch_stop_delay
+
+    def _lookback(self):
+        return self.ch_stop_delay
+
+    def _histogram(self, times, patterns, start_range):
+        return g2_histogram(times, patterns, self.ch_start, self.ch_stop, self.bin_width, self.bins, \
+            self.ch_stop_delay, start_range=start_range)
+
+
+class StreamingAllPairs(_StreamingCorrelation):
+    """[summary]
+    all_pairs_histograms for a stream of event batches, see StreamingG2.
+
+    Args:
+        bin_width, bins, delays: See all_pairs_histograms. Change them with configure().
+    """
+
+    def __init__(self, bin_width: int = 2, bins: int = 501, delays = None):
+        super(StreamingAllPairs, self).__init__()
+        self.configure(bin_width, bins, delays)
+
+    def configure(self, bin_width: int, bins: int, delays = None):
+        self.bin_width = bin_width
+        self.bins = bins
+        self.delays = np.zeros((4, 4), dtype=np.int64) if delays is None else np.array(delays, dtype=np.int64)
+
+    def _reach(self):
+        return self.bins * self.bin_width - int(self.delays.min())
+
+    def _lookback(self):
+        return int(self.delays.max())
+
+    def _histogram(self, times, patterns, start_range):
+        return all_pairs_histograms(times, patterns, self.bin_width, self.bins, self.delays, start_range=start_range)
+
+
+def g2_from_raw_log(file_name: str, ch_start: int, ch_stop: int, bin_width: int, bins: int, ch_stop_delay: int = 0):
+    """[summary]
+    Re-analyses a raw timestamp log (RawTimestampWriter) with new settings. The file is memory-mapped and processed
+    chunk by chunk, so logs larger than memory are fine.
+
+    Returns:
+        np.ndarray: int64 counts per bin over the whole log.
+    """
+    from tdc1_logging import read_binary_log
+    hist = np.zeros(bins, dtype=np.int64)
+    for segment in read_binary_log(file_name):
+        # Each segment is one run (read_binary_log joins the resyncs within a run): the device counter restarted,
+        # so decoding starts afresh
+        decoder = TimestampDecoder()
+        g2 = StreamingG2(ch_start, ch_stop, bin_width, bins, ch_stop_delay)
+        for words in segment.chunks:
+            hist += g2.push(*decoder.decode(words))
+        hist += g2.flush()
+    return hist
+
+
+G2_FIT_SIGNIFICANCE = 5 # Standard deviations a fitted peak must stand above the background
+AUTO_DELAY_RANGE = 10000 # ns either side of zero searched by find_stop_delay
+AUTO_DELAY_FFT_BINS = 1 << 21 # Most time bins find_stop_delay correlates by FFT; longer batches get wider bins
+_FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+
+
+def find_stop_delay(times, patterns, ch_start: int, ch_stop: int, max_delay: int = AUTO_DELAY_RANGE, \
+    bin_width: int = TIMESTAMP_RESOLUTION, significance: float = G2_FIT_SIGNIFICANCE):
+    """[summary]
+    Finds the delay of the stop channel relative to the start channel from one batch of timestamps, within
+    +-max_delay ns. Both channels are binned over the whole batch into at most AUTO_DELAY_FFT_BINS bins and
+    cross-correlated by FFT, which costs the same for any number of events (pairing every start with every stop
+    within +-max_delay would grow with the square of the rate). The coarse peak is then refined with g2_histogram
+    at bin_width, over the few coarse bins around it only.
+
+    Args:
+        times, patterns (np.ndarray): Events, see module docstring.
+        max_delay (int): Largest delay searched, either way, in ns.
+        bin_width (int): Resolution of the result in ns.
+        significance (float): Standard deviations the coarse peak must stand above the background.
+
+    Returns:
+        dict: delay (ns, stop minus start, start of the highest fine bin), pairs (coincidences above the
+            background in the coarse peak) and significance; None if no peak stands out.
+    """
+    starts = times[(patterns & channel_mask(ch_start)) != 0]
+    stops = times[(patterns & channel_mask(ch_stop)) != 0]
+    if ch_start == ch_stop or len(starts) == 0 or len(stops) == 0:
+        return None
+    t0 = min(starts[0], stops[0])
+    span = max(starts[-1], stops[-1]) - t0 + 1
+    coarse = max(bin_width, -(-span // AUTO_DELAY_FFT_BINS))
+    coarse = -(-coarse // bin_width) * bin_width # Whole fine bins, so the refined window lines up
+    lags = -(-max_delay // coarse) + 1
+    size = span // coarse + 1
+    a = np.bincount((starts - t0) // coarse, minlength=size).astype(np.float64)
+    b = np.bincount((stops - t0) // coarse, minlength=size).astype(np.float64)
+    n = 1 << int(np.ceil(np.log2(size + lags))) # Zero padded, so lags do not wrap around
+    c = np.fft.irfft(np.conj(np.fft.rfft(a, n)) * np.fft.rfft(b, n), n)
+    correlation = np.concatenate((c[n - lags:], c[:lags + 1])) # Lags -lags ... +lags coarse bins
+    # A delay falls into two neighbouring lags depending on where the events sit in their bins
+    pair_sums = correlation[:-1] + correlation[1:]
+    background = max(float(np.median(pair_sums)), 0.0)
+    peak = int(np.argmax(pair_sums))
+    excess = float(pair_sums[peak]) - background
+    noise = np.sqrt(max(background, 1.0))
+    if excess < significance * noise:
+        return None
+    # Delays of the peak's two lags lie within (lag - 1, lag + 2) coarse bins; histogram that range finely
+    low = (peak - lags - 1) * coarse
+    fine = g2_histogram(times, patterns, ch_start, ch_stop, bin_width, 3 * coarse // bin_width, -low)
+    return {'delay': int(low + np.argmax(fine) * bin_width), 'pairs': int(round(excess)), \
+        'significance': float(excess / noise)}
+
+
+def g2_peak_model(delays, params):
+    """[summary]
+    Gaussian peak on a flat background, the model fit_g2_peak fits: params are (position, sigma, height, background),
+    delays and position in ns.
+    """
+    position, sigma, height, background = params
+    return background + height * np.exp(-0.5 * ((np.asarray(delays, dtype=np.float64) - position) / sigma) ** 2)
+
+
+def fit_g2_peak(delays, histogram, initial = None, iterations: int = 50):
+    """[summary]
+    Fits a Gaussian peak on a flat background (g2_peak_model) to a g2 histogram by Levenberg-Marquardt, weighting
+    every bin by its Poisson error. Without an initial guess, the peak is taken at the highest bin, the background at
+    the median bin and the width from the bins above half height.
+
+    Args:
+        delays (np.ndarray): Delay of every bin in ns, eg. HistogramAccumulator.time_bins().
+        histogram (np.ndarray): Counts per bin.
+        initial (tuple): Starting (position, sigma, height, background), eg. the previous fit's params scaled to the
+            new number of counts. Converges in a few iterations when the peak has hardly changed.
+        iterations (int): Maximum number of iterations.
+
+    Returns:
+        dict: position and fwhm (ns), height and background (counts per bin), g2_0 (peak over background, inf
+            without background), params (for g2_peak_model or as the next initial), iterations; None if there is no
+            peak to fit, or the fitted one is not at least G2_FIT_SIGNIFICANCE standard deviations above the
+            background (a noise fluctuation).
+    """
+    x = np.asarray(delays, dtype=np.float64)
+    y = np.asarray(histogram, dtype=np.float64)
+    if len(y) < 5 or y.sum() <= 0:
+        return None
+    bin_width = x[1] - x[0]
+    weights = 1 / np.maximum(y, 1) # Inverse Poisson variance
+    if initial is None:
+        background = float(np.median(y))
+        peak = int(np.argmax(y))
+        height = y[peak] - background
+        above = np.count_nonzero(y - background > height / 2)
+        initial = (x[peak], max(above, 1) * bin_width / _FWHM_PER_SIGMA, height, background)
+    params = np.array(initial, dtype=np.float64)
+
+    def residuals(params):
+        return y - g2_peak_model(x, params)
+
+    r = residuals(params)
+    chi2 = float((weights * r ** 2).sum())
+    damping = 1e-3
+    done = 0
+    for done in range(1, iterations + 1):
+        position, sigma, height, _ = params
+        u = (x - position) / sigma
+        g = np.exp(-0.5 * u ** 2)
+        # Jacobian of the model with respect to (position, sigma, height, background)
+        jacobian = np.stack((height * g * u / sigma, height * g * u ** 2 / sigma, g, np.ones_like(x)), axis=1)
+        jtw = jacobian.T * weights
+        jtj = jtw @ jacobian
+        gradient = jtw @ r
+        improved = False
+        while damping < 1e10:
+            try:
+                step = np.linalg.solve(jtj + damping * np.diag(np.diag(jtj) + 1e-12), gradient)
+            except np.linalg.LinAlgError:
+                return None
+            trial = params + step
+            trial[1] = abs(trial[1])
+            trial_r = residuals(trial)
+            trial_chi2 = float((weights * trial_r ** 2).sum())
+            if trial_chi2 <= chi2:
+                improved = True
+                converged = chi2 - trial_chi2 <= 1e-9 * chi2
+                params, r, chi2 = trial, trial_r, trial_chi2
+                damping = max(damping / 10, 1e-12)
+                break
+            damping *= 10
+        if not improved or converged:
+            break
+    position, sigma, height, background = params.tolist()
+    if height <= 0 or not bin_width / 10 < sigma < x[-1] - x[0] or not x[0] <= position <= x[-1]:
+        return None
+    # Counts in the peak against the Poisson noise of everything within its FWHM
+    area = height * sigma * np.sqrt(2 * np.pi) / bin_width
+    noise = np.sqrt(max(background, 0) * sigma * _FWHM_PER_SIGMA / bin_width + area)
+    if area < G2_FIT_SIGNIFICANCE * noise:
+        return None
+    return {'position': position, 'fwhm': float(sigma * _FWHM_PER_SIGMA), 'height': height, 'background': background, \
+        'g2_0': (height + background) / background if background > 0 else float('inf'), 'params': tuple(params.tolist()), \
+        'iterations': done}
@@ -0,0 +1,489 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Benchmarks for the TDC1 GUI's data paths, runnable without a device.
+
+    Usage:
+    python tdc1_bench.py correlation --events 1000000
+    python tdc1_bench.py correlation --json results.json
+    python tdc1_bench.py rawlog --events 1000000
+    python tdc1_bench.py startup --repeat 5
+    python tdc1_bench.py pipeline --platform offscreen --json pipeline.json
+    python tdc1_bench.py jitter --int-times 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from tdc1_acquisition import Acquisition
+from tdc1_analysis import CHANNEL_PAIRS, g2_histogram, all_pairs_histograms, g2_from_raw_log
+from tdc1_logging import RawTimestampWriter, RAW_LOG_EXTENSION, log_files
+from tdc1_process import AcquisitionProcess
+from tdc1_sim import simulate_events, open_device, encode_timestamps
+
+
+def synthetic_events(events: int, rate: float = 1e6, pair_fraction: float = 0.2, delay: int = 20, seed: int = 0):
+    """[summary]
+    About `events` events from the simulated source (tdc1_sim.simulate_events) at a total rate of `rate` events/s,
+    a fraction of them in pairs on channels 1 and 3 delayed by `delay` ns. Returns (times in ns, patterns).
+    """
+    rng = np.random.default_rng(seed)
+    duration = events / rate
+    pair_rate = rate * pair_fraction / 2
+    return simulate_events(duration, [(rate - 2 * pair_rate) / 4] * 4, pair_rate, (1, 3), delay, 1, rng)
+
+
+def _best_of(repeat: int, function, *args, **kwargs):
+    # Best wall time of `repeat` runs (the least disturbed one) and the last result
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_correlation(events: int = 1000000, bins: int = 501, bin_width: int = 2, repeat: int = 3):
+    """[summary]
+    Histograms all 12 channel pairs of one batch of events, once pair by pair with g2_histogram and once with
+    all_pairs_histograms, and checks that both give the same counts.
+    """
+    times, patterns = synthetic_events(events)
+    per_pair_s, per_pair = _best_of(repeat, lambda: np.array([g2_histogram(times, patterns, start, stop, bin_width,
+        bins) for start, stop in CHANNEL_PAIRS]))
+    all_pairs_s, all_pairs = _best_of(repeat, all_pairs_histograms, times, patterns, bin_width, bins)
+    return {
+        'events': len(times),
+        'bins': bins,
+        'bin_width': bin_width,
+        'per_pair_s': per_pair_s,
+        'all_pairs_s': all_pairs_s,
+        'speedup': per_pair_s / all_pairs_s,
+        'all_pairs_events_per_s': len(times) / all_pairs_s,
+        'coincidences': int(all_pairs.sum()),
+        'identical': bool(np.array_equal(per_pair, all_pairs)),
+    }
+
+
+def bench_rawlog(events: int = 1000000, bins: int = 501, bin_width: int = 2, batches: int = 50, repeat: int = 3):
+    """[summary]
+    Writes one batch of events as a raw timestamp log (RawTimestampWriter) in `batches` flushes, with a time index
+    entry at every flush and a new rotated file every quarter of the events, then re-analyses it with
+    g2_from_raw_log and checks that it gives the same counts as g2_histogram over the whole stream.
+    """
+    times, patterns = synthetic_events(events)
+    expected = g2_histogram(times, patterns, 1, 3, bin_width, bins)
+    splits = np.linspace(0, len(times), batches + 1).astype(int)
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'bench' + RAW_LOG_EXTENSION)
+        writer = RawTimestampWriter(file_name, {'mode': 'timestamps'}, flush_rows=1, index_rows=1, \
+            rotate_bytes=len(times))
+        writer.start()
+        for begin, end in zip(splits[:-1], splits[1:]):
+            writer.put(time.time(), encode_timestamps(times[begin:end], patterns[begin:end]))
+        writer.close()
+        files = len(log_files(file_name))
+        reanalyse_s, histogram = _best_of(repeat, g2_from_raw_log, file_name, 1, 3, bin_width, bins)
+    return {
+        'events': len(times),
+        'batches': batches,
+        'files': files,
+        'reanalyse_s': reanalyse_s,
+        'events_per_s': len(times) / reanalyse_s,
+        'coincidences': int(expected.sum()),
+        'identical': bool(np.array_equal(histogram, expected)),
+    }
+
+
+# Run in a fresh interpreter by bench_startup, so that imports are measured cold. Prints one JSON line of times (s)
+# since `started`, the time.time() at which the parent launched the process.
+_STARTUP_SCRIPT = r'''
+import json, sys, time
+started = float(sys.argv[1])
+times = {'interpreter': time.time() - started}
+from PyQt5 import QtCore, QtWidgets
+app = QtWidgets.QApplication(sys.argv[:1])
+import tdc1_funcnew
+times['import'] = time.time() - started
+update_dev_list = tdc1_funcnew.MainWindow.updateDevList
+def listed(self, devices):
+    update_dev_list(self, devices)
+    discovered(devices)
+tdc1_funcnew.MainWindow.updateDevList = listed # The search may finish before win exists to connect to
+win = tdc1_funcnew.MainWindow()
+times['window'] = time.time() - started
+
+class Watcher(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and 'first_paint' not in times:
+            times['first_paint'] = time.time() - started
+            QtCore.QTimer.singleShot(0, check)
+        return False
+
+def discovered(devices):
+    times['devices_listed'] = time.time() - started
+    times['devices'] = len(devices)
+    check()
+
+def check():
+    if 'first_paint' in times and 'devices_listed' in times:
+        app.quit()
+
+watcher = Watcher()
+app.installEventFilter(watcher)
+win.show()
+QtCore.QTimer.singleShot(30000, app.quit)
+app.exec_()
+win.cleanUp()
+print(json.dumps(times))
+'''
+
+
+def bench_startup(repeat: int = 3, platform: str = None):
+    """[summary]
+    Starts the GUI in a new process `repeat` times and reports the median time from launch to: interpreter ready,
+    tdc1_funcnew imported, MainWindow constructed, first paint, and device list filled by the background search.
+    """
+    env = dict(os.environ)
+    if platform:
+        env['QT_QPA_PLATFORM'] = platform
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = here + os.pathsep + env.get('PYTHONPATH', '')
+    runs = []
+    for _ in range(repeat):
+        started = time.time()
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT, repr(started)], env=env, cwd=here, \
+            capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads([line for line in output.splitlines() if line.startswith('{')][-1]))
+    result = {'runs': repeat}
+    for key in ('interpreter', 'import', 'window', 'first_paint', 'devices_listed'):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            result[key + '_s'] = float(np.median(values))
+    result['devices'] = runs[-1].get('devices', 0)
+    return result
+
+
+# Run in a fresh interpreter by bench_pipeline for one mode and integration time: the GUI acquires from the simulator
+# with a logfile for `duration` seconds. Prints one JSON line of measurements.
+_PIPELINE_SCRIPT = r'''
+import collections, json, os, sys, time
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+import tdc1_funcnew as T
+
+mode, int_ms, duration, option, logfile = sys.argv[1], int(sys.argv[2]), float(sys.argv[3]), sys.argv[4], sys.argv[5]
+T.MainWindow.restoreSettings = lambda self: None # Neither use nor overwrite the user's saved settings
+T.MainWindow.saveSettings = lambda self: None
+QtWidgets.QMessageBox.exec = lambda self: QtWidgets.QMessageBox.Ok
+
+emitted = collections.deque() # perf_counter() of every sample/histogram handed over, appended in the worker thread
+received = [] # Hand-over times of data taken by the GUI in the current frame
+rendered = [] # Hand-over times of data drawn by renderFrame but not yet painted
+latencies = []
+ingest_times = []
+samples = [] # Samples (or g2 acquisitions) taken per frame
+render_times = []
+acquired = []
+
+def emitting(hook):
+    def wrapper(self, *args):
+        emitted.append(time.perf_counter())
+        hook(self, *args)
+    return wrapper
+T.logWorker.on_counts = emitting(T.logWorker.on_counts)
+T.logWorker.on_histogram = emitting(T.logWorker.on_histogram)
+
+def timed_ingest(ingest, size):
+    def wrapper(self, block):
+        start = time.perf_counter()
+        n = size(block)
+        received.extend(emitted.popleft() if emitted else start for _ in range(n))
+        ingest(self, block)
+        ingest_times.append(time.perf_counter() - start)
+        samples.append(n)
+    return wrapper
+T.MainWindow.updateCounts = timed_ingest(T.MainWindow.updateCounts, len)
+T.MainWindow.updateHistogram = timed_ingest(T.MainWindow.updateHistogram, lambda block: block.acquisitions)
+
+render = T.MainWindow.renderFrame
+def timed_render(self):
+    start = time.perf_counter()
+    render(self)
+    if received:
+        # Frames that brought data, including taking it from the worker
+        render_times.append(time.perf_counter() - start)
+        rendered.extend(received)
+        received.clear()
+T.MainWindow.renderFrame = timed_render
+
+class PaintWatcher(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and rendered:
+            now = time.perf_counter()
+            latencies.extend(now - t for t in rendered)
+            rendered.clear()
+        return False
+
+app = QtWidgets.QApplication(sys.argv[:1])
+win = T.MainWindow()
+win.show()
+watcher = PaintWatcher()
+
+def begin():
+    # The simulator is listed once the background device search is done
+    if win.devCombobox.findText('simulator') < 0:
+        QtCore.QTimer.singleShot(50, begin)
+        return
+    win.devCombobox.setCurrentText('simulator')
+    win.modesCombobox.setCurrentText(mode)
+    win.integrationSpinBox.setValue(int_ms)
+    win.streamCheckbox.setChecked(option == 'continuous')
+    win.pipelinedCheckbox.setChecked(option == 'pipelined')
+    win._logfile_name = logfile
+    win.log_flag = True
+    acquired.append(time.perf_counter())
+    win.liveStart()
+    if mode == 'g2':
+        win.tabs.setCurrentWidget(win.tab2)
+        plot = win.tdcPlot2
+    else:
+        for button in (win.radio1_Button, win.radio2_Button, win.radio3_Button, win.radio4_Button):
+            button.setChecked(True)
+        plot = win.tdcPlot
+    plot.viewport().installEventFilter(watcher)
+    QtCore.QTimer.singleShot(int(duration * 1000), end)
+
+def end():
+    count = sum(samples)
+    elapsed = time.perf_counter() - acquired[0]
+    win.liveStart() # Live Stop; waits for the worker, which closes the logfile
+    log_bytes = sum(os.path.getsize(f) for f in (logfile, os.path.splitext(logfile)[0] + '.tdc1raw') \
+        if os.path.exists(f))
+    gui_time = sum(render_times)
+    percentiles = np.percentile(latencies, [50, 90, 99]) * 1e3 if latencies else [float('nan')] * 3
+    print(json.dumps({
+        'mode': (mode + ' ' + option).strip(),
+        'int_time_ms': int_ms,
+        'samples': count,
+        'samples_per_s': count / elapsed,
+        'duty_cycle': count * int_ms * 1e-3 / elapsed,
+        'latency_p50_ms': percentiles[0],
+        'latency_p90_ms': percentiles[1],
+        'latency_p99_ms': percentiles[2],
+        'latency_max_ms': max(latencies) * 1e3 if latencies else float('nan'),
+        'gui_ms_per_update': gui_time / max(count, 1) * 1e3,
+        'ingest_p99_ms': float(np.percentile(ingest_times, 99)) * 1e3 if ingest_times else float('nan'),
+        'frames': len(render_times),
+        'log_bytes_per_s': log_bytes / elapsed,
+    }))
+    app.quit()
+
+QtCore.QTimer.singleShot(0, begin)
+QtCore.QTimer.singleShot(int(duration * 1000) + 30000, app.quit) # In case the run never starts
+app.exec_()
+win.cleanUp()
+'''
+
+
+def bench_pipeline(int_times = (1, 10, 100, 1000), modes = ('singles', 'pairs', 'g2', 'g2 continuous'), \
+    duration: float = 3.0, platform: str = None):
+    """[summary]
+    Full chain against the simulated device, one fresh GUI process per mode and integration time: acquisition loop,
+    the hand-over to the GUI, renderFrame, the plot's paint and the logfile. Reports samples/s, duty cycle (acquired
+    time / wall time), hand-over-to-paint latency percentiles, GUI-thread time per update (its share of the frames that
+    brought data) and logfile bytes/s.
+
+    Args:
+        int_times (sequence): Integration times in ms.
+        modes (sequence): GUI modes; 'g2 continuous' is g2 with the Continuous box ticked, 'singles pipelined' and
+            'pairs pipelined' have the Pipelined box ticked.
+        duration (float): Seconds per run; extended to at least three integration times.
+    """
+    env = dict(os.environ)
+    if platform:
+        env['QT_QPA_PLATFORM'] = platform
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = here + os.pathsep + env.get('PYTHONPATH', '')
+    runs = []
+    with tempfile.TemporaryDirectory() as folder:
+        for mode in modes:
+            for int_ms in int_times:
+                logfile = os.path.join(folder, f'{mode.replace(" ", "_")}_{int_ms}.csv')
+                seconds = max(duration, 3 * int_ms * 1e-3 + 0.5)
+                name, _, option = mode.partition(' ')
+                output = subprocess.run([sys.executable, '-c', _PIPELINE_SCRIPT, name, str(int_ms), str(seconds), \
+                    option, logfile], env=env, cwd=here, capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads([line for line in output.splitlines() if line.startswith('{')][-1]))
+    return {'runs': runs}
+
+
+class _TimedAcquisition(Acquisition):
+    # Keeps the time of every counts acquisition
+    def __init__(self):
+        super(_TimedAcquisition, self).__init__()
+        self.times = []
+
+    def on_counts(self, start: float, now: float, data: tuple, dev_mode: str):
+        self.times.append(now)
+
+
+def _python_load(seconds: float):
+    # Pure-Python work that holds the GIL, as updating many Qt/pyqtgraph items does; None just waits
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        sum(i * i for i in range(1000))
+
+
+def _acquisition_times(separate_process: bool, load: bool, int_ms: int, duration: float, logfile: str):
+    # Times of the singles acquisitions of one run against the simulator, with or without load in this thread
+    wait = _python_load if load else time.sleep
+    if separate_process:
+        process = AcquisitionProcess('simulator', 'singles', 'NIM')
+        process.start(int_ms * 1e-3, logfile, True, 1, 3, 0, 2)
+        times = []
+        while not times:
+            # Start-up of the child is not measured
+            time.sleep(0.01)
+            block = process.counts.swap()
+            times = list(block.view()[0]) if block is not None else []
+        wait(duration)
+        block = process.counts.swap()
+        process.stop()
+        process.close()
+        return times + (list(block.view()[0]) if block is not None else [])
+    acquisition = _TimedAcquisition()
+    thread = threading.Thread(target=acquisition.log_which_data, args=(int_ms * 1e-3, logfile, 'simulator', True, \
+        'singles', open_device('simulator'), 1, 3, 0, 2))
+    thread.start()
+    wait(duration)
+    acquisition.active_flag = False
+    thread.join()
+    return acquisition.times
+
+
+def bench_jitter(int_times = (10,), duration: float = 3.0):
+    """[summary]
+    Timing jitter of the acquisition loop (singles from the simulator, with a logfile) running in a thread of this
+    process, as logWorker does, and in a separate process (tdc1_process), each with and without a pure-Python load in
+    the main thread standing in for heavy plotting. Jitter is how far each interval between acquisitions is from the
+    median interval; reported as its p50, p99 and max, with the standard deviation of the intervals, in ms.
+
+    Args:
+        int_times (sequence): Integration times in ms.
+        duration (float): Seconds per run.
+    """
+    runs = []
+    with tempfile.TemporaryDirectory() as folder:
+        for int_ms in int_times:
+            for separate_process in (False, True):
+                for load in (False, True):
+                    times = _acquisition_times(separate_process, load, int_ms, duration, \
+                        os.path.join(folder, f'jitter_{int_ms}_{int(separate_process)}{int(load)}.csv'))
+                    intervals = np.diff(times)[1:] * 1e3 # The first acquisition includes opening the device
+                    jitter = np.abs(intervals - np.median(intervals))
+                    runs.append({
+                        'acquisition': 'process' if separate_process else 'thread',
+                        'load': 'python' if load else 'none',
+                        'int_time_ms': int_ms,
+                        'samples': len(intervals),
+                        'interval_ms': float(np.median(intervals)),
+                        'jitter_p50_ms': float(np.percentile(jitter, 50)),
+                        'jitter_p99_ms': float(np.percentile(jitter, 99)),
+                        'jitter_max_ms': float(jitter.max()),
+                        'std_ms': float(intervals.std()),
+                    })
+    return {'runs': runs}
+
+
+BENCHMARKS = {
+    'correlation': bench_correlation,
+    'rawlog': bench_rawlog,
+    'startup': bench_startup,
+    'pipeline': bench_pipeline,
+    'jitter': bench_jitter,
+}
+
+
+def _print_results(name: str, result: dict):
+    print(name)
+    for key, value in result.items():
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            # One row per run
+            columns = list(value[0])
+            print('    ' + ' '.join(f'{c:>16}' for c in columns))
+            for row in value:
+                print('    ' + ' '.join(f'{row[c]:>16.4g}' if isinstance(row[c], float) else f'{row[c]:>16}' \
+                    for c in columns))
+        else:
+            print(f'    {key:<24}{value:.4g}' if isinstance(value, float) else f'    {key:<24}{value}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the TDC1 GUI, runnable without a device.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'])
+    parser.add_argument('--events', type=int, default=1000000, help='Events per batch for the correlation and rawlog benchmarks')
+    parser.add_argument('--bins', type=int, default=501)
+    parser.add_argument('--bin-width', type=int, default=2, help='Bin width in ns')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the fastest one is reported')
+    parser.add_argument('--platform', help="Qt platform for the GUI benchmarks, eg. 'offscreen' with no display")
+    parser.add_argument('--int-times', type=int, nargs='+', default=[1, 10, 100, 1000], \
+        help='Integration times in ms for the pipeline and jitter benchmarks')
+    parser.add_argument('--modes', nargs='+', default=['singles', 'pairs', 'g2', 'g2-continuous'], \
+        choices=['singles', 'pairs', 'g2', 'g2-continuous', 'singles-pipelined', 'pairs-pipelined'], \
+        help='GUI modes for the pipeline benchmark')
+    parser.add_argument('--duration', type=float, default=3.0, help='Seconds per pipeline or jitter run')
+    parser.add_argument('--json', metavar='FILE', help="Write the results as JSON to FILE ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    options = {
+        'correlation': dict(events=args.events, bins=args.bins, bin_width=args.bin_width, repeat=args.repeat),
+        'rawlog': dict(events=args.events, bins=args.bins, bin_width=args.bin_width, repeat=args.repeat),
+        'startup': dict(repeat=args.repeat, platform=args.platform),
+        'pipeline': dict(int_times=args.int_times, modes=[m.replace('-', ' ') for m in args.modes], \
+            duration=args.duration, platform=args.platform),
+        'jitter': dict(int_times=args.int_times, duration=args.duration),
+    }
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](**options.get(name, {}))
+        if args.json != '-':
+            _print_results(name, results[name])
+
+    if args.json:
+        report = {'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+    return 0 if all(r.get('identical', True) for r in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
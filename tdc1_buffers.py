@@ -0,0 +1,832 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Preallocated NumPy containers for the data shown by the TDC1 GUI. Nothing in here depends on Qt.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    """[summary]
+    Fixed-capacity history of samples: a time column plus a (channels, capacity) block of values.
+
+    Every sample is stored twice, at position i and i + capacity, so the most recent samples are always one contiguous
+    slice of the storage. view() therefore hands pyqtgraph plain slices and append() never allocates.
+
+    Args:
+        channels (int): Number of values per sample.
+        capacity (int): Number of samples kept. Older samples are overwritten.
+    """
+
+    def __init__(self, channels: int = 4, capacity: int = 501, dtype = np.float64):
+        self.channels = channels
+        self.dtype = dtype
+        self._allocate(max(1, int(capacity)))
+
+    def _allocate(self, capacity: int):
+        self.capacity = capacity
+        self._time = np.zeros(2 * capacity, dtype=np.float64)
+        self._data = np.zeros((self.channels, 2 * capacity), dtype=self.dtype)
+        self._head = 0 # Index of the oldest sample in the first half of the storage
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, t: float, values):
+        """[summary]
+        Adds one sample, dropping the oldest one if the buffer is full.
+
+        Args:
+            t (float): Time of the sample.
+            values (sequence): At least `channels` values; extra values are ignored.
+        """
+        cap = self.capacity
+        if self._size < cap:
+            i = self._size
+            self._size += 1
+        else:
+            i = self._head
+            self._head = (self._head + 1) % cap
+        self._time[i] = t
+        self._time[i + cap] = t
+        for ch in range(self.channels):
+            self._data[ch, i] = values[ch]
+            self._data[ch, i + cap] = values[ch]
+
+    def extend(self, times, values):
+        """[summary]
+        Adds a block of samples at once, as append() would one by one.
+
+        Args:
+            times (np.ndarray): Times of the samples.
+            values (np.ndarray): Shape (at least `channels`, len(times)); extra rows are ignored.
+        """
+        cap = self.capacity
+        n = len(times)
+        if n > cap:
+            times = times[n - cap:]
+            values = values[:, n - cap:]
+            n = cap
+        start = self._head + self._size if self._size < cap else self._head
+        size = min(cap, self._size + n)
+        self._head = (self._head + self._size + n - size) % cap
+        self._size = size
+        # At most two contiguous runs of slots, each written to both halves of the storage
+        first = min(n, cap - start)
+        for i, j, k in ((start, 0, first), (0, first, n)):
+            if k > j:
+                for offset in (i, i + cap):
+                    self._time[offset:offset + k - j] = times[j:k]
+                    self._data[:, offset:offset + k - j] = values[:self.channels, j:k]
+
+    def view(self):
+        """[summary]
+        Returns (time, data): views of the stored samples, oldest first. data has shape (channels, len(self)).
+        The views are only valid until the next append/resize/clear.
+        """
+        start = self._head
+        stop = start + self._size
+        return self._time[start:stop], self._data[:, start:stop]
+
+    def last(self):
+        """[summary]
+        Returns (time, values) of the most recent sample, or None if empty.
+        """
+        if self._size == 0:
+            return None
+        i = self._head + self._size - 1
+        return self._time[i], self._data[:, i]
+
+    def resize(self, capacity: int):
+        """[summary]
+        Changes the capacity, keeping the most recent samples that still fit.
+        """
+        capacity = max(1, int(capacity))
+        if capacity == self.capacity:
+            return
+        t, data = self.view()
+        keep = min(self._size, capacity)
+        t = t[len(t) - keep:].copy()
+        data = data[:, data.shape[1] - keep:].copy()
+        self._allocate(capacity)
+        self._time[:keep] = t
+        self._time[capacity:capacity + keep] = t
+        self._data[:, :keep] = data
+        self._data[:, capacity:capacity + keep] = data
+        self._size = keep
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+
+class _PyramidLevel:
+    # Growable storage for one level of MinMaxPyramid. Level 0 keeps the raw values in both min and max.
+    def __init__(self, channels: int, capacity: int, raw: bool):
+        self.size = 0
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.min = np.empty((channels, capacity), dtype=np.float32)
+        self.max = self.min if raw else np.empty((channels, capacity), dtype=np.float32)
+
+    def grow(self):
+        capacity = 2 * len(self.time)
+        self.time = np.resize(self.time, capacity)
+        raw = self.max is self.min
+        self.min = np.concatenate((self.min, np.empty_like(self.min)), axis=1)
+        self.max = self.min if raw else np.concatenate((self.max, np.empty_like(self.max)), axis=1)
+
+
+class MinMaxPyramid:
+    """[summary]
+    Whole-run history of samples with min/max decimation levels, for drawing long runs at screen resolution.
+
+    Level 0 holds every sample. Each entry of level k summarises `factor` entries of level k - 1 by their start time,
+    minimum and maximum, and is added as soon as those entries are complete, so building costs O(1) per sample.
+    query() picks the finest level with no more than about one entry per pixel in the requested time range and draws
+    every entry as a vertical min-max segment, so single-sample spikes remain visible at any zoom.
+
+    Args:
+        channels (int): Number of values per sample.
+        factor (int): Number of entries merged into one entry of the next level.
+    """
+
+    def __init__(self, channels: int = 4, factor: int = 4, capacity: int = 4096):
+        self.channels = channels
+        self.factor = factor
+        self._capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self.levels = [_PyramidLevel(self.channels, self._capacity, raw=True)]
+
+    def __len__(self):
+        return self.levels[0].size
+
+    def append(self, t: float, values):
+        """[summary]
+        Adds one sample and completes any decimated entries it finishes.
+        """
+        level = self.levels[0]
+        if level.size == len(level.time):
+            level.grow()
+        i = level.size
+        level.time[i] = t
+        for ch in range(self.channels):
+            level.min[ch, i] = values[ch]
+        level.size += 1
+        k = 0
+        while level.size % self.factor == 0:
+            # A block of `factor` entries is complete: summarise it one level up
+            if k + 1 == len(self.levels):
+                self.levels.append(_PyramidLevel(self.channels, max(16, len(level.time) // self.factor), raw=False))
+            parent = self.levels[k + 1]
+            if parent.size == len(parent.time):
+                parent.grow()
+            start = level.size - self.factor
+            j = parent.size
+            parent.time[j] = level.time[start]
+            parent.min[:, j] = level.min[:, start:level.size].min(axis=1)
+            parent.max[:, j] = level.max[:, start:level.size].max(axis=1)
+            parent.size += 1
+            level = parent
+            k += 1
+
+    def extend(self, times, values):
+        """[summary]
+        Adds a block of samples at once; same result as append() for each of them.
+
+        Args:
+            times (np.ndarray): Times of the samples.
+            values (np.ndarray): Shape (at least `channels`, len(times)); extra rows are ignored.
+        """
+        n = len(times)
+        level = self.levels[0]
+        while level.size + n > len(level.time):
+            level.grow()
+        level.time[level.size:level.size + n] = times
+        level.min[:, level.size:level.size + n] = values[:self.channels]
+        level.size += n
+        k = 0
+        # Every level k + 1 has one entry per complete block of `factor` entries of level k
+        while level.size >= self.factor:
+            if k + 1 == len(self.levels):
+                self.levels.append(_PyramidLevel(self.channels, max(16, len(level.time) // self.factor), raw=False))
+            parent = self.levels[k + 1]
+            m = level.size // self.factor - parent.size
+            if m <= 0:
+                break
+            while parent.size + m > len(parent.time):
+                parent.grow()
+            first = parent.size * self.factor
+            last = first + m * self.factor
+            parent.time[parent.size:parent.size + m] = level.time[first:last:self.factor]
+            parent.min[:, parent.size:parent.size + m] = \
+                level.min[:, first:last].reshape(self.channels, m, self.factor).min(axis=2)
+            parent.max[:, parent.size:parent.size + m] = \
+                level.max[:, first:last].reshape(self.channels, m, self.factor).max(axis=2)
+            parent.size += m
+            level = parent
+            k += 1
+
+    def choose_level(self, t0: float, t1: float, pixels: int):
+        """[summary]
+        Returns the finest level index with no more than `pixels` entries between t0 and t1. Level 0 is used as long
+        as the raw samples fit, so zooming in shows the actual data.
+        """
+        for k, level in enumerate(self.levels):
+            times = level.time[:level.size]
+            n = np.searchsorted(times, t1, side='right') - np.searchsorted(times, t0, side='left')
+            if n <= pixels:
+                return k
+        return len(self.levels) - 1
+
+    def query(self, t0: float, t1: float, pixels: int):
+        """[summary]
+        Returns (time, data) covering t0..t1 with roughly 2 * pixels points per channel. data has shape
+        (channels, n). The entry just outside each end of the range is included so lines run to the plot edges.
+
+        Args:
+            t0, t1 (float): Visible time range.
+            pixels (int): Width of the plot in pixels.
+        """
+        if len(self) == 0:
+            return np.empty(0), np.empty((self.channels, 0), dtype=np.float32)
+        k = self.choose_level(t0, t1, max(1, pixels))
+        times = []
+        values = []
+        stop = None
+        # Entries of level k in range, then the not yet decimated tail of each finer level down to the raw samples
+        for level_index in range(k, -1, -1):
+            level = self.levels[level_index]
+            start = 0 if stop is None else stop * self.factor
+            first = max(start, np.searchsorted(level.time[:level.size], t0, side='left') - 1)
+            last = min(level.size, np.searchsorted(level.time[:level.size], t1, side='right') + 1)
+            stop = level.size
+            if last <= first:
+                continue
+            t = level.time[first:last]
+            if level_index == 0:
+                times.append(t)
+                values.append(level.min[:, first:last])
+            else:
+                # Two points per entry, at the same time: a vertical segment from min to max
+                times.append(np.repeat(t, 2))
+                segment = np.empty((self.channels, 2 * (last - first)), dtype=np.float32)
+                segment[:, 0::2] = level.min[:, first:last]
+                segment[:, 1::2] = level.max[:, first:last]
+                values.append(segment)
+        if not times:
+            return np.empty(0), np.empty((self.channels, 0), dtype=np.float32)
+        return np.concatenate(times), np.concatenate(values, axis=1)
+
+
+class RunningStatistics:
+    """[summary]
+    Whole-run statistics of the count rate of every channel, updated as blocks of samples arrive: mean and standard
+    deviation (Welford's algorithm, merged a block at a time) and the non-overlapping Allan deviation at octave
+    averaging times tau0, 2 tau0, 4 tau0... Memory is O(1) per tau level, whatever the length of the run.
+
+    Level k keeps the average of its unfinished group of 2^k samples (at most one finished group of level k - 1), the
+    last finished group average and the sum of squared differences between consecutive group averages. A level is
+    added once the first group of the level below finishes, so there is one level per octave of the run length.
+
+    Args:
+        channels (int): Number of values per sample.
+        max_levels (int): Octaves of tau kept (2^max_levels samples is far longer than any run).
+    """
+
+    def __init__(self, channels: int = 8, max_levels: int = 40):
+        self.channels = channels
+        self.max_levels = max_levels
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.mean = np.zeros(self.channels, dtype=np.float64)
+        self._m2 = np.zeros(self.channels, dtype=np.float64) # Sum of squared deviations from the mean
+        self._reset_allan(0.0)
+
+    def _reset_allan(self, tau0: float):
+        self.tau0 = tau0
+        self._pending = [] # Per level: average of the unfinished group's first half, or None
+        self._previous = [] # Per level: last finished group average, or None
+        self._sum_sq = [] # Per level: sum of squared differences of consecutive group averages
+        self._diffs = [] # Per level: number of those differences
+
+    def add(self, counts, tau0: float):
+        """[summary]
+        Adds samples of counts per integration window. The Allan deviation restarts if the integration time changes.
+
+        Args:
+            counts (np.ndarray): One row per channel and one column per sample. Missing rows count as zero.
+            tau0 (float): Integration time of the samples in seconds.
+        """
+        counts = np.asarray(counts)[:self.channels]
+        n = counts.shape[1]
+        if not n:
+            return
+        rates = np.zeros((n, self.channels), dtype=np.float64) # One row per sample
+        rates[:, :len(counts)] = counts.T / tau0
+        # Chan et al.'s pairwise update: merge the block's mean and squared deviations into the running ones
+        block_mean = rates.mean(axis=0)
+        delta = block_mean - self.mean
+        total = self.count + n
+        self._m2 += ((rates - block_mean) ** 2).sum(axis=0) + delta ** 2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        if tau0 != self.tau0:
+            self._reset_allan(tau0)
+        groups = rates # Finished group averages of the current level, oldest first
+        k = 0
+        while len(groups) and k < self.max_levels:
+            if k == len(self._previous):
+                self._pending.append(None)
+                self._previous.append(None)
+                self._sum_sq.append(np.zeros(self.channels, dtype=np.float64))
+                self._diffs.append(0)
+            sequence = groups if self._previous[k] is None else np.vstack((self._previous[k], groups))
+            self._sum_sq[k] += (np.diff(sequence, axis=0) ** 2).sum(axis=0)
+            self._diffs[k] += len(sequence) - 1
+            self._previous[k] = groups[-1]
+            # Pairs of this level's groups are the next level's groups
+            if self._pending[k] is not None:
+                groups = np.vstack((self._pending[k], groups))
+            self._pending[k] = groups[-1] if len(groups) % 2 else None
+            groups = (groups[0:len(groups) - 1:2] + groups[1::2]) / 2
+            k += 1
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else np.zeros(self.channels)
+
+    def allan_deviation(self):
+        """[summary]
+        Allan deviation of the rates at every averaging time that has at least one difference.
+
+        Returns:
+            tuple: (taus, adev): averaging times in seconds and a (len(taus), channels) array in counts/s.
+        """
+        levels = [k for k, d in enumerate(self._diffs) if d > 0]
+        taus = np.array([self.tau0 * 2 ** k for k in levels])
+        adev = np.array([np.sqrt(self._sum_sq[k] / (2 * self._diffs[k])) for k in levels]).reshape(len(levels), \
+            self.channels)
+        return taus, adev
+
+
+class SampleBlock:
+    """[summary]
+    Preallocated block of samples (a time plus up to `channels` values each) that the acquisition worker fills one
+    sample at a time and the GUI reads as a whole through a DoubleBuffer. Only grows (doubling) if the GUI falls behind
+    by more than `capacity` samples.
+
+    Args:
+        channels (int): Maximum number of values per sample. Shorter samples leave the remaining rows zero.
+        capacity (int): Initial number of samples.
+    """
+
+    def __init__(self, channels: int = 8, capacity: int = 1024):
+        self.channels = channels
+        self.times = np.zeros(max(1, int(capacity)), dtype=np.float64)
+        self.values = np.zeros((channels, len(self.times)), dtype=np.int64)
+        self.start = 0.0 # Start time of the run the samples belong to
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        self.times = np.concatenate((self.times, np.zeros_like(self.times)))
+        self.values = np.concatenate((self.values, np.zeros_like(self.values)), axis=1)
+
+    def add(self, t: float, values):
+        i = self._size
+        if i == len(self.times):
+            self._grow()
+        self.times[i] = t
+        self.values[:len(values), i] = values
+        self._size += 1
+
+    def extend(self, times, values):
+        """[summary]
+        Adds several samples; values has one row per value and one column per sample.
+        """
+        i = self._size
+        n = len(times)
+        while i + n > len(self.times):
+            self._grow()
+        self.times[i:i + n] = times
+        self.values[:len(values), i:i + n] = values
+        self._size += n
+
+    def view(self):
+        """[summary]
+        Returns (times, values) of the stored samples, values with shape (channels, len(self)). Views, valid until
+        the block is cleared.
+        """
+        return self.times[:self._size], self.values[:, :self._size]
+
+    def clear(self):
+        self.values[:, :self._size] = 0
+        self._size = 0
+
+
+class HistogramBlock:
+    """[summary]
+    Sum of the g2 histograms of one or more acquisitions, handed from the acquisition worker to the GUI through a
+    DoubleBuffer. histograms has one row for count_g2 data and one per channel pair (CHANNEL_PAIRS order) for the
+    continuous g2.
+
+    Args:
+        rows (int): Number of histograms.
+        bins (int): Number of bins.
+    """
+
+    def __init__(self, rows: int = 1, bins: int = 501):
+        self.histograms = np.zeros((rows, bins), dtype=np.int64)
+        self.bin_width = None
+        self.acquisitions = 0
+        self.first = 0.0 # time.time() of the first acquisition in the block
+
+    def add(self, histograms, bin_width: int, t: float):
+        """[summary]
+        Adds one acquisition.
+
+        Args:
+            histograms (np.ndarray): One histogram, or one row per channel pair.
+            bin_width (int): Bin width the histograms were taken with.
+            t (float): time.time() of the acquisition.
+        """
+        histograms = np.asarray(histograms)
+        if histograms.ndim == 1:
+            histograms = histograms[np.newaxis]
+        if histograms.shape != self.histograms.shape or bin_width != self.bin_width:
+            # The settings changed: acquisitions taken with the old ones cannot be added to, so they are dropped
+            if histograms.shape != self.histograms.shape:
+                self.histograms = np.zeros(histograms.shape, dtype=np.int64)
+            else:
+                self.histograms[:] = 0
+            self.bin_width = bin_width
+            self.acquisitions = 0
+        if self.acquisitions == 0:
+            self.first = t
+        self.histograms += histograms
+        self.acquisitions += 1
+
+    def clear(self):
+        self.histograms[:] = 0
+        self.acquisitions = 0
+
+
+class DoubleBuffer:
+    """[summary]
+    Two preallocated buffers (eg. SampleBlocks) shared by one writer thread and one reader thread, so data is handed
+    over without signals, copies or allocations per update.
+
+    The writer adds to the back buffer inside `with exchange.write() as back:`; every write increments `sequence`. The
+    reader calls swap() when it is ready for data (the GUI does so once per frame): if sequence has moved, the back
+    buffer becomes the front buffer and is returned. The reader may use it until its next swap(), when it is cleared and
+    becomes the back buffer again. The lock is only held while writing and for the swap itself, never while the reader
+    is using the data, and checking for new data needs no lock at all.
+
+    Args:
+        factory (callable): Returns an empty buffer. Buffers need a clear() method.
+    """
+
+    def __init__(self, factory):
+        self._front = factory()
+        self._back = factory()
+        self._lock = threading.Lock()
+        self.sequence = 0 # Number of writes so far
+        self._swapped = 0 # sequence at the last swap
+
+    @contextlib.contextmanager
+    def write(self):
+        with self._lock:
+            yield self._back
+            self.sequence += 1
+
+    def swap(self):
+        """[summary]
+        Returns the buffer with everything written since the last swap, or None if nothing was.
+        """
+        if self.sequence == self._swapped:
+            return None
+        self._front.clear() # The reader is done with it
+        with self._lock:
+            self._front, self._back = self._back, self._front
+            self._swapped = self.sequence
+        return self._front
+
+
+RECENT_MAX_BUCKETS = 600 # Most rows in the ring of a sliding "recent" g2
+RECENT_MAX_BYTES = 4 << 20 # Most memory for that ring, per accumulator
+
+
+class HistogramAccumulator:
+    """[summary]
+    Accumulated g2 histogram with int64 bins and a running total, plus an optional sliding "recent" g2 over the last
+    `window` add() calls.
+
+    The recent g2 is kept as a ring of partial sums (buckets) of several add() calls each, at most RECENT_MAX_BUCKETS
+    rows and RECENT_MAX_BYTES, so its memory does not grow with the window. A whole bucket is dropped at a time, so the
+    recent g2 covers the last `window` add() calls less up to one bucket (exactly `window` if buckets hold one call).
+
+    Totals are updated from each increment only, never by summing the whole accumulated array. If the number of bins
+    changes with the same bin width, bins keep their delays, so the histogram is extended with zeros or its tail is
+    dropped (and the total adjusted). A different bin width makes the old bins meaningless and restarts accumulation.
+
+    Args:
+        bins (int): Number of bins.
+        bin_width (int): Bin width in ns.
+        window (int): Number of recent add() calls kept for the sliding histogram. 0 disables it.
+    """
+
+    def __init__(self, bins: int = 501, bin_width: int = 2, window: int = 0):
+        self.bin_width = bin_width
+        self.window = max(0, int(window))
+        self._reset(bins)
+
+    def _reset(self, bins: int):
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.total = 0
+        self.acquisitions = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        bins = len(self.histogram)
+        max_buckets = max(1, min(RECENT_MAX_BUCKETS, RECENT_MAX_BYTES // (8 * max(bins, 1))))
+        self.bucket_size = max(1, -(-self.window // max_buckets)) # add() calls summed in one bucket
+        buckets = -(-self.window // self.bucket_size)
+        self._ring = np.zeros((buckets, bins), dtype=np.int64)
+        self._ring_totals = np.zeros(buckets, dtype=np.int64)
+        self._ring_index = 0 # Bucket being filled
+        self._ring_count = 1 # Buckets in use, including the one being filled
+        self._bucket_fill = 0 # add() calls in the bucket being filled
+        self.recent = np.zeros(bins, dtype=np.int64)
+        self.recent_total = 0
+
+    @property
+    def bins(self):
+        return len(self.histogram)
+
+    def time_bins(self):
+        """[summary]
+        Delay of the start of each bin in ns.
+        """
+        return np.arange(self.bins, dtype=np.int64) * self.bin_width
+
+    def add(self, incremental, bin_width: int = None, acquisitions: int = 1):
+        """[summary]
+        Adds one acquisition's histogram, or the sum of several. The recent window counts calls to add().
+
+        Args:
+            incremental (np.ndarray): Counts per bin from count_g2.
+            bin_width (int): Bin width the histogram was taken with, if it may have changed.
+            acquisitions (int): Number of acquisitions summed in incremental.
+        """
+        incremental = np.asarray(incremental)
+        if bin_width is not None and bin_width != self.bin_width:
+            print(f'Bin width changed from {self.bin_width} to {bin_width} ns, restarting g2 accumulation.')
+            self.bin_width = bin_width
+            self._reset(len(incremental))
+        elif len(incremental) != self.bins:
+            self.resize(len(incremental))
+        self.histogram += incremental
+        increment_total = int(incremental.sum())
+        self.total += increment_total
+        self.acquisitions += acquisitions
+        if self.window:
+            if self._bucket_fill == self.bucket_size:
+                # Move on to the next bucket, dropping the oldest whole bucket once the ring is full
+                i = (self._ring_index + 1) % len(self._ring)
+                if self._ring_count == len(self._ring):
+                    self.recent -= self._ring[i]
+                    self.recent_total -= int(self._ring_totals[i])
+                    self._ring[i] = 0
+                    self._ring_totals[i] = 0
+                else:
+                    self._ring_count += 1
+                self._ring_index = i
+                self._bucket_fill = 0
+            i = self._ring_index
+            self._ring[i] += incremental
+            self._ring_totals[i] += increment_total
+            self.recent += incremental
+            self.recent_total += increment_total
+            self._bucket_fill += 1
+
+    def resize(self, bins: int):
+        """[summary]
+        Changes the number of bins, keeping the delay of every bin. The recent window restarts.
+        """
+        if bins < self.bins:
+            self.total -= int(self.histogram[bins:].sum())
+            self.histogram = self.histogram[:bins].copy()
+        else:
+            self.histogram = np.concatenate((self.histogram, np.zeros(bins - self.bins, dtype=np.int64)))
+        self._reset_window()
+
+    def set_window(self, window: int):
+        """[summary]
+        Changes how many recent acquisitions make up the sliding histogram. The recent window restarts.
+        """
+        self.window = max(0, int(window))
+        self._reset_window()
+
+    def restore(self, histogram, acquisitions: int):
+        """[summary]
+        Replaces the accumulated histogram, eg. with one read back from a HistogramCheckpoint. The recent window
+        restarts.
+        """
+        self.histogram = np.array(histogram, dtype=np.int64)
+        self.total = int(self.histogram.sum())
+        self.acquisitions = int(acquisitions)
+        self._reset_window()
+
+    def clear(self):
+        self._reset(self.bins)
+
+
+CHECKPOINT_MAGIC = b'TDC1G2CK'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER_BYTES = 4096 # Histograms start on a page boundary, so a bin's page is the same in file and memory
+CHECKPOINT_FLUSH_INTERVAL = 10.0 # Seconds between msyncs of the dirty pages
+CHECKPOINT_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('rows', '<u4'), ('bins', '<u8'), \
+    ('bin_width', '<i8'), ('ch_start', '<i8'), ('ch_stop', '<i8'), ('pair_delays', '<i8', (4, 4)), \
+    ('acquisitions', '<i8', (16,)), ('updated', '<f8')])
+
+
+class HistogramCheckpoint:
+    """[summary]
+    Accumulated g2 histograms kept in a memory-mapped file, so they survive a crash or an accidental Clear Data.
+    Clearing the g2 sets the checkpoint aside (set_aside) as `<file_name>.prev` instead of letting the next update()
+    overwrite it; swap_previous() brings it back.
+    The file is a page-sized header (bin width, channels, pair delays, acquisitions per row) followed by a
+    (rows, bins) int64 array: one row for the displayed pair, or one per channel pair (CHANNEL_PAIRS order) with the
+    continuous g2.
+
+    update() adds only the non-zero bins of each increment, so only the pages they fall in are dirtied, and flush()
+    (msync, every flush_interval seconds from update()) writes just those pages back. Writes to the mapping are in the
+    OS page cache straight away, so a crash of the program itself loses nothing. The whole file is only rewritten
+    when its layout changes (number of rows or bins, bin width), replacing the old one atomically.
+
+    Args:
+        file_name (str): Checkpoint file.
+        flush_interval (float): Seconds between flushes done by update(). 0 flushes on every update.
+    """
+
+    def __init__(self, file_name: str, flush_interval: float = CHECKPOINT_FLUSH_INTERVAL):
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self._header = None
+        self._histograms = None
+        self._last_flush = 0.0
+
+    @property
+    def attached(self):
+        return self._histograms is not None
+
+    def exists(self):
+        return os.path.isfile(self.file_name)
+
+    @property
+    def previous_name(self):
+        return self.file_name + '.prev'
+
+    def has_previous(self):
+        return os.path.isfile(self.previous_name)
+
+    def set_aside(self):
+        """[summary]
+        Detaches and keeps the checkpoint as previous_name, replacing the one set aside before, so the next update()
+        starts a new file instead of overwriting it.
+        """
+        self.close()
+        if self.exists():
+            os.replace(self.file_name, self.previous_name)
+
+    def swap_previous(self):
+        """[summary]
+        Detaches and exchanges the checkpoint with the one set aside, so load() reads the set-aside g2 and the current
+        one is set aside in its place.
+        """
+        self.close()
+        if not self.has_previous():
+            return
+        if self.exists():
+            swap_name = self.file_name + '.swap'
+            os.replace(self.file_name, swap_name)
+            os.replace(self.previous_name, self.file_name)
+            os.replace(swap_name, self.previous_name)
+        else:
+            os.replace(self.previous_name, self.file_name)
+
+    def load(self):
+        """[summary]
+        Opens an existing checkpoint and attaches to it, so later updates add to it.
+
+        Returns:
+            dict: bin_width, ch_start, ch_stop, pair_delays (4 x 4), acquisitions (per row), histograms (rows x bins,
+                a copy) and updated (Unix time of the last update), or None if there is no valid checkpoint.
+        """
+        self.close()
+        try:
+            header = np.memmap(self.file_name, dtype=CHECKPOINT_HEADER_DTYPE, mode='r+', shape=(1,))
+        except (OSError, ValueError):
+            return None
+        rows, bins = int(header['rows'][0]), int(header['bins'][0])
+        if header['magic'][0] != CHECKPOINT_MAGIC or header['version'][0] != CHECKPOINT_VERSION or \
+                not 0 < rows <= 16 or os.path.getsize(self.file_name) != CHECKPOINT_HEADER_BYTES + rows * bins * 8:
+            return None
+        self._header = header
+        self._histograms = np.memmap(self.file_name, dtype='<i8', mode='r+', offset=CHECKPOINT_HEADER_BYTES, \
+            shape=(rows, bins))
+        self._last_flush = time.monotonic()
+        h = header[0]
+        return {'bin_width': int(h['bin_width']), 'ch_start': int(h['ch_start']), 'ch_stop': int(h['ch_stop']), \
+            'pair_delays': np.array(h['pair_delays']), 'acquisitions': h['acquisitions'][:rows].tolist(), \
+            'histograms': np.array(self._histograms), 'updated': float(h['updated'])}
+
+    def update(self, accumulators: list, increments, ch_start: int, ch_stop: int, pair_delays):
+        """[summary]
+        Records the histograms that were just added to the accumulators. The checkpoint must hold what the
+        accumulators held before the increments (it does after load() or a previous update); if it is not attached or
+        its layout differs, the accumulators are written out whole instead.
+
+        Args:
+            accumulators (list): HistogramAccumulator per row, after their add().
+            increments (np.ndarray): (rows, bins) histograms that were added.
+            ch_start (int): Displayed start channel.
+            ch_stop (int): Displayed stop channel.
+            pair_delays (np.ndarray): 4 x 4 offsets of the (start, stop) pairs in ns.
+        """
+        rows, bins, bin_width = len(accumulators), accumulators[0].bins, accumulators[0].bin_width
+        if not self.attached or self._histograms.shape != (rows, bins) or \
+                self._header['bin_width'][0] != bin_width or any(a.bin_width != bin_width for a in accumulators):
+            self._write(accumulators)
+        else:
+            for row, increment in zip(self._histograms, increments):
+                increment = np.asarray(increment)
+                touched = np.flatnonzero(increment)
+                row[touched] += increment[touched]
+        header = self._header[0]
+        header['acquisitions'][:rows] = [a.acquisitions for a in accumulators]
+        header['ch_start'], header['ch_stop'] = ch_start, ch_stop
+        header['pair_delays'] = pair_delays
+        header['updated'] = time.time()
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write(self, accumulators: list):
+        self.close()
+        rows, bins = len(accumulators), accumulators[0].bins
+        header = np.zeros(1, dtype=CHECKPOINT_HEADER_DTYPE)
+        header['magic'], header['version'] = CHECKPOINT_MAGIC, CHECKPOINT_VERSION
+        header['rows'], header['bins'], header['bin_width'] = rows, bins, accumulators[0].bin_width
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+        part_name = self.file_name + '.part'
+        with open(part_name, 'wb') as f:
+            f.write(header.tobytes().ljust(CHECKPOINT_HEADER_BYTES, b'\0'))
+            for a in accumulators:
+                f.write(a.histogram.astype('<i8').tobytes())
+        os.replace(part_name, self.file_name)
+        self._header = np.memmap(self.file_name, dtype=CHECKPOINT_HEADER_DTYPE, mode='r+', shape=(1,))
+        self._histograms = np.memmap(self.file_name, dtype='<i8', mode='r+', offset=CHECKPOINT_HEADER_BYTES, \
+            shape=(rows, bins))
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        if self.attached:
+            self._header.flush()
+            self._histograms.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """[summary]
+        Flushes and detaches; the file stays for a later load(). The next update() rewrites it from its accumulators.
+        """
+        self.flush()
+        self._header = None
+        self._histograms = None
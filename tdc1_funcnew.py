@@ -22,6 +22,7 @@
 
 
 from os import stat
+import os
 import sys
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QMainWindow, QAction, qApp, QApplication, QMenu, \
@@ -35,10 +36,34 @@ import numpy as np
 from datetime import datetime
 import time
 
-from S15lib.instruments import usb_counter_fpga as tdc1
-from S15lib.instruments import serial_connection
+import importlib
 import serial
 
+from tdc1_logging import BINARY_LOG_EXTENSION, read_log, log_time_range, LogWriter
+from tdc1_buffers import RingBuffer, MinMaxPyramid, HistogramAccumulator, SampleBlock, HistogramBlock, DoubleBuffer, \
+    HistogramCheckpoint, RunningStatistics
+from tdc1_analysis import CHANNEL_PAIRS, fit_g2_peak, g2_peak_model, find_stop_delay, AUTO_DELAY_RANGE
+from tdc1_acquisition import Acquisition
+from tdc1_sim import SIMULATED_DEVICES, open_device
+from tdc1_metrics import METRICS, MetricsExporter
+from tdc1_process import AcquisitionProcess
+from tdc1_stream import capture_timestamps
+
+
+class _LazyModule:
+    # Stands in for a module until one of its attributes is first used. S15lib.instruments imports every S-Fifteen
+    # instrument driver (and their numerical dependencies), which is not needed until a device is opened.
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self._name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+tdc1 = _LazyModule('S15lib.instruments.usb_counter_fpga')
+serial_connection = _LazyModule('S15lib.instruments.serial_connection')
+
 """[summary]
     This is the GUI for the usb counter TDC1. It processes data from TDC1's three different modes - singles, pairs and timestamp - and displays
     the data in a live-updating graph.
@@ -49,182 +74,646 @@ import serial
 """
 
 
-PLT_SAMPLES = 501 # plot samples
+PLT_SAMPLES = 501 # default plot samples
+RENDER_FPS = 30 # maximum plot/label redraws per second
+COUNTS_BLOCK_SAMPLES = 1024 # initial capacity of the blocks counts are handed to the GUI in
+# Logfile rotation choices: (segment size in bytes, seconds between segments), see tdc1_logging.LogWriter
+LOG_ROTATIONS = {'No rotation': (0, 0), 'Rotate hourly': (0, 3600), 'Rotate daily': (0, 86400), \
+    'Rotate at 100 MB': (100 * 10**6, 0), 'Rotate at 1 GB': (10**9, 0)}
+G2_FIT_MIN_CHANGE = 0.01 # the g2 peak is refitted once the histogram total has grown by this fraction
+G2_FIT_HEADER = '#time_stamp,total,position_ns,fwhm_ns,height,background,g2_0' # columns of the g2 fit logfile
+AUTO_DELAY_TIME = 0.5 # seconds of timestamps Auto Delay searches for the stop channel delay
 
-class logWorker(QtCore.QObject):
+def new_counts_exchange():
+    return DoubleBuffer(lambda: SampleBlock(channels=8, capacity=COUNTS_BLOCK_SAMPLES))
+
+class logWorker(QtCore.QObject, Acquisition):
     """[summary]
     Worker object for threading the logging process to ensure the GUI does not freeze up while data is being logged and plotted.
+    The acquisition loops themselves are in tdc1_acquisition.Acquisition; this class passes on what their hooks receive.
+    Counts and g2 histograms are not sent as signals but written into DoubleBuffers shared with the GUI, which takes
+    whatever has arrived once per render frame. Nothing is copied or allocated per sample, however short the
+    integration time.
 
     Args:
-        QtCore (QObject): [description]
+        counts_exchange (DoubleBuffer): Of SampleBlocks, for the counts. A new one if not given.
+        g2_exchange (DoubleBuffer): Of HistogramBlocks, for the g2 histograms. A new one if not given.
     """
     # Worker Signals
-    data_is_logged = QtCore.pyqtSignal(float, float, tuple, str, list)
-    histogram_logged = QtCore.pyqtSignal(dict, int, int)
     coincidences_data_logged = QtCore.pyqtSignal('PyQt_PyObject') # Replace 'PyQt_PyObject' with object?
     thread_finished = QtCore.pyqtSignal('PyQt_PyObject')
-    permission_error = QtCore.pyqtSignal('PyQt_PyObject')
+    logfile_message = QtCore.pyqtSignal(str)
 
-    def __init__(self):
+    def __init__(self, counts_exchange: DoubleBuffer = None, g2_exchange: DoubleBuffer = None):
         super(logWorker, self).__init__()
-        self.active_flag = False
         self.radio_flags = [0,0,0,0] # 0 represents unchecked radio button, 1 for checked
-        self.int_time = 1
-        self.ch_start = 1
-        self.ch_stop = 3
-        self.bin_width = 2
-        self.bins = 501
-        self.offset = 0
-        self.runtime = 0
+        self.counts_exchange = counts_exchange if counts_exchange is not None else new_counts_exchange()
+        self.g2_exchange = g2_exchange if g2_exchange is not None else DoubleBuffer(HistogramBlock)
     
     # Connected to MainWindow.logging_requested
     @QtCore.pyqtSlot(float, str, str, bool, str, object, int, int, int, int)
     def log_which_data(self, int_time: float, file_name: str, device_path: str, log_flag: bool, \
         dev_mode: str, tdc1_dev: object, start: int, stop: int, offset: int, bin_width: int):
-        self.int_time = int_time
-        self.ch_start = start
-        self.ch_stop = stop
-        self.offset = offset
-        self.bin_width = bin_width
-        self.active_flag = True
-        if dev_mode == 'singles':
-            print('initiating singles log...')
-            self.log_counts_data(file_name, \
-        device_path, log_flag, dev_mode, tdc1_dev)
-        elif dev_mode == 'g2':
-            print('initiating g2 log...')
-            self.log_g2(file_name, device_path, log_flag, dev_mode, \
-                tdc1_dev)
-        elif dev_mode == 'pairs':
-            print('initiating pairs log')
-            self.log_coincidences_data(file_name, \
-        device_path, log_flag, dev_mode, tdc1_dev)
-
-    def log_counts_data(self, file_name: str, device_path: str, log_flag: bool, \
-        dev_mode: str, tdc1_dev: object):
-        start = time.time()
-        now = start
-        # If log file is selected and GUI is running, log to file + display counts
-        if log_flag == True and self.active_flag == True:
-            try:
-                open(file_name)
-            except IOError:
-                # --- Add functionality to handle empty files --- #
-                f = open(file_name, 'w')
-                f.write('#time_stamp,counts\n')
-            while self.active_flag == True:
-                counts = tdc1_dev.get_counts(self.int_time)
-                now = time.time()
-                self.data_is_logged.emit(start, now, counts, dev_mode, self.radio_flags)
-                try:
-                    with open(file_name, 'a+') as f:
-                        time_data: str = datetime.now().isoformat()
-                        data_pairs = '{},{},{},{},{}\n'.format(time_data, *counts)
-                        f.write(data_pairs)
-                    if self.active_flag == False:
-                        break
-                except PermissionError:
-                    tdc1_dev._com.reset_input_buffer()
-                    self.permission_error.emit(tdc1_dev)
-                    return
-        # Else, plot without logging to file
-        elif log_flag == False:
-            while self.active_flag == True:
-                counts = tdc1_dev.get_counts(self.int_time)
-                now = time.time()
-                self.data_is_logged.emit(start, now, counts, dev_mode, self.radio_flags)
-                if self.active_flag == False:
-                    break
-        print('terminating singles log.')
+        Acquisition.log_which_data(self, int_time, file_name, device_path, log_flag, dev_mode, tdc1_dev, \
+            start, stop, offset, bin_width)
+
+    def on_counts(self, start: float, now: float, data: tuple, dev_mode: str):
+        with self.counts_exchange.write() as block:
+            block.start = start
+            block.add(now, data)
+
+    def on_histogram(self, g2_dict: dict, bins: int, bin_width: int):
+        # The continuous g2 provides all channel pairs, count_g2 only the selected one
+        histograms = g2_dict['pairs'] if 'pairs' in g2_dict else g2_dict['histogram']
+        with self.g2_exchange.write() as block:
+            block.add(histograms, bin_width, time.time())
+
+    def on_message(self, message: str):
+        self.logfile_message.emit(message)
+
+    def on_finished(self, tdc1_dev: object):
         self.thread_finished.emit(tdc1_dev)
 
-    def log_coincidences_data(self, file_name: str, device_path: str, log_flag: bool, \
-        dev_mode: str, tdc1_dev: object):
+
+class deviceScanner(QtCore.QObject):
+    """[summary]
+    Worker object that searches for TDC1s in its own thread, so that the main window can be shown straight away.
+    """
+    devices_found = QtCore.pyqtSignal(list)
+
+    @QtCore.pyqtSlot()
+    def scan(self):
+        devices = []
+        try:
+            devices = serial_connection.search_for_serial_devices(tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
+        except Exception as e:
+            print(f'Device search failed: {e}')
+        self.devices_found.emit(list(devices) + SIMULATED_DEVICES)
+
+
+class logLoader(QtCore.QObject):
+    """[summary]
+    Worker object that reads a logfile back (tdc1_logging.read_log) in its own thread, so the GUI stays responsive
+    while a large log is parsed. start and stop (Unix times, 0 for no limit) select a time range, read through the
+    log's index if it has one.
+    """
+    log_loaded = QtCore.pyqtSignal(str, list)
+    load_failed = QtCore.pyqtSignal(str, str)
+
+    @QtCore.pyqtSlot(str, float, float)
+    def load(self, file_name: str, start: float, stop: float):
+        try:
+            segments = read_log(file_name, start or None, stop or None)
+        except (OSError, ValueError) as e:
+            self.load_failed.emit(file_name, str(e))
+            return
+        if (start or stop) and not segments:
+            self.load_failed.emit(file_name, 'It has no rows in the chosen time range.')
+            return
+        self.log_loaded.emit(file_name, segments)
+
+
+class g2Fitter(QtCore.QObject):
+    """[summary]
+    Worker object that fits the g2 peak (tdc1_analysis.fit_g2_peak) in its own thread, so the GUI thread only draws
+    the result. Each fit starts from the previous one of the same histogram (bin width, bins and channel pair),
+    scaled to the new number of counts, so it takes a few iterations. With a writer set, every fit is also written to
+    the g2 fit logfile (G2_FIT_HEADER).
+    """
+    fitted = QtCore.pyqtSignal(object, object) # Key of the histogram, fit_g2_peak result or None
+
+    def __init__(self, *args, **kwargs):
+        super(g2Fitter, self).__init__(*args, **kwargs)
+        self.writer = None # LogWriter of the g2 fit logfile, set by the GUI while logging
+        self._previous = None # (key, total, params) of the last successful fit
+
+    @QtCore.pyqtSlot(object, object, object)
+    def fit(self, key: tuple, delays, histogram):
+        total = int(histogram.sum())
+        initial = None
+        if self._previous is not None and self._previous[0] == key:
+            position, sigma, height, background = self._previous[2]
+            scale = total / max(self._previous[1], 1)
+            initial = (position, sigma, height * scale, background * scale)
+        with METRICS.timer('g2_fit'):
+            result = fit_g2_peak(delays, histogram, initial)
+            if result is None and initial is not None:
+                result = fit_g2_peak(delays, histogram) # The peak may have moved too far for a warm start
+        self._previous = (key, total, result['params']) if result is not None else None
+        writer = self.writer
+        if result is not None and writer is not None:
+            writer.put(time.time(), [total, result['position'], result['fwhm'], result['height'], \
+                result['background'], result['g2_0']])
+        self.fitted.emit(key, result)
+
+
+class delayFinder(QtCore.QObject):
+    """[summary]
+    Worker object for Auto Delay: captures AUTO_DELAY_TIME seconds of timestamps and finds the delay between the start
+    and stop channels by FFT cross-correlation (tdc1_analysis.find_stop_delay) in its own thread.
+    """
+    delay_found = QtCore.pyqtSignal(object) # find_stop_delay result, None if there is no peak
+    search_failed = QtCore.pyqtSignal(str)
+
+    @QtCore.pyqtSlot(object, int, int)
+    def find(self, tdc1_dev: object, ch_start: int, ch_stop: int):
+        try:
+            times, patterns = capture_timestamps(tdc1_dev, AUTO_DELAY_TIME)
+        except (serial.SerialException, OSError) as e:
+            self.search_failed.emit(str(e))
+            return
+        self.delay_found.emit(find_stop_delay(times, patterns, ch_start, ch_stop))
+
+
+def g2_fit_logfile_name(file_name: str):
+    """[summary]
+    Logfile the g2 peak fits go to, next to the g2 logfile, eg. 'run.csv' gives 'run_g2fit.csv'.
+    """
+    return os.path.splitext(file_name)[0] + '_g2fit.csv'
+
+
+def g2_checkpoint_name():
+    """[summary]
+    File the accumulated g2 histogram is kept in (see HistogramCheckpoint), in the user's application data folder.
+    """
+    data_dir = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericDataLocation)
+    return os.path.join(data_dir, 'S-Fifteen Instruments', 'TDC1 GUI', 'g2_checkpoint.tdc1g2')
+
+
+def device_logfile_name(file_name: str, dev_path: str):
+    """[summary]
+    Logfile for one of several devices logging at once: the device name is added before the extension,
+    eg. 'run.csv' and 'COM4' give 'run_COM4.csv'.
+    """
+    base, ext = os.path.splitext(file_name)
+    name = ''.join(c for c in os.path.basename(dev_path) if c.isalnum())
+    return f'{base}_{name}{ext}'
+
+
+class DevicePanel(QWidget):
+    """[summary]
+    Plot tab for one TDC1 run by the DeviceManager. Each panel has its own logWorker, QThread and logfile, so a slow
+    device never holds up the others. Counts are stored as rates (counts/s) against the manager's common start time,
+    so the curves of all devices share one time axis.
+
+    Args:
+        dev_path (str): Device path, eg. 'COM4'.
+        manager (DeviceManager): Provides the common start time.
+    """
+    # Send logging parameters to worker method
+    logging_requested = QtCore.pyqtSignal(float, str, str, bool, str, object, int, int, int, int)
+
+    def __init__(self, dev_path: str, manager: object, *args, **kwargs):
+        super(DevicePanel, self).__init__(*args, **kwargs)
+        self.dev_path = dev_path
+        self.manager = manager
+        self._tdc1_dev = None
+        self.logger = None
+        self.logger_thread = None
+        self.acq_flag = False
+        self.dev_mode = 'singles'
+        self.int_time = 1
+        self.history = RingBuffer(channels=4, capacity=PLT_SAMPLES)
+        self.counts_exchange = new_counts_exchange() # Shared with each run's logWorker
+        self._curves_dirty = False
+        self._label_values = None
+
+        labelStyle = '<span style=\"color:black;font-size:25px\">'
+        self.plot = pg.PlotWidget(title = dev_path)
+        self.plot.setBackground('w')
+        self.plot.setLabel('left', labelStyle + 'Rate (counts/s)')
+        self.plot.setLabel('bottom', labelStyle + 'Time (s)')
+        self.plot.getAxis('bottom').setPen(color='k')
+        self.plot.getAxis('left').setPen(color='k')
+        self.plot.showGrid(y=True)
+        self.linePlots = [self.plot.plot([], [], pen=pg.mkPen(width=2, color=c)) for c in 'rgbk']
+        self.countsLabels = []
+        layout = QGridLayout()
+        layout.addWidget(self.plot, 0, 0, 4, 5)
+        for i, color in enumerate(['red', 'green', 'blue', 'black']):
+            label = QtWidgets.QLabel("0", self)
+            label.setStyleSheet(f"color: {color}; font-size: 48px")
+            label.setAlignment(QtCore.Qt.AlignCenter)
+            layout.addWidget(label, i, 5)
+            self.countsLabels.append(label)
+        self.statusLabel = QtWidgets.QLabel('', self)
+        layout.addWidget(self.statusLabel, 4, 0, 1, 6)
+        self.setLayout(layout)
+
+    def start(self, dev_mode: str, int_time: float, level: str, file_name: str):
         """[summary]
-        Logs the data from TDC1 Timestamp unit when in Coincidences mode. See log_counts_data function for more information.
+        Opens the device (if needed) and starts its logWorker.
+
+        Args:
+            dev_mode (str): 'singles' or 'pairs'.
+            int_time (float): Integration time in seconds.
+            level (str): 'NIM' or 'TTL'.
+            file_name (str): Logfile for this device, '' for no logging.
         """
-        start = time.time()
-        now = start
-        if log_flag == True and self.active_flag == True:
-            try:
-                open(file_name)
-            except IOError:
-                # --- Add functionality to handle empty files --- #
-                f = open(file_name, 'w')
-                f.write('#time_stamp,coincidences\n')
-            while self.active_flag == True:
-                coincidences = tdc1_dev.get_counts_and_coincidences(self.int_time)
-                now = time.time()
-                self.data_is_logged.emit(start, now, coincidences, dev_mode, self.radio_flags)
-                try:
-                    with open(file_name, 'a+') as f:
-                        # Organising data into pairs
-                        time_data: str = datetime.now().isoformat()
-                        data_pairs = '{},{},{},{},{},{},{},{},{}\n'.format(time_data, *coincidences)
-                        f.write(data_pairs)
-                    if self.active_flag == False:
-                        break
-                except PermissionError:
-                    tdc1_dev._com.reset_input_buffer()
-                    self.permission_error.emit(tdc1_dev)
-                    return
-        elif log_flag == False:
-            while self.active_flag == True:
-                coincidences = tdc1_dev.get_counts_and_coincidences(self.int_time)
-                now = time.time()
-                self.data_is_logged.emit(start, now, coincidences, dev_mode, self.radio_flags)
-                if self.active_flag == False:
-                        break
-        print('terminating pairs log.')
-        self.thread_finished.emit(tdc1_dev)
+        if self._tdc1_dev == None:
+            print(f'Creating TDC1 object for {self.dev_path}.')
+            self._tdc1_dev = open_device(self.dev_path)
+        self._tdc1_dev.mode = dev_mode
+        self._tdc1_dev.level = level
+        self.dev_mode = dev_mode
+        self.int_time = int_time
+        self.history.clear()
+        self.statusLabel.setText(file_name)
+
+        self.counts_exchange.swap() # Drop anything left from the previous run
+        self.logger = logWorker(counts_exchange=self.counts_exchange)
+        self.logger_thread = QtCore.QThread(self)
+        self.logger.moveToThread(self.logger_thread)
+        self.logger_thread.start()
+        self.logging_requested.connect(self.logger.log_which_data)
+        self.logger.thread_finished.connect(self.finished)
+        self.logger.logfile_message.connect(self.logfileStatus)
+        self.logger.int_time = int_time
+        self.logger.log_rotate_bytes, self.logger.log_rotate_interval, self.logger.log_compress = \
+            self.manager.window.logRotation()
+
+        self._tdc1_dev._com.reset_input_buffer()
+        self.acq_flag = True
+        self.logging_requested.emit(int_time, file_name, self.dev_path, file_name != '', dev_mode, \
+            self._tdc1_dev, 1, 3, 0, 2)
+
+    def stop(self):
+        if self.logger:
+            self.logger.active_flag = False
+        if self.logger_thread:
+            self.logger_thread.quit()
+            self.logger_thread.wait()
+        self.logging_requested.disconnect()
+        self.logger = None
+        self.logger_thread = None
+        self.acq_flag = False
+
+    def closeDevice(self):
+        if self.logger_thread:
+            self.stop()
+        try:
+            self._tdc1_dev._com.close()
+        except AttributeError:
+            pass
+        self._tdc1_dev = None
+
+    # Called from renderFrame with the samples that arrived since the last frame
+    def updateData(self, block: SampleBlock):
+        times, values = block.view()
+        # Singles: channels 1-4. Pairs: coincidences 1-3, 1-4, 2-3, 2-4, as on the main Counts tab
+        values = values[0:4] if self.dev_mode == 'singles' else values[4:8]
+        self.history.extend(times - self.manager.t0, values / self.int_time)
+        self._label_values = values[:, -1]
+        self._curves_dirty = True
+        self.manager._overview_dirty = True
+
+    @QtCore.pyqtSlot('PyQt_PyObject')
+    def finished(self, dev):
+        self.acq_flag = False
+
+    @QtCore.pyqtSlot(str)
+    def logfileStatus(self, message: str):
+        self.statusLabel.setText(message)
+
+    def renderFrame(self):
+        block = self.counts_exchange.swap()
+        if block is not None and len(block):
+            self.updateData(block)
+        if self._curves_dirty:
+            self._curves_dirty = False
+            t, y = self.history.view()
+            for i in range(4):
+                self.linePlots[i].setData(t, y[i])
+        if self._label_values is not None:
+            for label, value in zip(self.countsLabels, self._label_values):
+                label.setText(str(value))
+            self._label_values = None
+
+
+class DeviceManager(QWidget):
+    """[summary]
+    'Devices' tab: runs several TDC1s side by side. Every ticked device gets a DevicePanel (its own worker thread,
+    logfile and plot tab), and the overview plot shows the same channel of every device together.
+
+    Integration time, NIM/TTL level and logfile are taken from the main window when Start is pressed. With a logfile
+    selected, each device logs to its own file (see device_logfile_name). The device selected in the main window is
+    skipped, since its port is already in use.
+
+    Args:
+        window (MainWindow): Main window whose tabs, settings and render timer are used.
+    """
+
+    def __init__(self, window: object, *args, **kwargs):
+        super(DeviceManager, self).__init__(*args, **kwargs)
+        self.window = window
+        self.panels = {} # Device path -> DevicePanel
+        self.overviewPlots = {} # Device path -> overview curve
+        self.t0 = time.time() # Common start time of all devices
+        self.acq_flag = False
+        self._overview_dirty = False
+
+        self.deviceList = QtWidgets.QListWidget(self)
+        self.rescan_Button = QtWidgets.QPushButton("Rescan", self)
+        self.rescan_Button.clicked.connect(self.rescan)
+        self.modesCombobox = QComboBox(self)
+        self.modesCombobox.addItems(['singles', 'pairs'])
+        self.modesCombobox.currentTextChanged.connect(self.updateChannelNames)
+        self.channelLabel = QtWidgets.QLabel("Overview:", self)
+        self.channelCombobox = QComboBox(self)
+        self.channelCombobox.currentIndexChanged.connect(self.updateOverviewChannel)
+        self.start_Button = QtWidgets.QPushButton("Start Devices", self)
+        self.start_Button.clicked.connect(self.startStop)
+        self.updateChannelNames(self.modesCombobox.currentText())
+
+        labelStyle = '<span style=\"color:black;font-size:25px\">'
+        self.overviewPlot = pg.PlotWidget(title = "All Devices")
+        self.overviewPlot.setBackground('w')
+        self.overviewPlot.setLabel('left', labelStyle + 'Rate (counts/s)')
+        self.overviewPlot.setLabel('bottom', labelStyle + 'Time (s)')
+        self.overviewPlot.getAxis('bottom').setPen(color='k')
+        self.overviewPlot.getAxis('left').setPen(color='k')
+        self.overviewPlot.showGrid(y=True)
+        self.overviewPlot.addLegend()
+
+        controls = QVBoxLayout()
+        controls.addWidget(self.deviceList)
+        controls.addWidget(self.rescan_Button)
+        controls.addWidget(self.modesCombobox)
+        controls.addWidget(self.channelLabel)
+        controls.addWidget(self.channelCombobox)
+        controls.addWidget(self.start_Button)
+        layout = QGridLayout()
+        layout.addLayout(controls, 0, 0)
+        layout.addWidget(self.overviewPlot, 0, 1, 1, 5)
+        self.setLayout(layout)
+
+        self.setDevices(window.dev_list)
+        window.render_timer.timeout.connect(self.renderFrame)
+
+    def setDevices(self, devices: list):
+        self.deviceList.clear()
+        for dev_path in devices:
+            item = QtWidgets.QListWidgetItem(dev_path)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Unchecked)
+            self.deviceList.addItem(item)
+
+    def checkedDevices(self):
+        items = [self.deviceList.item(i) for i in range(self.deviceList.count())]
+        return [item.text() for item in items if item.checkState() == QtCore.Qt.Checked]
+
+    def busy(self, dev_path: str):
+        # True if dev_path is in use by a running panel
+        return dev_path in self.panels and self.panels[dev_path].acq_flag == True
+
+    @QtCore.pyqtSlot()
+    def rescan(self):
+        # The list is refilled by the main window's updateDevList when the search is done
+        if self.acq_flag == False:
+            self.window.scanDevices()
+
+    @QtCore.pyqtSlot(str)
+    def updateChannelNames(self, dev_mode: str):
+        names = ['Ch 1', 'Ch 2', 'Ch 3', 'Ch 4'] if dev_mode == 'singles' else ['1-3', '1-4', '2-3', '2-4']
+        index = max(0, self.channelCombobox.currentIndex())
+        self.channelCombobox.blockSignals(True)
+        self.channelCombobox.clear()
+        self.channelCombobox.addItems(names)
+        self.channelCombobox.setCurrentIndex(index)
+        self.channelCombobox.blockSignals(False)
+
+    @QtCore.pyqtSlot(int)
+    def updateOverviewChannel(self, index: int):
+        self._overview_dirty = True
+
+    @QtCore.pyqtSlot()
+    def startStop(self):
+        if self.acq_flag == True:
+            self.stopAll()
+        else:
+            self.startAll()
+
+    def startAll(self):
+        devices = [d for d in self.checkedDevices() if d != self.window._dev_path]
+        if not devices:
+            print('No devices ticked (the device selected in the main window is run from there).')
+            return
+        int_time = self.window.integrationSpinBox.value() * 1e-3
+        level = 'TTL' if self.window.levelsComboBox.currentText().startswith('TTL') else 'NIM'
+        dev_mode = self.modesCombobox.currentText()
+        self.t0 = time.time()
+        for i, dev_path in enumerate(devices):
+            if dev_path not in self.panels:
+                panel = DevicePanel(dev_path, self)
+                self.panels[dev_path] = panel
+                self.window.tabs.addTab(panel, os.path.basename(dev_path))
+                # Panning/zooming one device's plot moves all of them
+                panel.plot.setXLink(self.overviewPlot)
+                self.overviewPlots[dev_path] = self.overviewPlot.plot([], [], name = dev_path, \
+                    pen=pg.mkPen(width=2, color=pg.intColor(len(self.overviewPlots), hues=8)))
+            file_name = device_logfile_name(self.window._logfile_name, dev_path) if self.window.log_flag == True else ''
+            self.panels[dev_path].start(dev_mode, int_time, level, file_name)
+        self.acq_flag = True
+        self.modesCombobox.setEnabled(False)
+        self.rescan_Button.setEnabled(False)
+        self.start_Button.setText("Stop Devices")
+
+    def stopAll(self):
+        for panel in self.panels.values():
+            panel.closeDevice()
+        self.acq_flag = False
+        self.modesCombobox.setEnabled(True)
+        self.rescan_Button.setEnabled(True)
+        self.start_Button.setText("Start Devices")
+
+    # Connected to the main window's render_timer.timeout
+    @QtCore.pyqtSlot()
+    def renderFrame(self):
+        for panel in self.panels.values():
+            panel.renderFrame()
+        if self._overview_dirty:
+            self._overview_dirty = False
+            channel = max(0, self.channelCombobox.currentIndex())
+            for dev_path, curve in self.overviewPlots.items():
+                # Views into each panel's ring buffer; nothing is copied
+                t, y = self.panels[dev_path].history.view()
+                curve.setData(t, y[channel])
+
+
+class StatsPanel(QWidget):
+    """[summary]
+    'Stats' tab: rate, busy fraction and latency of every processing stage timed through tdc1_metrics.METRICS (device
+    reads, logfile writes, signal delivery to the GUI, GUI slots and rendering), the acquisition duty cycle and the
+    number of dropped render frames. The table is only refreshed while the tab is visible. The same numbers can be written periodically to a Prometheus text file.
+
+    Args:
+        window (MainWindow): Main window, for the file dialog.
+    """
+    REFRESH_INTERVAL = 1000 # ms
+    COLUMNS = ['Stage', 'Count', 'Rate (/s)', 'Busy (%)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)']
+
+    def __init__(self, window: object, *args, **kwargs):
+        super(StatsPanel, self).__init__(*args, **kwargs)
+        self.window = window
+        self.exporter = None
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.countersLabel = QtWidgets.QLabel(self)
+        self.clear_Button = QtWidgets.QPushButton("Clear Stats", self)
+        self.clear_Button.clicked.connect(self.clearStats)
+        self.export_Button = QtWidgets.QPushButton("Export Metrics", self)
+        self.export_Button.clicked.connect(self.exportMetrics)
+        self.exportText = QtWidgets.QLabel(self)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.countersLabel)
+        controls.addStretch()
+        controls.addWidget(self.exportText)
+        controls.addWidget(self.export_Button)
+        controls.addWidget(self.clear_Button)
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(controls)
+        self.setLayout(layout)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start()
+
+    def showEvent(self, event):
+        super(StatsPanel, self).showEvent(event)
+        self.refresh()
+
+    @QtCore.pyqtSlot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+        stages, counters = METRICS.summary()
+        self.table.setRowCount(len(stages))
+        for row, (name, s) in enumerate(stages.items()):
+            values = [name, str(s['count']), f"{s['rate']:.1f}", f"{s['busy'] * 100:.1f}", f"{s['p50'] * 1e3:.3f}", \
+                f"{s['p99'] * 1e3:.3f}", f"{s['max'] * 1e3:.3f}"]
+            for column, text in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+        text = 'Dropped frames: ' + str(counters.get('dropped_frames', 0))
+        if 'window' in stages:
+            # Time covered by integration windows (singles and pairs)
+            text = f"Duty cycle: {stages['window']['busy'] * 100:.1f}%, " + text
+        if 'lost_samples' in counters:
+            text += ', lost samples: ' + str(counters['lost_samples'])
+        self.countersLabel.setText(text)
+
+    @QtCore.pyqtSlot()
+    def clearStats(self):
+        METRICS.clear()
+        self.refresh()
+
+    @QtCore.pyqtSlot()
+    def exportMetrics(self):
+        if self.exporter:
+            self.stopExport()
+            return
+        file_name = QtWidgets.QFileDialog.getSaveFileName(self, "Export metrics to", "tdc1.prom", \
+            "Prometheus text (*.prom);;All files (*)")[0]
+        if file_name != '':
+            self.exporter = MetricsExporter(file_name)
+            self.exporter.start()
+            self.exportText.setText(file_name)
+            self.export_Button.setText('Stop Export')
+
+    def stopExport(self):
+        if self.exporter:
+            self.exporter.stop()
+            self.exporter = None
+        self.exportText.setText('')
+        self.export_Button.setText('Export Metrics')
+
+
+class RunStatsPanel(QWidget):
+    """[summary]
+    'Run Stats' tab: whole-run mean, standard deviation and Allan deviation (at octave averaging times) of the count
+    rate of every singles channel and, in pairs mode, every coincidence pair, from the main window's
+    RunningStatistics. Covers the whole run, not just the plotted samples, and also a log shown with Load Log.
+    Refreshed only while the tab is visible.
+
+    Args:
+        window (MainWindow): Main window whose count_stats are shown.
+    """
+    REFRESH_INTERVAL = 1000 # ms
+    CHANNELS = ['Ch 1', 'Ch 2', 'Ch 3', 'Ch 4', '1-3', '1-4', '2-3', '2-4']
+
+    def __init__(self, window: object, *args, **kwargs):
+        super(RunStatsPanel, self).__init__(*args, **kwargs)
+        self.window = window
+
+        self.table = QtWidgets.QTableWidget(0, 0, self)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.samplesLabel = QtWidgets.QLabel(self)
+        self.clear_Button = QtWidgets.QPushButton("Clear Stats", self)
+        self.clear_Button.clicked.connect(self.clearStats)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.samplesLabel)
+        controls.addStretch()
+        controls.addWidget(self.clear_Button)
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(controls)
+        self.setLayout(layout)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setInterval(self.REFRESH_INTERVAL)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start()
+
+    def showEvent(self, event):
+        super(RunStatsPanel, self).showEvent(event)
+        self.refresh()
+
+    @QtCore.pyqtSlot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+        stats = self.window.count_stats
+        # Coincidence columns only once there are pairs counts (pairs mode)
+        columns = 8 if np.any(stats.mean[4:8]) else 4
+        taus, adev = stats.allan_deviation()
+        rows = [('Mean (/s)', stats.mean), ('Std dev (/s)', stats.std)]
+        rows += [(f'ADEV {tau:g} s (/s)', values) for tau, values in zip(taus, adev)]
+        if self.table.columnCount() != columns:
+            self.table.setColumnCount(columns)
+            self.table.setHorizontalHeaderLabels(self.CHANNELS[:columns])
+        if self.table.rowCount() != len(rows):
+            self.table.setRowCount(len(rows))
+            self.table.setVerticalHeaderLabels([name for name, _ in rows])
+        for row, (_, values) in enumerate(rows):
+            for column in range(columns):
+                text = f'{values[column]:.6g}'
+                item = self.table.item(row, column)
+                if item is None:
+                    self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+        duration = stats.count * stats.tau0
+        duration = f'{duration / 3600:.2f} h' if duration >= 3600 else f'{duration:.1f} s'
+        self.samplesLabel.setText(f'Samples: {stats.count}' + (f' ({duration})' if stats.count else ''))
+
+    @QtCore.pyqtSlot()
+    def clearStats(self):
+        self.window.count_stats.clear()
+        self.refresh()
+
 
-    def log_g2(self, file_name: str, device_path: str, log_flag: bool, \
-        dev_mode: str, tdc1_dev: object):
-        start = time.time()
-        now = start
-        if log_flag == True and self.active_flag == True:
-            try:
-                open(file_name)
-            except IOError:
-                # --- Add functionality to handle empty files --- #
-                f = open(file_name, 'w')
-                f.write('#time_stamp,g2\n')
-            while self.active_flag == True:
-                #print(f'calling g2_dict({self.int_time}, START: {self.ch_start}, STOP: {self.ch_stop}, {self.bin_width}, {self.bins}, {self.offset})')
-                g2_dict = tdc1_dev.count_g2(t_acq = self.int_time, ch_start = self.ch_start, ch_stop = self.ch_stop, \
-                    bin_width = self.bin_width, bins = self.bins, ch_stop_delay = self.offset)
-                now = time.time()
-                hist = g2_dict['histogram']
-                self.histogram_logged.emit(g2_dict, self.bins, self.bin_width)
-                try:
-                    with open(file_name, 'a+') as f:
-                        # Organising data into pairs
-                        time_data: str = datetime.now().isoformat()
-                        hist_list = hist.tolist()
-                        new_hist = [str(element) for element in hist_list]
-                        new_hist.insert(0, time_data)
-                        data = ','.join(new_hist) + '\n'
-                        f.write(data)
-                    if self.active_flag == False:
-                        break
-                except PermissionError:
-                    tdc1_dev._com.reset_input_buffer()
-                    self.permission_error.emit(tdc1_dev)
-                    return
-        elif log_flag == False:
-            while self.active_flag == True:
-                #print(f'calling g2_dict({self.int_time}, START: {self.ch_start}, STOP: {self.ch_stop}, {self.bin_width}, {self.bins}, {self.offset})')
-                g2_dict = tdc1_dev.count_g2(t_acq = self.int_time, ch_start = self.ch_start, ch_stop = self.ch_stop, \
-                    bin_width = self.bin_width, bins = self.bins, ch_stop_delay = self.offset)
-                now = time.time()
-                self.histogram_logged.emit(g2_dict, self.bins, self.bin_width)
-                #print(f'calling g2_dict({self.int_time}, {self.ch_start}, {self.ch_stop}, {self.bin_width}, {self.bins}')
-                if self.active_flag == False:
-                        break
-        print('terminating g2 log.')
-        self.thread_finished.emit(tdc1_dev)
-        
-        
 class MainWindow(QMainWindow):
     """[summary]
     Main window class containing the main window and its associated methods. 
@@ -233,6 +722,10 @@ class MainWindow(QMainWindow):
     """
     # Send logging parameters to worker method
     logging_requested = QtCore.pyqtSignal(float, str, str, bool, str, object, int, int, int, int)
+    scan_requested = QtCore.pyqtSignal()
+    load_requested = QtCore.pyqtSignal(str, float, float)
+    fit_requested = QtCore.pyqtSignal(object, object, object)
+    delay_requested = QtCore.pyqtSignal(object, int, int)
     
     def __init__(self, *args, **kwargs):
         """[summary]
@@ -254,6 +747,20 @@ class MainWindow(QMainWindow):
         
         self.logger = None # Variable that will hold the logWorker object
         self.logger_thread = None # Variable that will hold the QThread object
+        self.process = None # AcquisitionProcess of the last run in a separate process
+        self.scanner = None # deviceScanner searching for devices in scanner_thread
+        self.scanner_thread = None
+        self.loader = None # logLoader reading logfiles back in loader_thread
+        self.loader_thread = None
+        self.finder = None # delayFinder searching for the stop channel delay in finder_thread
+        self.finder_thread = None
+        self.fitter = None # g2Fitter fitting the g2 peak in fitter_thread
+        self.fitter_thread = None
+        self.fit_writer = None # LogWriter of the g2 fit logfile while logging with Log fit ticked
+        self._fit_key = None # Histogram the last fit request was for, and its total then
+        self._fit_total = 0
+        self._fit_busy = False # A fit is running; another request waits for it (_fit_pending)
+        self._fit_pending = False
         
         self.initUI() # UI is initialised afer the class variables are defined
 
@@ -279,11 +786,12 @@ class MainWindow(QMainWindow):
         self._runtime_prev = self._runtime
 
         self._plot_tab = self.tabs.currentIndex()  # Counts graph = 0, Coincidences graph = 1
-        self.idx = min(len(self.y1), self.plotSamples)  # Index for plotting
         self._counts_plotted = False
         self._g2_plotted = False
         self._data_plotted = self._counts_plotted or self._g2_plotted
         self.runtimeCheck = self.runtime_Checkbox.isChecked()
+
+        self.scanDevices()
         
 
     def initUI(self):
@@ -305,6 +813,15 @@ class MainWindow(QMainWindow):
         self.selectLogfile_Button.clicked.connect(self.selectLogfile)
         self.selectLogfile_Button.setEnabled(False)
 
+        # Long runs can be split into numbered segments, completed ones compressed in the background
+        self.rotateCombobox = QComboBox(self)
+        self.rotateCombobox.addItems(LOG_ROTATIONS)
+        self.rotateCombobox.currentTextChanged.connect(self.updateRotation)
+        self.rotateCombobox.setEnabled(False)
+        self.compressCombobox = QComboBox(self)
+        self.compressCombobox.addItems(['No compression', 'gzip', 'xz'])
+        self.compressCombobox.setEnabled(False)
+
         # setAutoExclusive method is used to toggle the radio buttons independently.
         self.radio1_Button = QRadioButton("Channel 1", self)
         self.radio1_Button.setStyleSheet('color: red; font-size: 14px')
@@ -328,6 +845,21 @@ class MainWindow(QMainWindow):
         #self.radio4_Button.setEnabled(False)
 
         self.runtime_Checkbox = QCheckBox("Timer?")
+
+        # g2 from one continuous timestamp stream (no dead time between acquisitions) instead of repeated count_g2 calls
+        self.streamCheckbox = QCheckBox("Continuous")
+
+        # Fits the g2 peak in a worker thread and overlays it; Log fit writes every fit next to the logfile
+        self.fitCheckbox = QCheckBox("Fit peak")
+        self.fitCheckbox.toggled.connect(self.updateFit)
+        self.fitLogCheckbox = QCheckBox("Log fit")
+        self.fitLogCheckbox.setEnabled(False)
+
+        # Device I/O and logging in a child process, so redrawing the plots cannot delay reads (see tdc1_process)
+        self.processCheckbox = QCheckBox("Separate process")
+
+        # Singles/pairs with the next window requested from the device while the last one is handled (no dead time)
+        self.pipelinedCheckbox = QCheckBox("Pipelined")
         #self.runtime_Checkbox.stateChanged.connect(self.updateRuntimeSelection)
 
         self.clearCountsDataData_Button = QtWidgets.QPushButton("Clear Data", self)
@@ -336,6 +868,14 @@ class MainWindow(QMainWindow):
         self.clearg2DataData_Button = QtWidgets.QPushButton("Clear Data", self)
         self.clearg2DataData_Button.clicked.connect(self.clearg2DataData)
 
+        # Brings back the g2 last accumulated (live runs only), eg. after a crash or Clear Data
+        self.restoreg2_Button = QtWidgets.QPushButton("Restore g2", self)
+        self.restoreg2_Button.clicked.connect(self.restoreg2)
+
+        # Shows a previously written logfile in the counts graph or g2 histogram, without a device
+        self.loadLog_Button = QtWidgets.QPushButton("Load Log", self)
+        self.loadLog_Button.clicked.connect(self.loadLog)
+
         #---------Buttons---------#
 
 
@@ -370,7 +910,11 @@ class MainWindow(QMainWindow):
         self.g2RateLabel = QtWidgets.QLabel("Total Pairs: <br>" + "0")
         self.g2RateLabel.setStyleSheet("font-size: 64px")
         self.g2RateLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.g2FitLabel = QtWidgets.QLabel("")
+        self.g2FitLabel.setStyleSheet("font-size: 20px")
+        self.g2FitLabel.setAlignment(QtCore.Qt.AlignCenter)
         self.resolutionTextLabel = QtWidgets.QLabel("Bin Width:", self)
+        self.recentLabel = QtWidgets.QLabel("Recent (s):", self)
 
         self.runtimeLabel = QtWidgets.QLabel("Total Runtime (mins):", self)
         self.countdownLabel = QtWidgets.QLabel("00:00:00", self)
@@ -388,12 +932,10 @@ class MainWindow(QMainWindow):
         self.integrationSpinBox.valueChanged.connect(self.update_intTime)
         self.integrationSpinBox.setEnabled(False)
 
-        self.dev_list = serial_connection.search_for_serial_devices(
-            tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
-        try:
-            self.dev_list = serial_connection.search_for_serial_devices(tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
-        except:
-            pass
+        # Devices are searched for in the background (see scanDevices); until then only the last used device is listed
+        self.settings = QtCore.QSettings('S-Fifteen Instruments', 'TDC1 GUI')
+        last_device = self.settings.value('device', '', type=str)
+        self.dev_list = [last_device] if last_device else []
         self.devCombobox = QComboBox(self)
         self.devCombobox.addItem('Select your device')
         self.devCombobox.addItems(self.dev_list)
@@ -428,16 +970,26 @@ class MainWindow(QMainWindow):
         self.samplesSpinbox.setEnabled(False)
 
         self.offsetSpinbox = QSpinBox(self)
-        self.offsetSpinbox.setRange(-10, 65535)
+        self.offsetSpinbox.setRange(-65535, 65535) # Auto Delay may need the stop channel moved earlier
         self.offsetSpinbox.setKeyboardTracking(False)
         #self.offsetSpinbox.setEnabled(False)
         self.offsetSpinbox.valueChanged.connect(self.updateOffset)
 
+        # Sets the offset from the measured delay between the start and stop channels
+        self.autoDelay_Button = QtWidgets.QPushButton("Auto Delay", self)
+        self.autoDelay_Button.clicked.connect(self.autoDelay)
+
         self.resolutionSpinbox = QSpinBox(self)
         self.resolutionSpinbox.setRange(0, 1000)
         self.resolutionSpinbox.setKeyboardTracking(False)
         self.resolutionSpinbox.setValue(2) # Default 2 ns bin width
         self.resolutionSpinbox.valueChanged.connect(self.updateBinwidth)
+
+        self.recentSpinbox = QSpinBox(self)
+        self.recentSpinbox.setRange(0, 3600)
+        self.recentSpinbox.setKeyboardTracking(False)
+        self.recentSpinbox.setValue(0) # Default off; otherwise also plot the g2 of the last N seconds
+        self.recentSpinbox.valueChanged.connect(self.updateRecentWindow)
         #self.resolutionSpinbox.setEnabled(False)
 
         self.runtimeSpinbox = QSpinBox(self)
@@ -459,18 +1011,26 @@ class MainWindow(QMainWindow):
         #---------PLOTS---------#
         # Initiating plot data variables
         # Plot 1 - Four channel counts plot
-        self.x = []
-        self.y1 = []
-        self.y2 = []
-        self.y3 = []
-        self.y4 = []
-        self.y_data = [self.y1, self.y2, self.y3, self.y4]
+        # Time column plus one row per channel, preallocated; resized when Plot Samples changes
+        self.counts_history = RingBuffer(channels=4, capacity=PLT_SAMPLES)
+        # Whole-run history with min/max decimation, drawn instead once the user pans or zooms the counts graph
+        self.counts_pyramid = MinMaxPyramid(channels=4)
+        # Whole-run mean, standard deviation and Allan deviation of every channel, shown in the Run Stats tab
+        self.count_stats = RunningStatistics(channels=8)
+        # Shared with each run's logWorker, which writes into them; renderFrame takes what has arrived once per frame
+        self.counts_exchange = new_counts_exchange()
+        self.g2_exchange = DoubleBuffer(HistogramBlock)
 
         # Plot 2 - Time difference histogram (Channel cross-correlation)
         self.bins = 501
         self.binsize = 2 # nanoseconds
-        self.x0 = np.arange(0, self.bins*self.binsize, self.binsize)
-        self.y0 = np.zeros_like(self.x0)
+        self.g2_hist = HistogramAccumulator(bins=self.bins, bin_width=self.binsize)
+        self.g2_pairs = None # Accumulators of all 12 channel pairs, once the continuous g2 provides them
+        # Memory-mapped copy of the accumulated g2 on disk, so it can be restored after a crash or Clear Data
+        self.g2_checkpoint = HistogramCheckpoint(g2_checkpoint_name())
+        self.pair_delays = np.zeros((4, 4), dtype=np.int64) # Offset of each (start, stop) pair
+        self.x0 = self.g2_hist.time_bins()
+        self.recent_seconds = 0 # Length of the sliding 'recent' g2, 0 = off
         
         font = QtGui.QFont("Arial", 24)     
         labelStyle = '<span style=\"color:black;font-size:25px\">'
@@ -485,17 +1045,13 @@ class MainWindow(QMainWindow):
         self.tdcPlot.getAxis('bottom').setPen(color='k')
         self.tdcPlot.getAxis('left').setPen(color='k')
         self.tdcPlot.showGrid(y=True)
+        self.tdcPlot.getViewBox().sigXRangeChanged.connect(self.countsRangeChanged)
         
-        # Setting up plot window 2 (Plot Widget)
-        self.tdcPlot2 = pg.PlotWidget(title = "Coincidences Histogram")
-        self.tdcPlot2.setBackground('w')
-        self.tdcPlot2.setLabel('left', labelStyle + 'Coincidences')
-        self.tdcPlot2.setLabel('bottom', labelStyle + 'Time Delay (ns)')
-        self.tdcPlot2.getAxis('left').tickFont = font
-        self.tdcPlot2.getAxis('bottom').tickFont = font
-        self.tdcPlot2.getAxis('bottom').setPen(color='k')
-        self.tdcPlot2.getAxis('left').setPen(color='k')
-        self.tdcPlot2.showGrid(y=True)
+        # Plot window 2 is only built when the g2 tab is first shown (see buildg2Plot)
+        self.tdcPlot2 = None
+        self.histogramPlot = None
+        self.recentHistogramPlot = None
+        self.fitPlot = None
 
         # Setting up data plots (Plot data item)
         self.lineStyle1 = pg.mkPen(width=2, color='r') # Red
@@ -506,17 +1062,28 @@ class MainWindow(QMainWindow):
 
         # Plotting the graph - https://pyqtgraph.readthedocs.io/en/latest/plotting.html for organisation of plotting classes
         # Take note: multiple plotDataItems can sit on one plotWidget
-        self.linePlot1 = self.tdcPlot.plot(self.x, self.y1, pen=self.lineStyle1)
-        self.linePlot2 = self.tdcPlot.plot(self.x, self.y2, pen=self.lineStyle2)
-        self.linePlot3 = self.tdcPlot.plot(self.x, self.y3, pen=self.lineStyle3)
-        self.linePlot4 = self.tdcPlot.plot(self.x, self.y4, pen=self.lineStyle4)
-        self.histogramPlot = self.tdcPlot2.plot(self.x0, self.y0, pen=self.lineStyle0, symbol = 'x', symbolPen = 'b', symbolBrush = 0.2)
+        self.linePlot1 = self.tdcPlot.plot([], [], pen=self.lineStyle1)
+        self.linePlot2 = self.tdcPlot.plot([], [], pen=self.lineStyle2)
+        self.linePlot3 = self.tdcPlot.plot([], [], pen=self.lineStyle3)
+        self.linePlot4 = self.tdcPlot.plot([], [], pen=self.lineStyle4)
         self.linePlots = [self.linePlot1, self.linePlot2, self.linePlot3, self.linePlot4]
         #---------PLOTS---------#
 
         # Timer
         self.timer = QtCore.QTimer()
 
+        # Render timer. New data is taken from the worker and plots/labels redrawn at most render_fps times a second.
+        self.countsLabels = [self.Ch1CountsLabel, self.Ch2CountsLabel, self.Ch3CountsLabel, self.Ch4CountsLabel]
+        self._curves_dirty = [False, False, False, False]
+        self._label_values = None # Latest values for the big counts labels, None if already shown
+        self._histogram_dirty = False
+        self.render_fps = RENDER_FPS
+        self.render_timer = QtCore.QTimer(self)
+        self.render_timer.setInterval(int(1000 / self.render_fps))
+        self.render_timer.timeout.connect(self.renderFrame)
+        self.render_timer.start()
+        self._last_frame = None # perf_counter time of the previous render tick, for counting dropped frames
+
         #---------Main Window---------#
         self.setWindowTitle("TDC-1")
         self.move(0, 0)
@@ -540,12 +1107,32 @@ class MainWindow(QMainWindow):
 
         self.tab2 = QWidget()
         self.layout2 = QGridLayout()
-        self.layout2.addWidget(self.tdcPlot2, 0, 0, 5, 5)
         self.layout2.addWidget(self.g2RateLabel, 0, 5)
+        self.layout2.addWidget(self.g2FitLabel, 1, 5)
+        self.layout2.addWidget(self.restoreg2_Button, 3, 5)
         self.layout2.addWidget(self.clearg2DataData_Button, 4, 5)
         self.tab2.setLayout(self.layout2)
         self.tabs.addTab(self.tab2, "g2")
+
+        # Further TDC1s, each with its own worker and tab, plus an overview of all of them. Built when first shown.
+        self.devices = None
+        self.devicesTab = QWidget()
+        self.devicesTab.setLayout(QVBoxLayout())
+        self.tabs.addTab(self.devicesTab, "Devices")
+
+        # Stage timings (tdc1_metrics), built when first shown
+        self.stats = None
+        self.statsTab = QWidget()
+        self.statsTab.setLayout(QVBoxLayout())
+        self.tabs.addTab(self.statsTab, "Stats")
+
+        # Whole-run count rate statistics (RunStatsPanel), built when first shown
+        self.runStats = None
+        self.runStatsTab = QWidget()
+        self.runStatsTab.setLayout(QVBoxLayout())
+        self.tabs.addTab(self.runStatsTab, "Run Stats")
         self.tabs.currentChanged.connect(self.update_plot_tab)
+        self.tabs.setCornerWidget(self.loadLog_Button)
         #---------Tabs---------#
 
         #Layout
@@ -564,8 +1151,11 @@ class MainWindow(QMainWindow):
         self.grid.addWidget(self.runtime_Checkbox, 1, 4, 1, 1)
         self.grid.addWidget(self.countdownLabel, 1, 5, 1, 1)
         self.grid.addWidget(self.liveStart_Button, 2, 0)
+        self.grid.addWidget(self.processCheckbox, 2, 1)
         self.grid.addWidget(self.selectLogfile_Button, 2, 2)
         self.grid.addWidget(self.logfileText, 2, 3)
+        self.grid.addWidget(self.rotateCombobox, 2, 4)
+        self.grid.addWidget(self.compressCombobox, 2, 5)
         self.grid.addWidget(self.tabs, 4, 0, 5, 6)
         
         self.countsGroupbox = QGroupBox('Counts')
@@ -574,6 +1164,7 @@ class MainWindow(QMainWindow):
         self.singlesLayout.addWidget(self.radio2_Button)
         self.singlesLayout.addWidget(self.radio3_Button)
         self.singlesLayout.addWidget(self.radio4_Button)
+        self.singlesLayout.addWidget(self.pipelinedCheckbox)
         self.countsGroupbox.setLayout(self.singlesLayout)
         self.grid.addWidget(self.countsGroupbox, 3, 0, 1, 2)
 
@@ -583,12 +1174,18 @@ class MainWindow(QMainWindow):
         self.g2SpinLayout.addWidget(self.channelsCombobox1)
         self.g2SpinLayout.addWidget(self.stopChannelLabel)
         self.g2SpinLayout.addWidget(self.channelsCombobox2)
+        self.g2SpinLayout.addWidget(self.recentLabel)
+        self.g2SpinLayout.addWidget(self.recentSpinbox)
+        self.g2SpinLayout.addWidget(self.fitCheckbox)
+        self.g2SpinLayout.addWidget(self.fitLogCheckbox)
         #self.g2LabelLayout = QHBoxLayout()
         self.g2CenterLayout = QHBoxLayout()
         self.g2CenterLayout.addWidget(self.offsetLabel)
         self.g2CenterLayout.addWidget(self.offsetSpinbox)
+        self.g2CenterLayout.addWidget(self.autoDelay_Button)
         self.g2CenterLayout.addWidget(self.resolutionTextLabel)
         self.g2CenterLayout.addWidget(self.resolutionSpinbox)
+        self.g2CenterLayout.addWidget(self.streamCheckbox)
         self.g2Layout = QVBoxLayout()
         #self.g2Layout.addLayout(self.g2LabelLayout)
         self.g2Layout.addLayout(self.g2SpinLayout)
@@ -612,16 +1209,27 @@ class MainWindow(QMainWindow):
     def selectDevice(self, devPath: str):
         if devPath == 'Select your device':
             return
+        if self.devices and self.devices.busy(devPath):
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setIcon(QtWidgets.QMessageBox.Information)
+            msgBox.setText('This device is running in the Devices tab. Please stop it there first.')
+            msgBox.setWindowTitle('Error Selecting Device')
+            msgBox.setStandardButtons(QMessageBox.Ok)
+            msgBox.exec()
+            self.devCombobox.setCurrentText('Select your device')
+            return
         if self.acq_flag == False:
             self.StrongResetInternalVariables()
             self.resetGUIelements()
             print('Creating TDC1 object.')
-            self._tdc1_dev = tdc1.TimeStampTDC1(devPath)
+            self._tdc1_dev = open_device(devPath)
             self._dev_path = devPath
             check = self._tdc1_dev._device_path
             print(f'Device connected at {check}')
             self.enableDevOptions()
             self._dev_selected = True
+            if devPath == self.settings.value('device', '', type=str):
+                self.restoreSettings()
         elif self.acq_flag == True:
             msgBox = QtWidgets.QMessageBox()
             msgBox.setIcon(QtWidgets.QMessageBox.Information)
@@ -631,16 +1239,174 @@ class MainWindow(QMainWindow):
             msgBox.exec()
             self.modesCombobox.setCurrentText(self._dev_mode_prev)
 
+    def scanDevices(self):
+        """[summary]
+        Starts a device search in the scanner thread. updateDevList fills devCombobox when it is done.
+        """
+        if self.scanner is None:
+            self.scanner = deviceScanner()
+            self.scanner_thread = QtCore.QThread(self)
+            self.scanner.moveToThread(self.scanner_thread)
+            self.scan_requested.connect(self.scanner.scan)
+            self.scanner.devices_found.connect(self.updateDevList)
+            self.scanner_thread.start()
+        self.scan_requested.emit()
+
+    # Connected to loadLog_Button.clicked
     @QtCore.pyqtSlot()
-    def updateDevList(self):
+    def loadLog(self):
+        """[summary]
+        Asks for a logfile and reads it in the loader thread. showLog draws it once it has been read. If the log
+        has an index (tdc1_logging.log_index_name), a time range of it can be chosen instead of the whole log.
+        """
+        if self.acq_flag == True:
+            print('Stop the run before loading a logfile.')
+            return
+        if self._data_plotted == True:
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setIcon(QtWidgets.QMessageBox.Information)
+            msgBox.setText('The plotted data will be replaced by the logfile. Any data unsaved to a Logfile will be lost.')
+            msgBox.setWindowTitle('Confirm Load Log')
+            msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+            if msgBox.exec() != QMessageBox.Ok:
+                return
+        file_name = QtWidgets.QFileDialog.getOpenFileName(self, "Load log file", '', \
+            "TDC1 logs (*.csv *" + BINARY_LOG_EXTENSION + " *.gz *.xz);;All files (*)")[0]
+        if file_name == '':
+            return
+        time_range = self.askLogRange(file_name)
+        if time_range is None:
+            return
+        if self.loader is None:
+            self.loader = logLoader()
+            self.loader_thread = QtCore.QThread(self)
+            self.loader.moveToThread(self.loader_thread)
+            self.load_requested.connect(self.loader.load)
+            self.loader.log_loaded.connect(self.showLog)
+            self.loader.load_failed.connect(self.loadFailed)
+            self.loader_thread.start()
+        self.loadLog_Button.setEnabled(False)
+        self.loadLog_Button.setText('Loading...')
+        self.load_requested.emit(file_name, *time_range)
+
+    def askLogRange(self, file_name: str):
+        """[summary]
+        Asks which part of an indexed log to load. Logs without an index are loaded whole.
+
+        Returns:
+            tuple: (start, stop) Unix times, 0 for no limit, or None if cancelled.
+        """
+        indexed = log_time_range(file_name)
+        if indexed is None:
+            return (0.0, 0.0)
+        dialog = QDialog(self)
+        dialog.setWindowTitle('Load Log')
+        layout = QGridLayout(dialog)
+        whole_Checkbox = QCheckBox('Whole log', dialog)
+        whole_Checkbox.setChecked(True)
+        layout.addWidget(whole_Checkbox, 0, 0, 1, 2)
+        edits = []
+        for row, (label, t) in enumerate((('From', indexed[0]), ('To', indexed[1]))):
+            edit = QtWidgets.QDateTimeEdit(QtCore.QDateTime.fromMSecsSinceEpoch(int(t * 1e3)), dialog)
+            edit.setDisplayFormat('yyyy-MM-dd HH:mm:ss')
+            edit.setCalendarPopup(True)
+            edit.setEnabled(False)
+            whole_Checkbox.toggled.connect(lambda checked, edit=edit: edit.setEnabled(not checked))
+            layout.addWidget(QtWidgets.QLabel(label, dialog), row + 1, 0)
+            layout.addWidget(edit, row + 1, 1)
+            edits.append(edit)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, dialog)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons, 3, 0, 1, 2)
+        if dialog.exec() != QDialog.Accepted:
+            return None
+        if whole_Checkbox.isChecked() == True:
+            return (0.0, 0.0)
+        start, stop = (e.dateTime().toMSecsSinceEpoch() * 1e-3 for e in edits)
+        # Unchanged ends mean the start or end of the log (rows after the last index entry are not in its range)
+        return (start if start > int(indexed[0]) else 0.0, stop + 1 if stop < int(indexed[1]) else 0.0)
+
+    # Connected to loader.log_loaded
+    @QtCore.pyqtSlot(str, list)
+    def showLog(self, file_name: str, segments: list):
+        """[summary]
+        Draws a log read by the loader. Singles and pairs go to the counts graph, zoomed out to the whole log (pan and
+        zoom then go through the min/max pyramid as for a long live run), g2 rows are summed into the histogram.
+        Segments of a different mode than the first are left out, as in binary_to_csv.
+        """
+        self.loadLog_Button.setEnabled(True)
+        self.loadLog_Button.setText('Load Log')
+        if self.acq_flag == True:
+            return
+        mode = segments[0].meta.get('mode', 'singles') if segments else None
+        segments = [s for s in segments if s.meta.get('mode', 'singles') == mode and len(s)]
+        if mode not in ('g2', 'timestamps'):
+            # Counts rows need at least the 4 singles columns; times and values come from the same segments
+            segments = [s for s in segments if s.values.shape[1] >= 4]
+        if mode == 'timestamps' or not segments:
+            self.loadFailed(file_name, 'It holds no counts or g2 rows (raw timestamps are re-analysed with ' \
+                'tdc1_analysis.g2_from_raw_log).')
+            return
+        name = os.path.basename(file_name)
+        rows = sum(len(s) for s in segments)
+        if mode == 'g2':
+            self.resetg2Plot()
+            for segment in segments:
+                self.g2_hist.add(segment.values.sum(axis=0), segment.meta.get('bin_width', self.binsize), len(segment))
+            self.binsize = self.g2_hist.bin_width
+            self.x0 = self.g2_hist.time_bins()
+            self._g2_plotted = True
+            self._histogram_dirty = True
+            self.tabs.setCurrentWidget(self.tab2)
+            self.tdcPlot2.setTitle(f'Coincidences Histogram ({name})')
+            self.requestFit()
+        else:
+            self.resetCountsPlot()
+            times = np.concatenate([s.time for s in segments])
+            values = np.concatenate([s.values[:, :8] for s in segments]).T
+            times = times - times[0]
+            self.counts_pyramid.extend(times, values)
+            self.counts_history.extend(times, values)
+            # The log does not record the integration time; the spacing of its rows is close to it
+            self.count_stats.add(values, float(np.median(np.diff(times))) if len(times) > 1 else 1.0)
+            self._label_values = (values[0:4, -1] if mode == 'singles' else values[4:8, -1]).tolist()
+            self._counts_plotted = True
+            for button in (self.radio1_Button, self.radio2_Button, self.radio3_Button, self.radio4_Button):
+                button.setChecked(True)
+            self.enableSinglesOptions()
+            self.updatePlots(self._radio_flags)
+            self.tdcPlot.setXRange(times[0], times[-1], padding=0) # Auto-range off, so the whole log is drawn
+            self.tabs.setCurrentWidget(self.tab1)
+            self.tdcPlot.setTitle(f'Counts Graph ({name})')
+        self._data_plotted = self._counts_plotted or self._g2_plotted
+        print(f'Loaded {rows} {mode} rows from {file_name}.')
+
+    # Connected to loader.load_failed
+    @QtCore.pyqtSlot(str, str)
+    def loadFailed(self, file_name: str, message: str):
+        self.loadLog_Button.setEnabled(True)
+        self.loadLog_Button.setText('Load Log')
+        msgBox = QtWidgets.QMessageBox()
+        msgBox.setIcon(QtWidgets.QMessageBox.Warning)
+        msgBox.setText(f'Cannot load {file_name}. {message}')
+        msgBox.setWindowTitle('Load Log')
+        msgBox.exec()
+
+    # Connected to scanner.devices_found
+    @QtCore.pyqtSlot(list)
+    def updateDevList(self, devices: list):
+        self.dev_list = devices
+        current = self.devCombobox.currentText()
+        self.devCombobox.blockSignals(True) # The selected device stays selected
         self.devCombobox.clear()
         self.devCombobox.addItem('Select your device')
-        devices = serial_connection.search_for_serial_devices(tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
-        try:
-            serial_connection.search_for_serial_devices(tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
-        except:
-            pass
         self.devCombobox.addItems(devices)
+        if current in devices:
+            self.devCombobox.setCurrentText(current)
+        self.devCombobox.blockSignals(False)
+        if self.devices and self.devices.acq_flag == False:
+            self.devices.setDevices(devices)
 
     # Connected to modesCombobox.currentTextChanged
     @QtCore.pyqtSlot(str)
@@ -661,7 +1427,7 @@ class MainWindow(QMainWindow):
                 self.log_flag = False
                 self.acq_flag = False
                 if self._tdc1_dev == None:
-                    self._tdc1_dev = tdc1.TimeStampTDC1(self._dev_path)
+                    self._tdc1_dev = open_device(self._dev_path)
                 if newMode == 'g2':
                     self._tdc1_dev.mode = 'timestamp'
                     self.samplesSpinbox.setEnabled(True)
@@ -677,7 +1443,7 @@ class MainWindow(QMainWindow):
                 self.modesCombobox.setCurrentText(self._dev_mode_prev)
         elif self._dev_selected == True and self.acq_flag == False and self._data_plotted == False:
             if self._tdc1_dev == None:
-                    self._tdc1_dev = tdc1.TimeStampTDC1(self._dev_path)
+                    self._tdc1_dev = open_device(self._dev_path)
             if newMode == 'g2':
                 self._tdc1_dev.mode = 'timestamp'
                 self.samplesSpinbox.setEnabled(True)
@@ -700,6 +1466,7 @@ class MainWindow(QMainWindow):
         # self.logger_thread = None # and thread...?
         # self._tdc1_dev = None # Destroy tdc1_dev object
         self.stopTimer()
+        self.stopFitLog()
         self.acq_flag = False
         self.modesCombobox.setEnabled(True)
         self.levelsComboBox.setEnabled(True)
@@ -707,35 +1474,55 @@ class MainWindow(QMainWindow):
         self.runtimeSpinbox.setEnabled(True)
         self.runtime_Checkbox.setEnabled(True)
         self.selectLogfile_Button.setEnabled(True)
+        self.rotateCombobox.setEnabled(True)
+        self.updateRotation()
+        self.processCheckbox.setEnabled(True)
+        self.pipelinedCheckbox.setEnabled(True)
         self.liveStart_Button.setText("Live Start")
 
-    @QtCore.pyqtSlot('PyQt_PyObject')
-    def logfile_permission_error_reset(self, dev):
-        msgBox = QtWidgets.QMessageBox()
-        msgBox.setIcon(QtWidgets.QMessageBox.Critical)
-        msgBox.setText('Ensure logfile is not open in another program.')
-        msgBox.setWindowTitle('Permission Error')
-        msgBox.setStandardButtons(QMessageBox.Ok)
-        msgBox.exec()
-        # if dev._com.isOpen():
-        #     dev._com.close()
-        # self.logger = None # Destroy logger
-        # self.logger_thread = None # and thread...?
-        # self._tdc1_dev = None # Destroy tdc1_dev object
-        self.stopTimer()
-        self.acq_flag = False
-        self.modesCombobox.setEnabled(True)
-        self.levelsComboBox.setEnabled(True)
-        self.devCombobox.setEnabled(True)
-        self.runtimeSpinbox.setEnabled(True)
-        self.runtime_Checkbox.setEnabled(True)
-        self.selectLogfile_Button.setEnabled(True)
-        self.liveStart_Button.setText("Live Start")
+    # Connected to logfile_message signal. Writer problems (e.g. logfile open in another program) no longer stop the run;
+    # rows are buffered until the file can be written again.
+    @QtCore.pyqtSlot(str)
+    def logfile_status(self, message: str):
+        self.logfileText.setText(self._logfile_name + '\n' + message)
 
     # Update plot index on plot tab change
     @QtCore.pyqtSlot()
     def update_plot_tab(self):
         self._plot_tab = self.tabs.currentIndex()
+        if self.tabs.currentWidget() is self.tab2 and self.tdcPlot2 is None:
+            self.buildg2Plot()
+        elif self.tabs.currentWidget() is self.devicesTab and self.devices is None:
+            self.devices = DeviceManager(self)
+            self.devicesTab.layout().addWidget(self.devices)
+        elif self.tabs.currentWidget() is self.statsTab and self.stats is None:
+            self.stats = StatsPanel(self)
+            self.statsTab.layout().addWidget(self.stats)
+        elif self.tabs.currentWidget() is self.runStatsTab and self.runStats is None:
+            self.runStats = RunStatsPanel(self)
+            self.runStatsTab.layout().addWidget(self.runStats)
+
+    def buildg2Plot(self):
+        """[summary]
+        Creates the g2 histogram plot. Deferred until the g2 tab is first shown to keep start-up fast; any g2 data
+        received before then is drawn on the next frame.
+        """
+        labelStyle = '<span style=\"color:black;font-size:25px\">'
+        font = QtGui.QFont("Arial", 24)
+        self.tdcPlot2 = pg.PlotWidget(title = "Coincidences Histogram")
+        self.tdcPlot2.setBackground('w')
+        self.tdcPlot2.setLabel('left', labelStyle + 'Coincidences')
+        self.tdcPlot2.setLabel('bottom', labelStyle + 'Time Delay (ns)')
+        self.tdcPlot2.getAxis('left').tickFont = font
+        self.tdcPlot2.getAxis('bottom').tickFont = font
+        self.tdcPlot2.getAxis('bottom').setPen(color='k')
+        self.tdcPlot2.getAxis('left').setPen(color='k')
+        self.tdcPlot2.showGrid(y=True)
+        self.histogramPlot = self.tdcPlot2.plot(self.x0, self.g2_hist.histogram, pen=self.lineStyle0, symbol = 'x', symbolPen = 'b', symbolBrush = 0.2)
+        self.recentHistogramPlot = self.tdcPlot2.plot([], [], pen=pg.mkPen(width=2, color='g'))
+        self.fitPlot = self.tdcPlot2.plot([], [], pen=pg.mkPen(width=2, color='r'))
+        self.layout2.addWidget(self.tdcPlot2, 0, 0, 5, 5)
+        self._histogram_dirty = True
 
     # Update integration time on spinbox value change
     @QtCore.pyqtSlot(int)
@@ -743,19 +1530,103 @@ class MainWindow(QMainWindow):
         self.integration_time = int_time * 1e-3
         if self.logger:
             self.logger.int_time = int_time * 1e-3
+        if self.recent_seconds:
+            self.updateRecentWindow(self.recent_seconds)
 
     @QtCore.pyqtSlot(int)
     def updateBins(self, bins: int):
         self.bins = bins
         if self.logger:
             self.logger.bins = bins
+        # Plot Samples also sets how much counts history is kept
+        self.plotSamples = bins
+        self.counts_history.resize(bins)
+        if self._counts_plotted:
+            self.updatePlots(self._radio_flags)
 
     @QtCore.pyqtSlot(int)
     def updateOffset(self, offset: int):
         self.offset = offset
+        # Each start/stop pair remembers its own offset; the continuous g2 applies all of them at once
+        self.pair_delays[self._ch_start - 1, self._ch_stop - 1] = offset
         if self.logger:
             self.logger.offset = offset
 
+    def reopenDevice(self):
+        # After a run in a separate process, which closes the port. A new device object starts in singles mode at its
+        # default level, so the mode and level chosen in the GUI are set again
+        self._tdc1_dev = open_device(self._dev_path)
+        if self._dev_mode:
+            self._tdc1_dev.mode = 'timestamp' if self._dev_mode == 'g2' else self._dev_mode
+        if self._level:
+            self._tdc1_dev.level = self._level
+
+    # Connected to autoDelay_Button.clicked
+    @QtCore.pyqtSlot()
+    def autoDelay(self):
+        """[summary]
+        Captures a batch of timestamps in the finder thread and, once showDelay has the delay of the stop channel
+        behind the start channel, sets the offset that puts the peak in the middle of the histogram.
+        """
+        if self.acq_flag == True:
+            print('Stop the run before searching for the delay.')
+            return
+        if self._dev_mode != 'g2' or self._dev_selected == False:
+            print('Select a device in g2 mode to search for the delay.')
+            return
+        if self._tdc1_dev == None:
+            self.reopenDevice()
+        if self.finder is None:
+            self.finder = delayFinder()
+            self.finder_thread = QtCore.QThread(self)
+            self.finder.moveToThread(self.finder_thread)
+            self.delay_requested.connect(self.finder.find)
+            self.finder.delay_found.connect(self.showDelay)
+            self.finder.search_failed.connect(self.delaySearchFailed)
+            self.finder_thread.start()
+        # The device is busy until the search is done: nothing else may write to its port, and the pair and bin width
+        # the offset is worked out for stay as they are
+        self.liveStart_Button.setEnabled(False)
+        self.modesCombobox.setEnabled(False)
+        self.levelsComboBox.setEnabled(False)
+        self.devCombobox.setEnabled(False)
+        self.disableg2Options()
+        self.autoDelay_Button.setText('Searching...')
+        self.delay_requested.emit(self._tdc1_dev, self._ch_start, self._ch_stop)
+
+    # Connected to finder.delay_found
+    @QtCore.pyqtSlot(object)
+    def showDelay(self, result: dict):
+        self.delaySearchDone()
+        if result is None:
+            self.delaySearchFailed(f'No coincidence peak between channels {self._ch_start} and {self._ch_stop} ' \
+                f'within {AUTO_DELAY_RANGE / 1000:g} us either way.')
+            return
+        window = self.bins * self.resolutionSpinbox.value()
+        offset = int(window // 2 - result['delay'])
+        offset = min(max(offset, self.offsetSpinbox.minimum()), self.offsetSpinbox.maximum())
+        self.offsetSpinbox.setValue(offset)
+        print(f"Stop channel {self._ch_stop} is {result['delay']} ns behind start channel {self._ch_start} " \
+            f"({result['pairs']} pairs); offset set to {offset} ns.")
+
+    # Connected to finder.search_failed
+    @QtCore.pyqtSlot(str)
+    def delaySearchFailed(self, message: str):
+        self.delaySearchDone()
+        msgBox = QtWidgets.QMessageBox()
+        msgBox.setIcon(QtWidgets.QMessageBox.Warning)
+        msgBox.setText(message)
+        msgBox.setWindowTitle('Auto Delay')
+        msgBox.exec()
+
+    def delaySearchDone(self):
+        self.liveStart_Button.setEnabled(True)
+        self.modesCombobox.setEnabled(True)
+        self.levelsComboBox.setEnabled(True)
+        self.devCombobox.setEnabled(True)
+        self.enableg2Options()
+        self.autoDelay_Button.setText('Auto Delay')
+
     # Click Live Start button to get started!
     @QtCore.pyqtSlot()
     # Connected to self.liveStart_button.clicked
@@ -780,25 +1651,30 @@ class MainWindow(QMainWindow):
             self.devCombobox.setEnabled(True)
             self.runtimeSpinbox.setEnabled(True)
             self.runtime_Checkbox.setEnabled(True)
-            self._tdc1_dev._com.reset_input_buffer()
+            self.processCheckbox.setEnabled(True)
+            self.pipelinedCheckbox.setEnabled(True)
+            if self._tdc1_dev: # None after a run in a separate process, which closes the port itself
+                self._tdc1_dev._com.reset_input_buffer()
         #If not currently live plotting, pressing the button starts plotting
         elif self.acq_flag is False and self.liveStart_Button.text() == "Live Start":
             self.liveStart_Button.setEnabled(False)
             QtCore.QTimer.singleShot(1000, lambda: self.liveStart_Button.setEnabled(True))
             if self._tdc1_dev == None:
-                self._tdc1_dev = tdc1.TimeStampTDC1(self.devCombobox.currentText())
+                self.reopenDevice()
             self.acq_flag = True
             if self._data_plotted == True:
                 if self.modesCombobox.currentText() == 'g2' and self._g2_plotted == True:
                     msgBox = QtWidgets.QMessageBox()
                     msgBox.setIcon(QtWidgets.QMessageBox.Information)
-                    msgBox.setText('A g2 plot already exists. Clear the old plot and start anew?')
+                    msgBox.setText('A g2 plot already exists. Clear the old plot and start anew, or continue ' \
+                        'accumulating it?' + self.g2DiscardNote())
                     msgBox.setWindowTitle('Existing g2 Plot')
-                    msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+                    msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Yes | QMessageBox.Cancel)
+                    msgBox.button(QMessageBox.Yes).setText('Continue')
                     returnValue = msgBox.exec()
                     if returnValue == QMessageBox.Ok:
                         self.resetg2Plot()
-                    else:
+                    elif returnValue != QMessageBox.Yes:
                         return
                 elif self.modesCombobox.currentText() == 'singles' and self._counts_plotted == True:
                     msgBox = QtWidgets.QMessageBox()
@@ -823,11 +1699,15 @@ class MainWindow(QMainWindow):
                     else:
                         return
             self.selectLogfile_Button.setEnabled(False)
+            self.rotateCombobox.setEnabled(False)
+            self.updateRotation()
             self.modesCombobox.setEnabled(False)
             self.levelsComboBox.setEnabled(False)
             self.devCombobox.setEnabled(False)
             self.runtimeSpinbox.setEnabled(False)
             self.runtime_Checkbox.setEnabled(False)
+            self.processCheckbox.setEnabled(False)
+            self.pipelinedCheckbox.setEnabled(False)
             if self._dev_mode == 'singles' or self._dev_mode == 'pairs':
                 self.enableSinglesOptions()
                 self.resetRadioButtons()
@@ -844,27 +1724,52 @@ class MainWindow(QMainWindow):
     # Logging
     def startLogging(self):
         """[summary]
-        Creation process of worker object and QThread.
+        Creation process of worker object and QThread, or with Separate process checked, of the AcquisitionProcess
+        that takes their place. Stage timings of a separate process (acquire, log_write...) stay in that process.
         """
-        # Create worker instance and a thread
-        self.logger = logWorker()
-        self.logger_thread = QtCore.QThread(self) # QThread is not a thread, but a thread MANAGER
+        if self.process is not None:
+            # Its shared memory is only read by this window, so it can go once the next run starts
+            self.process.close()
+            self.process = None
+            self.counts_exchange = new_counts_exchange()
+            self.g2_exchange = DoubleBuffer(HistogramBlock)
+        if self.processCheckbox.isChecked():
+            # The child opens the device itself; the window's port is reopened when it is next needed
+            self._tdc1_dev._com.close()
+            self._tdc1_dev = None
+            level = 'TTL' if self.levelsComboBox.currentText().startswith('TTL') else 'NIM'
+            self.process = AcquisitionProcess(self._dev_path, self._dev_mode, level)
+            self.counts_exchange, self.g2_exchange = self.process.counts, self.process.g2
+            self.logger = self.process # Settings are forwarded to the child as for a logWorker
+            self.logger_thread = None
+        else:
+            # Create worker instance and a thread
+            self.logger = logWorker(counts_exchange=self.counts_exchange, g2_exchange=self.g2_exchange)
+            self.logger_thread = QtCore.QThread(self) # QThread is not a thread, but a thread MANAGER
 
-        # Assign worker to the thread and start the thread
-        self.logger.moveToThread(self.logger_thread)
-        self.logger_thread.start() # This is where the thread is actually created, I think
+            # Assign worker to the thread and start the thread
+            self.logger.moveToThread(self.logger_thread)
+            self.logger_thread.start() # This is where the thread is actually created, I think
 
-        # Connect signals and slots AFTER moving the object to the thread
-        self.logging_requested.connect(self.logger.log_which_data)
-        self.logger.data_is_logged.connect(self.update_counts_plot_from_thread)
-        self.logger.histogram_logged.connect(self.updateHistogram)
-        self.logger.thread_finished.connect(self.closethreads_ports_timers)
-        self.logger.permission_error.connect(self.logfile_permission_error_reset)
+            # Connect signals and slots AFTER moving the object to the thread
+            self.logging_requested.connect(self.logger.log_which_data)
+            self.logger.thread_finished.connect(self.closethreads_ports_timers)
+            self.logger.logfile_message.connect(self.logfile_status)
 
         self.logger.int_time = int(self.integrationSpinBox.text()) * 1e-3 # Convert to seconds
+        self.logger.bins = self.bins
+        self.logger.stream = self.streamCheckbox.isChecked()
+        self.logger.pipelined = self.pipelinedCheckbox.isChecked()
+        self.logger.log_rotate_bytes, self.logger.log_rotate_interval, self.logger.log_compress = self.logRotation()
+        self.logger.pair_delays = self.pair_delays # Shared, so offset changes reach the running analysis
         #self.log_flag = True
-        self.logging_requested.emit(self.integration_time, self._logfile_name, self._dev_path, self.log_flag, self._dev_mode, \
-            self._tdc1_dev, self._ch_start, self._ch_stop, self.offset, self.bin_width)
+        self.startFitLog()
+        if self.process is not None:
+            self.process.start(self.integration_time, self._logfile_name, self.log_flag, self._ch_start, self._ch_stop, \
+                self.offset, self.bin_width)
+        else:
+            self.logging_requested.emit(self.integration_time, self._logfile_name, self._dev_path, self.log_flag, \
+                self._dev_mode, self._tdc1_dev, self._ch_start, self._ch_stop, self.offset, self.bin_width)
         
 
     @QtCore.pyqtSlot()
@@ -873,8 +1778,10 @@ class MainWindow(QMainWindow):
             if self.selectLogfile_Button.text() == 'Select Logfile':
                 default_filetype = 'csv'
                 start = datetime.now().strftime("%Y%m%d_%Hh%Mm%Ss ") + "_TDC1." + default_filetype
+                # The binary format is much smaller and faster to load for g2 runs; convert with tdc1_logging.py
                 self._logfile_name = QtWidgets.QFileDialog.getSaveFileName(
-                    self, "Save to log file", start)[0]
+                    self, "Save to log file", start, \
+                    "CSV (*.csv);;TDC1 binary log (*" + BINARY_LOG_EXTENSION + ")")[0]
                 self.logfileText.setText(self._logfile_name)
                 if self._logfile_name != '':
                     #self.startLogging_Button.setEnabled(True)
@@ -886,59 +1793,120 @@ class MainWindow(QMainWindow):
                 self.log_flag = False
                 self.selectLogfile_Button.setText('Select Logfile')
 
+    @QtCore.pyqtSlot()
+    def updateRotation(self):
+        # Only completed segments are compressed, so compression needs rotation
+        self.compressCombobox.setEnabled(self.rotateCombobox.isEnabled() and \
+            self.rotateCombobox.currentText() != 'No rotation')
+
+    def logRotation(self):
+        """[summary]
+        Rotation settings picked for the logfile, as (rotate_bytes, rotate_interval, compress) for the logWorker.
+        """
+        rotate_bytes, rotate_interval = LOG_ROTATIONS[self.rotateCombobox.currentText()]
+        compress = self.compressCombobox.currentText() if rotate_bytes or rotate_interval else ''
+        return rotate_bytes, rotate_interval, '' if compress == 'No compression' else compress
+
 
     # Updating data
-    # Connected to data_is_logged signal
-    @QtCore.pyqtSlot(float, float, tuple, str, list)
-    def update_counts_plot_from_thread(self, start: float, now: float, data: tuple, dev_mode: str, radio_flags: list):
-        #print(f'data is {data}')
-        next_time = now-start
-        if len(self.x) == PLT_SAMPLES:
-            # If hit sample limit, throw out 1st data point before adding new one
-            self.x = self.x[1:]
-            self.x.append(next_time)
-            self.y1 = self.y1[1:]; self.y2 = self.y2[1:]; self.y3 = self.y3[1:]; self.y4 = self.y4[1:]
-            self.y1.append(data[0]); self.y2.append(data[1]); self.y3.append(data[2]); self.y4.append(data[3])
-            self.y_data = [self.y1, self.y2, self.y3, self.y4]
-        elif len(self.x) < self.plotSamples:
-            # Otherwise, just append new data point
-            self.x.append(next_time)
-            self.y1.append(data[0]); self.y2.append(data[1]); self.y3.append(data[2]); self.y4.append(data[3])
-            self.idx = min(len(self.y1), self.plotSamples)
-            self.y1 = self.y1[-self.idx:]; self.y2 = self.y2[-self.idx:]; self.y3 = self.y3[-self.idx:]; self.y4 = self.y4[-self.idx:]
-            self.y_data = [self.y1, self.y2, self.y3, self.y4]
-            self._radio_flags = radio_flags
-        elif len(self.x) > self.plotSamples:
-            # If user reduces plot samples to less than already plotted, truncate as requested. We truncate one more data point than requested
-            # since we add the new one right after.
-            cutoff_idx = self.plotSamples + 1
-            self.x = self.x[-cutoff_idx:]
-            self.x.append(next_time)
-            self.y1 = self.y1[-cutoff_idx:]; self.y2 = self.y2[-cutoff_idx:]; self.y3 = self.y3[-cutoff_idx:]; self.y4 = self.y4[-cutoff_idx:]
-            self.y1.append(data[0]); self.y2.append(data[1]); self.y3.append(data[2]); self.y4.append(data[3])
-            self.y_data = [self.y1, self.y2, self.y3, self.y4]
-        if dev_mode == 'singles':
+    # Called from renderFrame with the front buffer of counts_exchange: the samples that arrived since the last frame.
+    # times has one entry per sample, values one column per sample (singles 1-4, then pairs).
+    def updateCounts(self, block: SampleBlock):
+        ingest_start = time.perf_counter()
+        times, values = block.view()
+        METRICS.record('handoff', time.time() - times[0])
+        times -= block.start # In place: the front buffer is ours until the next swap
+        # Ring buffer overwrites the oldest sample once Plot Samples points are stored; no lists are rebuilt
+        self.counts_history.extend(times, values)
+        self.counts_pyramid.extend(times, values)
+        self.count_stats.add(values, self.integrationSpinBox.value() * 1e-3)
+        if self._dev_mode == 'singles':
             # Counts labels will show single channel counts
-            self.Ch1CountsLabel.setText(str(data[0]))
-            self.Ch2CountsLabel.setText(str(data[1]))
-            self.Ch3CountsLabel.setText(str(data[2]))
-            self.Ch4CountsLabel.setText(str(data[3]))
-        elif dev_mode == 'pairs':
+            self._label_values = values[0:4, -1].tolist()
+        elif self._dev_mode == 'pairs':
             # Counts labels will show Ch 1-3, 1-4, 2-3, 2-4 coincidences
-            self.Ch1CountsLabel.setText(str(data[4]))
-            self.Ch2CountsLabel.setText(str(data[5]))
-            self.Ch3CountsLabel.setText(str(data[6]))
-            self.Ch4CountsLabel.setText(str(data[7]))
+            self._label_values = values[4:8, -1].tolist()
         self._counts_plotted = True
         self._data_plotted = self._counts_plotted or self._g2_plotted
         self.updatePlots(self._radio_flags)
+        METRICS.record('gui_counts', time.perf_counter() - ingest_start)
     
     # Updating plots 1-4
     def updatePlots(self, radio_flags: list):
-        for i in range(len(radio_flags)):
-            # Only show plots with the Radio button selected
-            if radio_flags[i] == 1:
-                self.linePlots[i].setData(self.x[-self.idx:], self.y_data[i][-self.idx:])
+        # Drawing happens in renderFrame; curves of unchecked channels stay dirty until they are shown
+        self._curves_dirty = [True, True, True, True]
+
+    # Connected to render_timer.timeout. Takes whatever data the worker has written since the last frame and redraws what
+    # changed, at most render_fps times a second however fast data arrives.
+    @QtCore.pyqtSlot()
+    def renderFrame(self):
+        tick = time.perf_counter()
+        if self._last_frame is not None:
+            # Ticks the timer could not deliver because the event loop was busy count as dropped frames
+            missed = int((tick - self._last_frame) / (self.render_timer.interval() * 1e-3) - 0.5)
+            if missed > 0:
+                METRICS.increment('dropped_frames', missed)
+        self._last_frame = tick
+        if self.process is not None:
+            for kind, value in self.process.events():
+                if kind == 'message':
+                    self.logfile_status(value)
+                elif kind == 'finished':
+                    self.closethreads_ports_timers(None)
+        block = self.counts_exchange.swap()
+        if block is not None and len(block):
+            self.updateCounts(block)
+        block = self.g2_exchange.swap()
+        if block is not None and block.acquisitions:
+            self.updateHistogram(block)
+        frame_start = time.perf_counter()
+        drawn = any(self._curves_dirty) or self._label_values is not None or self._histogram_dirty
+        if any(self._curves_dirty):
+            t, y = self.countsPlotData()
+            for i in range(len(self._radio_flags)):
+                if self._curves_dirty[i] and self._radio_flags[i] == 1:
+                    self.linePlots[i].setData(t, y[i])
+                    self._curves_dirty[i] = False
+        if self._label_values is not None:
+            for label, value in zip(self.countsLabels, self._label_values):
+                text = str(value)
+                if label.text() != text:
+                    label.setText(text)
+            self._label_values = None
+        if self._histogram_dirty:
+            self._histogram_dirty = False
+            if self.histogramPlot:
+                self.histogramPlot.setData(self.x0, self.g2_hist.histogram)
+            text = "Total Pairs: " + "<br>" + str(self.g2_hist.total)
+            if self.g2_hist.window:
+                if self.recentHistogramPlot:
+                    self.recentHistogramPlot.setData(self.x0, self.g2_hist.recent)
+                text += "<br>" + f"Last {self.recent_seconds}s: " + "<br>" + str(self.g2_hist.recent_total)
+            self.g2RateLabel.setText(text)
+        if drawn:
+            METRICS.record('render', time.perf_counter() - frame_start)
+
+    def countsPlotData(self):
+        """[summary]
+        Data for the counts curves. While the graph auto-scrolls, this is the last Plot Samples points. Once the user pans
+        or zooms (X auto-range off), it is the whole-run history at the resolution of the visible range, about two points
+        per pixel, so hours of data can be browsed without drawing every sample.
+        """
+        vb = self.tdcPlot.getViewBox()
+        if vb.autoRangeEnabled()[0]:
+            return self.counts_history.view()
+        x0, x1 = vb.viewRange()[0]
+        return self.counts_pyramid.query(x0, x1, max(1, int(vb.width())))
+
+    # Connected to the counts graph's sigXRangeChanged
+    @QtCore.pyqtSlot()
+    def countsRangeChanged(self):
+        if not self.tdcPlot.getViewBox().autoRangeEnabled()[0]:
+            self.updatePlots(self._radio_flags)
+
+    def setRenderFps(self, fps: float):
+        self.render_fps = fps
+        self.render_timer.setInterval(int(1000 / fps))
 
     # Radio button slots (functions)
 
@@ -946,7 +1914,6 @@ class MainWindow(QMainWindow):
     @QtCore.pyqtSlot('PyQt_PyObject')
     def displayPlot1(self, b: QRadioButton):
         if b.isChecked() == True:
-            # Possible to clear self.x and self.y1 without disrupting the worker loop?
             self._radio_flags[0] = 1
             self.updatePlots(self._radio_flags)
             self.linePlot1.setPen(self.lineStyle1)
@@ -1011,6 +1978,7 @@ class MainWindow(QMainWindow):
             if self.logger:
                 self.logger.ch_start = cs
                 print('logger start channel is now: ' + str(self.logger.ch_start))
+        self.selectPair()
 
     @QtCore.pyqtSlot(str)
     def updateStop(self, channel: str):
@@ -1020,6 +1988,22 @@ class MainWindow(QMainWindow):
             if self.logger:
                 self.logger.ch_stop = cs
                 print('logger stop channel is now: ' + str(self.logger.ch_stop))
+        self.selectPair()
+
+    def selectPair(self):
+        """[summary]
+        Shows the offset of the newly selected start/stop pair and, if the continuous g2 has been filling all pairs,
+        switches the histogram to that pair straight away.
+        """
+        pair = (self._ch_start, self._ch_stop)
+        if pair not in CHANNEL_PAIRS:
+            return
+        self.offsetSpinbox.setValue(int(self.pair_delays[pair[0] - 1, pair[1] - 1]))
+        if self.g2_pairs is not None:
+            self.g2_hist = self.g2_pairs[pair]
+            self.x0 = self.g2_hist.time_bins()
+            self._histogram_dirty = True
+            self.requestFit()
 
     @QtCore.pyqtSlot(str)
     def updateLevel(self, level: str):
@@ -1039,35 +2023,138 @@ class MainWindow(QMainWindow):
             pass
 
     # Histogram
-    # Connected to histogram_logged signal
-    @QtCore.pyqtSlot(dict, int, int)
-    def updateHistogram(self, g2_data: dict, bins: int, bin_width: int):
-        # {int - ch_start counts, int- ch_stop counts, int - actual acq time, float - time bins, float - histogram values}
-        # time bins and histogram vals are both np arrays
-        incremental_y = g2_data['histogram']
-        incremental_y_int = incremental_y.astype(np.int32)
-        beans = len(incremental_y_int)
-        self.y0 = self.wonkyAdd(y0 = self.y0, incremental = incremental_y_int)
-        self.x0 = np.arange(0, beans*bin_width, bin_width)
-        self.histogramPlot.setData(self.x0, self.y0)
-        totalpairs = np.sum(self.y0, dtype=np.int32)
+    # Called from renderFrame with the front buffer of g2_exchange: the sum of the acquisitions since the last frame
+    def updateHistogram(self, block: HistogramBlock):
+        ingest_start = time.perf_counter()
+        METRICS.record('handoff', time.time() - block.first)
+        bins = block.histograms.shape[1]
+        bin_width = block.bin_width
+        # int64 accumulation with running totals; see HistogramAccumulator for what happens when bins/bin width change
+        if len(block.histograms) == len(CHANNEL_PAIRS):
+            # Continuous g2 fills every channel pair, so the displayed pair can be switched without losing data
+            if self.g2_pairs is None:
+                self.g2_pairs = {pair: HistogramAccumulator(bins, bin_width, window=self.g2_hist.window) \
+                    for pair in CHANNEL_PAIRS}
+            for pair, row in zip(CHANNEL_PAIRS, block.histograms):
+                self.g2_pairs[pair].add(row, bin_width, block.acquisitions)
+            self.g2_hist = self.g2_pairs.get((self._ch_start, self._ch_stop), self.g2_hist)
+        else:
+            # Only the displayed pair is measured. The other pairs of an earlier continuous g2 (or a restored one) are
+            # kept while they match its bins
+            pair = (self._ch_start, self._ch_stop)
+            if self.g2_pairs is not None and (self.g2_pairs.get(pair) is not self.g2_hist or \
+                    bins != self.g2_hist.bins or bin_width != self.g2_hist.bin_width):
+                self.g2_pairs = None
+            self.g2_hist.add(block.histograms[0], bin_width, block.acquisitions)
+        # Only the bins this block touched are written to the checkpoint's pages
+        hists = [self.g2_hist] if self.g2_pairs is None else [self.g2_pairs[pair] for pair in CHANNEL_PAIRS]
+        increments = block.histograms
+        if len(increments) != len(hists): # One measured pair in the checkpoint's row for every pair
+            increments = np.zeros((len(hists), bins), dtype=np.int64)
+            increments[CHANNEL_PAIRS.index((self._ch_start, self._ch_stop))] = block.histograms[0]
+        self.g2_checkpoint.update(hists, increments, self._ch_start, self._ch_stop, self.pair_delays)
+        if len(self.x0) != self.g2_hist.bins or self.binsize != bin_width:
+            self.binsize = bin_width
+            self.x0 = self.g2_hist.time_bins()
         self._g2_plotted = True
         self._data_plotted = self._counts_plotted or self._g2_plotted
-        self.g2RateLabel.setText("Total Pairs: " + "<br>" + str(totalpairs))
-    
-    @staticmethod
-    def wonkyAdd(y0: np.array, incremental: np.array):
-        if len(y0) == len(incremental):
-            y0 += incremental
-        elif len(y0) < len(incremental):
-            diff = len(incremental) - len(y0)
-            pad = np.zeros(diff, dtype = np.int32)
-            y0 = np.append(y0, pad)
-            y0 += incremental
-        elif len(y0) > len(incremental):
-            y0 = y0[:len(incremental)]
-            y0 += incremental
-        return y0
+        self._histogram_dirty = True # Plot and Total Pairs label are redrawn in this frame
+        self.requestFit()
+        METRICS.record('gui_histogram', time.perf_counter() - ingest_start)
+
+    # Connected to fitCheckbox.toggled
+    @QtCore.pyqtSlot(bool)
+    def updateFit(self, checked: bool):
+        self.fitLogCheckbox.setEnabled(checked)
+        if checked:
+            self.requestFit()
+        else:
+            self.clearFit()
+
+    def requestFit(self):
+        """[summary]
+        Hands the displayed histogram to the g2Fitter if Fit peak is ticked and it has changed enough since the last
+        fit: another pair, bin width or number of bins, or G2_FIT_MIN_CHANGE more counts. While a fit runs, the latest
+        request waits for it, so fits never queue up.
+        """
+        if self.fitCheckbox.isChecked() == False or self.g2_hist.total == 0:
+            return
+        if self._fit_busy == True:
+            self._fit_pending = True
+            return
+        key = (self.g2_hist.bin_width, self.g2_hist.bins, self._ch_start, self._ch_stop)
+        if key == self._fit_key and self.g2_hist.total < self._fit_total * (1 + G2_FIT_MIN_CHANGE):
+            return
+        if self.fitter is None:
+            self.fitter = g2Fitter()
+            self.fitter_thread = QtCore.QThread(self)
+            self.fitter.moveToThread(self.fitter_thread)
+            self.fit_requested.connect(self.fitter.fit)
+            self.fitter.fitted.connect(self.showFit)
+            self.fitter_thread.start()
+        self.fitter.writer = self.fit_writer
+        self._fit_key = key
+        self._fit_total = self.g2_hist.total
+        self._fit_busy = True
+        self._fit_pending = False
+        self.fit_requested.emit(key, self.g2_hist.time_bins(), self.g2_hist.histogram.copy())
+
+    # Connected to fitter.fitted
+    @QtCore.pyqtSlot(object, object)
+    def showFit(self, key: tuple, result: dict):
+        self._fit_busy = False
+        if self.fitCheckbox.isChecked() == False:
+            return
+        if key == self._fit_key:
+            # Otherwise the histogram was cleared or switched to another pair while fitting
+            if result is None:
+                if self.fitPlot:
+                    self.fitPlot.setData([], [])
+                self.g2FitLabel.setText("No peak found")
+            else:
+                if self.fitPlot:
+                    delays = np.linspace(self.x0[0], self.x0[-1], 4 * len(self.x0))
+                    self.fitPlot.setData(delays, g2_peak_model(delays, result['params']))
+                self.g2FitLabel.setText(f"Peak: {result['position']:.2f} ns<br>FWHM: {result['fwhm']:.2f} ns<br>" \
+                    f"Height: {result['height']:.1f}<br>Background: {result['background']:.1f}<br>" \
+                    f"g2(0): {result['g2_0']:.2f}")
+        if self._fit_pending == True:
+            self.requestFit()
+
+    def clearFit(self):
+        self._fit_key = None
+        self._fit_total = 0
+        self._fit_pending = False
+        if self.fitPlot:
+            self.fitPlot.setData([], [])
+        self.g2FitLabel.setText("")
+
+    def startFitLog(self):
+        # Fits go to their own logfile next to the g2 logfile, whose rows hold histogram bins only
+        if self.log_flag == True and self._dev_mode == 'g2' and self.fitCheckbox.isChecked() and \
+                self.fitLogCheckbox.isChecked() and self._logfile_name:
+            self.fit_writer = LogWriter(g2_fit_logfile_name(self._logfile_name), G2_FIT_HEADER, index_rows=0)
+            self.fit_writer.start()
+
+    def stopFitLog(self):
+        if self.fit_writer is not None:
+            if self.fitter:
+                self.fitter.writer = None
+            self.fit_writer.close()
+            self.fit_writer = None
+
+    # Connected to recentSpinbox.valueChanged. 0 s hides the recent g2 curve.
+    @QtCore.pyqtSlot(int)
+    def updateRecentWindow(self, seconds: int):
+        self.recent_seconds = seconds
+        # One entry of the recent window per frame that brought data, so at most render_fps entries a second
+        int_time = max(self.integrationSpinBox.value() * 1e-3, 1 / self.render_fps)
+        window = int(np.ceil(seconds / int_time)) if seconds > 0 else 0
+        for hist in ([self.g2_hist] if self.g2_pairs is None else self.g2_pairs.values()):
+            hist.set_window(window)
+        if seconds == 0 and self.recentHistogramPlot:
+            self.recentHistogramPlot.setData([], [])
+        self._histogram_dirty = True
 
     @QtCore.pyqtSlot(int)
     def updateBinwidth(self, bin_width):
@@ -1075,7 +2162,6 @@ class MainWindow(QMainWindow):
         self.bin_width = bin_width
         if self.logger:
             self.logger.bin_width = bin_width
-        self.x0 = np.arange(0, self.bins*self.binsize, bin_width) # Will eventually be overwritten in updateHistogram, but this might help the first cycle.
 
     @QtCore.pyqtSlot(int)
     def updateRuntime(self, runtime):
@@ -1093,7 +2179,10 @@ class MainWindow(QMainWindow):
             self.logger.active_flag = False
         self.stopWorkerAndThread()
         self.stopTimer()
+        self.stopFitLog()
         self.selectLogfile_Button.setEnabled(True)
+        self.rotateCombobox.setEnabled(True)
+        self.updateRotation()
         self.liveStart_Button.setText("Live Start")
 
     # Timer
@@ -1151,6 +2240,8 @@ class MainWindow(QMainWindow):
                 self.logger.active_flag = False
                 self.logger_thread.quit()
                 self.logger_thread.wait()
+        elif self.process is not None:
+            self.process.stop()
 
     def deleteWorkerAndThread(self):
         self.stopWorkerAndThread()
@@ -1166,6 +2257,8 @@ class MainWindow(QMainWindow):
         self.samplesSpinbox.setEnabled(True)
         self.liveStart_Button.setEnabled(True)
         self.selectLogfile_Button.setEnabled(True)
+        self.rotateCombobox.setEnabled(True)
+        self.updateRotation()
         self.runtimeSpinbox.setEnabled(True)
 
     def disableDevOptions(self):
@@ -1175,6 +2268,8 @@ class MainWindow(QMainWindow):
         self.samplesSpinbox.setEnabled(False)
         self.liveStart_Button.setEnabled(False)
         self.selectLogfile_Button.setEnabled(False)
+        self.rotateCombobox.setEnabled(False)
+        self.updateRotation()
 
     def enableSinglesOptions(self):
         self.radio1_Button.setEnabled(True)
@@ -1192,18 +2287,22 @@ class MainWindow(QMainWindow):
         self.channelsCombobox1.setEnabled(True)
         self.channelsCombobox2.setEnabled(True)
         self.offsetSpinbox.setEnabled(True)
+        self.autoDelay_Button.setEnabled(True)
         self.resolutionSpinbox.setEnabled(True)
 
     def disableg2Options(self):
         self.channelsCombobox1.setEnabled(False)
         self.channelsCombobox2.setEnabled(False)
         self.offsetSpinbox.setEnabled(False)
+        self.autoDelay_Button.setEnabled(False)
         self.resolutionSpinbox.setEnabled(False)
     
     # For future use
     def resetGUIelements(self):
         self.liveStart_Button.setEnabled(True)
         self.selectLogfile_Button.setEnabled(True)
+        self.rotateCombobox.setEnabled(True)
+        self.updateRotation()
         self.logfileText.setText('')
         self.selectLogfile_Button.setText('Select Logfile')
         self.resetRadioButtons()
@@ -1219,27 +2318,53 @@ class MainWindow(QMainWindow):
         self.radio4_Button.setChecked(False)
 
     def resetCountsPlot(self):
-        self.x=[]
-        self.y1=[]
-        self.y2=[]
-        self.y3=[]
-        self.y4=[]
-        self.linePlot1.setData(self.x, self.y1)
-        self.linePlot2.setData(self.x, self.y2)
-        self.linePlot3.setData(self.x, self.y3)
-        self.linePlot4.setData(self.x, self.y4)
+        self.counts_exchange.swap() # Samples not yet shown are dropped too
+        self.counts_history.clear()
+        self.counts_pyramid.clear()
+        self.count_stats.clear()
+        self.linePlot1.setData([], [])
+        self.linePlot2.setData([], [])
+        self.linePlot3.setData([], [])
+        self.linePlot4.setData([], [])
+        self._curves_dirty = [False, False, False, False]
+        self.tdcPlot.setTitle("Counts Graph")
         self.resetRadioButtons()
         self._counts_plotted = False
         self._data_plotted = self._counts_plotted or self._g2_plotted
 
-    def resetg2Plot(self):
-        self.x0=np.arange(0, self.bins*self.binsize, self.binsize)
-        self.y0=np.zeros_like(self.x0)
-        self.histogramPlot.setData(self.x0, self.y0)
+    def resetg2Plot(self, set_aside: bool = True):
+        """[summary]
+        Clears the g2 plot and its accumulators.
+
+        Args:
+            set_aside (bool): Keep the checkpoint for Restore g2 (HistogramCheckpoint.set_aside), so the next g2 data
+                starts a new one. False just detaches it, eg. when it is about to be loaded.
+        """
+        self.g2_exchange.swap()
+        if set_aside == True:
+            self.g2_checkpoint.set_aside()
+        else:
+            self.g2_checkpoint.close()
+        self.clearFit()
+        self.g2_hist = HistogramAccumulator(bins=self.bins, bin_width=self.binsize, window=self.g2_hist.window)
+        self.g2_pairs = None
+        self.x0 = self.g2_hist.time_bins()
+        if self.histogramPlot:
+            self.histogramPlot.setData(self.x0, self.g2_hist.histogram)
+            self.recentHistogramPlot.setData([], [])
+            self.tdcPlot2.setTitle("Coincidences Histogram")
+        self.g2RateLabel.setText("Total Pairs: <br>" + "0")
+        self._histogram_dirty = False
         self._radio_flags = [0,0,0,0]
         self._g2_plotted = False
         self._data_plotted = self._counts_plotted or self._g2_plotted
 
+    def g2DiscardNote(self):
+        # Clearing sets the checkpoint aside for Restore g2, replacing the one set aside at the last clear
+        if self.g2_checkpoint.exists() and self.g2_checkpoint.has_previous():
+            return ' The g2 cleared before this one can then no longer be restored.'
+        return ''
+
     def resetDataAndPlots(self):
         self.resetCountsPlot()
         self.resetg2Plot()
@@ -1259,18 +2384,134 @@ class MainWindow(QMainWindow):
     def clearg2DataData(self):
         msgBox = QtWidgets.QMessageBox()
         msgBox.setIcon(QtWidgets.QMessageBox.Information)
-        msgBox.setText('Any g2 data unsaved to logfile will be lost. Click Ok to confirm.')
+        msgBox.setText('The g2 will be cleared; Restore g2 can bring it back.' + self.g2DiscardNote() + \
+            ' Click Ok to confirm.')
         msgBox.setWindowTitle('Confirm Clear Pairs.')
         msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         returnValue = msgBox.exec()
         if returnValue == QMessageBox.Ok:
             self.resetg2Plot()
+
+    # Connected to restoreg2_Button.clicked
+    @QtCore.pyqtSlot()
+    def restoreg2(self):
+        """[summary]
+        Shows the g2 kept in the checkpoint file, with the channels, offsets and bin width it was taken with. A run
+        started afterwards can continue accumulating it (Continue when asked), adding to the same checkpoint. If a g2
+        was cleared since, the user picks it or the last accumulated one; the other is set aside in its place.
+        """
+        if self.acq_flag == True:
+            print('Stop the run before restoring the g2.')
+            return
+        if self._g2_plotted == True:
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setIcon(QtWidgets.QMessageBox.Information)
+            msgBox.setText('The plotted g2 will be replaced by the restored one. Click Ok to confirm.')
+            msgBox.setWindowTitle('Confirm Restore g2')
+            msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+            if msgBox.exec() != QMessageBox.Ok:
+                return
+        use_previous = self.g2_checkpoint.has_previous() and not self.g2_checkpoint.exists()
+        if self.g2_checkpoint.has_previous() and self.g2_checkpoint.exists():
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setIcon(QtWidgets.QMessageBox.Question)
+            msgBox.setText('Restore the g2 that was cleared, or the last accumulated one? The other one is kept, ' \
+                'and Restore g2 can switch back to it.')
+            msgBox.setWindowTitle('Restore g2')
+            msgBox.setStandardButtons(QMessageBox.Yes | QMessageBox.Ok | QMessageBox.Cancel)
+            msgBox.button(QMessageBox.Yes).setText('Cleared')
+            msgBox.button(QMessageBox.Ok).setText('Last')
+            returnValue = msgBox.exec()
+            if returnValue == QMessageBox.Cancel:
+                return
+            use_previous = returnValue == QMessageBox.Yes
+        self.resetg2Plot(set_aside=False) # The plotted g2 is the one in the checkpoint
+        if use_previous == True:
+            self.g2_checkpoint.swap_previous()
+        checkpoint = self.g2_checkpoint.load()
+        if checkpoint is None:
+            msgBox = QtWidgets.QMessageBox()
+            msgBox.setIcon(QtWidgets.QMessageBox.Warning)
+            msgBox.setText(f'There is no g2 to restore in {self.g2_checkpoint.file_name}.')
+            msgBox.setWindowTitle('Restore g2')
+            msgBox.exec()
+            return
+        self.pair_delays[:] = checkpoint['pair_delays'] # In place, as a logger may share it
+        self.channelsCombobox1.setCurrentText(str(checkpoint['ch_start']))
+        self.channelsCombobox2.setCurrentText(str(checkpoint['ch_stop']))
+        self.resolutionSpinbox.setValue(checkpoint['bin_width'])
+        bin_width, histograms = checkpoint['bin_width'], checkpoint['histograms']
+        accumulators = []
+        for histogram, acquisitions in zip(histograms, checkpoint['acquisitions']):
+            accumulators.append(HistogramAccumulator(len(histogram), bin_width, window=self.g2_hist.window))
+            accumulators[-1].restore(histogram, acquisitions)
+        if len(accumulators) == len(CHANNEL_PAIRS):
+            self.g2_pairs = dict(zip(CHANNEL_PAIRS, accumulators))
+            self.g2_hist = self.g2_pairs.get((self._ch_start, self._ch_stop), accumulators[0])
+        else:
+            self.g2_hist = accumulators[0]
+        self.binsize = bin_width
+        self.x0 = self.g2_hist.time_bins()
+        self._g2_plotted = True
+        self._data_plotted = self._counts_plotted or self._g2_plotted
+        self._histogram_dirty = True
+        self.tabs.setCurrentWidget(self.tab2)
+        updated = datetime.fromtimestamp(checkpoint['updated']).strftime('%Y-%m-%d %H:%M:%S')
+        self.tdcPlot2.setTitle(f'Coincidences Histogram (restored, {updated})')
+        self.requestFit()
+        print(f'Restored {self.g2_hist.acquisitions} g2 acquisitions from {self.g2_checkpoint.file_name}.')
     
     # Dummmy slot for QTimer
     @QtCore.pyqtSlot()
     def dummy(self):
         pass
 
+    # Settings remembered between sessions, so the last used device comes back as it was left
+    def saveSettings(self):
+        if self._dev_path:
+            self.settings.setValue('device', self._dev_path)
+        if self.modesCombobox.currentText() != 'Select mode':
+            self.settings.setValue('mode', self.modesCombobox.currentText())
+        self.settings.setValue('level', self.levelsComboBox.currentText())
+        self.settings.setValue('int_time', self.integrationSpinBox.value())
+        self.settings.setValue('samples', self.samplesSpinbox.value())
+        self.settings.setValue('bin_width', self.resolutionSpinbox.value())
+        self.settings.setValue('ch_start', self.channelsCombobox1.currentText())
+        self.settings.setValue('ch_stop', self.channelsCombobox2.currentText())
+        self.settings.setValue('offset', self.offsetSpinbox.value())
+        self.settings.setValue('continuous', self.streamCheckbox.isChecked())
+        self.settings.setValue('separate_process', self.processCheckbox.isChecked())
+        self.settings.setValue('pipelined', self.pipelinedCheckbox.isChecked())
+        self.settings.setValue('fit_peak', self.fitCheckbox.isChecked())
+        self.settings.setValue('log_fit', self.fitLogCheckbox.isChecked())
+        self.settings.setValue('log_rotation', self.rotateCombobox.currentText())
+        self.settings.setValue('log_compression', self.compressCombobox.currentText())
+        self.settings.setValue('runtime', self.runtimeSpinbox.value())
+        self.settings.setValue('recent', self.recentSpinbox.value())
+        self.settings.sync()
+
+    def restoreSettings(self):
+        # Setting the widgets goes through the usual slots, so the device and logger are updated as if done by hand
+        for combobox, key in ((self.levelsComboBox, 'level'), (self.channelsCombobox1, 'ch_start'), \
+            (self.channelsCombobox2, 'ch_stop'), (self.rotateCombobox, 'log_rotation'), \
+            (self.compressCombobox, 'log_compression')):
+            text = self.settings.value(key, '', type=str)
+            if combobox.findText(text) >= 0:
+                combobox.setCurrentText(text)
+        for spinbox, key in ((self.integrationSpinBox, 'int_time'), (self.samplesSpinbox, 'samples'), \
+            (self.resolutionSpinbox, 'bin_width'), (self.offsetSpinbox, 'offset'), (self.runtimeSpinbox, 'runtime'), \
+            (self.recentSpinbox, 'recent')):
+            if self.settings.contains(key):
+                spinbox.setValue(self.settings.value(key, type=int))
+        self.streamCheckbox.setChecked(self.settings.value('continuous', False, type=bool))
+        self.processCheckbox.setChecked(self.settings.value('separate_process', False, type=bool))
+        self.pipelinedCheckbox.setChecked(self.settings.value('pipelined', False, type=bool))
+        self.fitCheckbox.setChecked(self.settings.value('fit_peak', False, type=bool))
+        self.fitLogCheckbox.setChecked(self.settings.value('log_fit', False, type=bool))
+        mode = self.settings.value('mode', '', type=str)
+        if self.modesCombobox.findText(mode) > 0:
+            self.modesCombobox.setCurrentText(mode)
+
     def cleanUp(self):
         print('Performing cleanup...')
         self.acq_flag = False
@@ -1279,6 +2520,27 @@ class MainWindow(QMainWindow):
             self.logger.active_flag = False
         self.stopWorkerAndThread()
         self.stopTimer()
+        if self.devices:
+            self.devices.stopAll()
+        if self.stats:
+            self.stats.stopExport()
+        if self.process is not None:
+            self.process.close()
+        if self.scanner_thread:
+            self.scanner_thread.quit()
+            self.scanner_thread.wait()
+        if self.loader_thread:
+            self.loader_thread.quit()
+            self.loader_thread.wait()
+        if self.fitter_thread:
+            self.fitter_thread.quit()
+            self.fitter_thread.wait()
+        if self.finder_thread:
+            self.finder_thread.quit()
+            self.finder_thread.wait()
+        self.stopFitLog()
+        self.g2_checkpoint.close()
+        self.saveSettings()
         print('Exiting app, bye!')
 
 def main():
@@ -1305,9 +2567,14 @@ if __name__ == '__main__':
 ######################
 
 # 1. This code processes and plots data from TDC1 timestamp unit
-# 2. There are two classes: logWorker and MainWindow
+# 2. There are two main classes: logWorker and MainWindow
 #   - logWorker handles the data logging to the csv file via a separate thread
+#   - With Separate process checked, an AcquisitionProcess (tdc1_process) does the same in a child process instead
 #   - MainWindow contains the GUI as well as graph plotting functions
+#   - DeviceManager (the Devices tab) runs further TDC1s, each in a DevicePanel with its own logWorker
+#   - logLoader reads logfiles back for 'Load Log' in its own thread (tdc1_logging.read_log)
+#   - g2Fitter fits the g2 peak in its own thread (tdc1_analysis.fit_g2_peak)
+#   - delayFinder captures timestamps for 'Auto Delay' in its own thread (tdc1_analysis.find_stop_delay)
 
 ######################
 # Update History     #
@@ -1326,6 +2593,35 @@ if __name__ == '__main__':
 # Fixed counts labels not updating after a while.
 # Properly split pairs/g2 functionality.
 
+# v1.4 (in development)
+# Logfiles are written by a separate writer thread (tdc1_logging.LogWriter) that keeps the file open and flushes in batches.
+# A logfile that is locked by another program no longer stops the run; rows are buffered and written once it is available.
+# Added the optional chunked binary log format (.tdc1log), with a memory-mapped reader and CSV converter in tdc1_logging.
+# Counts graph history is a preallocated ring buffer (tdc1_buffers.RingBuffer). Plot Samples now sets its length in all modes.
+# Plots and counts labels are redrawn by a render timer capped at RENDER_FPS instead of on every incoming sample.
+# The counts graph keeps the whole run in a min/max pyramid (tdc1_buffers.MinMaxPyramid). Pan or zoom out to see all of it.
+# g2 is accumulated in int64 (tdc1_buffers.HistogramAccumulator) with running totals. 'Recent (s)' adds a sliding g2 curve.
+# 'Continuous' g2 mode streams raw timestamps without gaps (tdc1_stream), with the raw events saved next to the logfile.
+# Continuous g2 histograms all 12 channel pairs at once (tdc1_analysis.all_pairs_histograms); switching pairs is instant.
+# Stop Ch Offset is remembered per start/stop pair.
+# Added the Devices tab (DeviceManager) to run several TDC1s at once, each with its own worker thread, logfile and tab.
+# Acquisition loops moved to tdc1_acquisition (no Qt); logWorker only forwards them as signals. Added tdc1_headless.
+# Faster start-up: S15lib is imported on first use, devices are searched for in a background thread, the g2 plot and
+# Devices tab are built when first shown, and the last device and its settings are remembered (QSettings).
+# Added a simulated TDC1 (tdc1_sim), listed as 'simulator' in the device list, for testing without hardware.
+# Added the Stats tab: rate and p50/p99 latency of each processing stage (tdc1_metrics), dropped frames, Prometheus export.
+# Counts and g2 reach the GUI through buffers shared with the worker (tdc1_buffers.DoubleBuffer), read once per frame.
+# 'Separate process' runs device I/O and logging in a child process (tdc1_process) that plotting cannot stall.
+# 'Pipelined' singles/pairs request the next window before the last one is handled; the Stats tab shows the duty cycle.
+# Logfiles can be rotated hourly, daily or by size into numbered segments, with completed segments compressed (gzip/xz).
+# 'Load Log' shows a previously written logfile (CSV or binary) in the counts graph or g2 histogram without a device.
+# Logfiles get a time index (run.csv.idx) so 'Load Log' can read just a time range of a long log.
+# The accumulated g2 is kept in a memory-mapped checkpoint file; 'Restore g2' brings it back after a crash or Clear Data.
+# Clear Data sets the checkpoint aside rather than letting the next g2 overwrite it.
+# 'Run Stats' tab: whole-run mean, standard deviation and Allan deviation of every channel's count rate.
+# 'Fit peak' fits the g2 peak (position, FWHM, height, background, g2(0)) in a worker thread; 'Log fit' logs the fits.
+# 'Auto Delay' finds the stop channel delay by FFT cross-correlation of a batch of timestamps and sets the offset.
+
 ###################################
 # TO CHECK AND FIX IF NEEDED      #
 ###################################
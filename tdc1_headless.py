@@ -0,0 +1,174 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Logs TDC1 data without the GUI, eg. on a lab server with no display. Uses the same acquisition loops and logfile
+    formats as the GUI (tdc1_acquisition) but never imports PyQt5 or pyqtgraph.
+
+    Usage:
+    python tdc1_headless.py --mode singles --int-time 1000 --runtime 60 --output run.csv
+    python tdc1_headless.py --device COM4 --mode g2 --start 1 --stop 3 --bin-width 2 --continuous --output run.tdc1log
+    python tdc1_headless.py --device simulator --mode g2 --continuous (see tdc1_sim for its settings)
+    python tdc1_headless.py --mode singles --metrics-file /var/lib/node_exporter/tdc1.prom (stage timings, see tdc1_metrics)
+    Ctrl+C ends the run cleanly (the logfile is flushed and closed).
+"""
+
+import argparse
+import signal
+import sys
+import threading
+import time
+
+import numpy as np
+
+from tdc1_acquisition import Acquisition
+from tdc1_sim import open_device as open_tdc1
+from tdc1_metrics import METRICS, MetricsExporter, METRICS_EXPORT_INTERVAL
+
+
+class HeadlessAcquisition(Acquisition):
+    """[summary]
+    Acquisition that keeps throughput statistics and prints them every `stats_interval` seconds.
+    """
+
+    def __init__(self, stats_interval: float = 10.0):
+        super(HeadlessAcquisition, self).__init__()
+        self.stats_interval = stats_interval
+        self.windows = 0
+        self.counts = 0
+        self._lock = threading.Lock() # on_histogram is called from the analyser thread in continuous mode
+        self._started = time.monotonic()
+        self._last_report = self._started
+        self._last_windows = 0
+        self._last_counts = 0
+
+    def on_counts(self, start: float, now: float, data: tuple, dev_mode: str):
+        # Singles: sum of the four channels. Pairs: sum of the four coincidence columns
+        self._add(sum(data[0:4]) if dev_mode == 'singles' else sum(data[4:8]))
+
+    def on_histogram(self, g2_dict: dict, bins: int, bin_width: int):
+        self._add(int(np.sum(g2_dict['histogram'])))
+
+    def _add(self, counts: int):
+        with self._lock:
+            self.windows += 1
+            self.counts += counts
+            now = time.monotonic()
+            if self.stats_interval > 0 and now - self._last_report >= self.stats_interval:
+                self.report(now)
+
+    def report(self, now: float = None):
+        """[summary]
+        Prints windows/s and counts/s since the last report, totals since the start, and for singles/pairs the recent
+        duty cycle.
+        """
+        now = time.monotonic() if now is None else now
+        dt = max(now - self._last_report, 1e-9)
+        stages, _ = METRICS.summary()
+        duty = f", duty cycle {stages['window']['busy'] * 100:.1f}%" if 'window' in stages else ''
+        print(f'[{now - self._started:9.1f} s] {(self.windows - self._last_windows) / dt:8.2f} windows/s, ' \
+            f'{(self.counts - self._last_counts) / dt:12.1f} counts/s, {self.windows} windows, {self.counts} counts ' \
+            f'total{duty}')
+        sys.stdout.flush()
+        self._last_report = now
+        self._last_windows = self.windows
+        self._last_counts = self.counts
+
+
+def find_device():
+    from S15lib.instruments import usb_counter_fpga as tdc1
+    from S15lib.instruments import serial_connection
+    devices = serial_connection.search_for_serial_devices(tdc1.TimeStampTDC1.DEVICE_IDENTIFIER)
+    if not devices:
+        raise SystemExit('No TDC1 found.')
+    return devices[0]
+
+
+def open_device(dev_path: str, dev_mode: str, level: str):
+    """[summary]
+    Opens the TDC1 and puts it in the mode needed for dev_mode, as the GUI does when a mode is selected.
+    """
+    tdc1_dev = open_tdc1(dev_path)
+    tdc1_dev.mode = 'timestamp' if dev_mode == 'g2' else dev_mode
+    tdc1_dev.level = level
+    return tdc1_dev
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Log TDC1 singles, pairs or g2 data without the GUI.')
+    parser.add_argument('--device', help="Device path, eg. COM4, or 'simulator'. Default: the first TDC1 found")
+    parser.add_argument('--mode', choices=['singles', 'pairs', 'g2'], default='singles')
+    parser.add_argument('--int-time', type=int, default=1000, help='Integration time in ms (default 1000)')
+    parser.add_argument('--level', choices=['NIM', 'TTL'], default='NIM')
+    parser.add_argument('--start', type=int, default=1, choices=[1, 2, 3, 4], help='g2 start channel')
+    parser.add_argument('--stop', type=int, default=3, choices=[1, 2, 3, 4], help='g2 stop channel')
+    parser.add_argument('--bin-width', type=int, default=2, help='g2 bin width in ns')
+    parser.add_argument('--bins', type=int, default=501, help='Number of g2 bins')
+    parser.add_argument('--offset', type=int, default=0, help='g2 stop channel offset in ns')
+    parser.add_argument('--continuous', action='store_true', help='g2 from a continuous timestamp stream')
+    parser.add_argument('--pipelined', action='store_true', \
+        help='Singles/pairs with the next window requested before the last one is handled')
+    parser.add_argument('--runtime', type=float, default=0, help='Run time in minutes; 0 runs until Ctrl+C')
+    parser.add_argument('--output', default='', help='Logfile (.csv or .tdc1log); nothing is logged if omitted')
+    parser.add_argument('--rotate-size', type=float, default=0, \
+        help='Start a new numbered logfile segment every this many MB (default: never)')
+    parser.add_argument('--rotate-interval', type=float, default=0, \
+        help='Start a new logfile segment every this many seconds, on the clock, eg. 3600 on the hour (default: never)')
+    parser.add_argument('--compress', choices=['gzip', 'xz'], default='', help='Compress completed logfile segments')
+    parser.add_argument('--stats-interval', type=float, default=10.0, help='Seconds between throughput reports')
+    parser.add_argument('--metrics-file', default='', help='Write stage timings to this file in Prometheus text format')
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_EXPORT_INTERVAL, \
+        help='Seconds between writes of the metrics file')
+    args = parser.parse_args(argv)
+
+    dev_path = args.device or find_device()
+    tdc1_dev = open_device(dev_path, args.mode, args.level)
+    acquisition = HeadlessAcquisition(args.stats_interval)
+    acquisition.bins = args.bins
+    acquisition.stream = args.continuous
+    acquisition.pipelined = args.pipelined
+    acquisition.log_rotate_bytes = int(args.rotate_size * 1e6)
+    acquisition.log_rotate_interval = args.rotate_interval
+    acquisition.log_compress = args.compress
+    acquisition.pair_delays[args.start - 1, args.stop - 1] = args.offset
+
+    def stop(*_):
+        acquisition.active_flag = False
+    signal.signal(signal.SIGINT, stop)
+    if args.runtime > 0:
+        timer = threading.Timer(args.runtime * 60, stop)
+        timer.daemon = True
+        timer.start()
+
+    exporter = None
+    if args.metrics_file:
+        exporter = MetricsExporter(args.metrics_file, args.metrics_interval)
+        exporter.start()
+
+    print(f'{dev_path}: {args.mode}, {args.int_time} ms' + (f', logging to {args.output}' if args.output else ''))
+    tdc1_dev._com.reset_input_buffer()
+    acquisition.log_which_data(args.int_time * 1e-3, args.output, dev_path, args.output != '', args.mode, tdc1_dev, \
+        args.start, args.stop, args.offset, args.bin_width)
+    acquisition.report()
+    if exporter:
+        exporter.stop()
+    tdc1_dev._com.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
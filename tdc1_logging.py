@@ -0,0 +1,1104 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Log file handling for the TDC1 GUI. Nothing in here depends on Qt, so it can be used from the logWorker thread
+    as well as from scripts.
+
+    Usage:
+    Create a LogWriter with the logfile name and header, start() it, then put() one sample per acquisition window.
+    close() flushes whatever is left and waits for the writer thread to finish.
+    BinaryLogWriter is used the same way for '.tdc1log' files. Those are read back with read_binary_log, or converted
+    to CSV from the command line with: python tdc1_logging.py <binary log> [csv file]
+    With rotate_bytes or rotate_interval set, the log is written as numbered segments (run_0001.csv, run_0002.csv, ...)
+    and completed segments can be compressed in the background (run_0001.csv.gz). log_files lists the files of a log
+    and open_log opens any of them; read_binary_log and binary_to_csv take compressed and rotated logs as they are.
+    read_log reads a CSV or binary log back into NumPy arrays; CSV logs are parsed in chunks, without a loop per row.
+    A time index next to each logfile (run.csv.idx) lets read_log load just a time range. Build one for an older CSV
+    log with: python tdc1_logging.py --index <csv log>
+"""
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+import queue
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from tdc1_metrics import METRICS
+
+
+LOG_FLUSH_ROWS = 256 # Flush to disk once this many rows are waiting
+LOG_FLUSH_INTERVAL = 1.0 # ... or once this many seconds have passed since the last flush
+LOG_FSYNC = False # fsync after every flush (slower, but survives power cuts)
+LOG_SPOOL_ROWS = 100000 # Rows kept in memory while the logfile is unavailable before spilling to a temp file
+LOG_RETRY_INTERVAL = 2.0 # Seconds between attempts to reopen an unavailable logfile
+LOG_CLOSE_RETRIES = 5 # Attempts made on close before buffered rows are saved to a recovery file instead
+LOG_ROTATE_BYTES = 0 # Start a new segment once the current one is this big; 0 never
+LOG_ROTATE_INTERVAL = 0 # Start a new segment at every multiple of this many seconds of wall-clock time; 0 never
+LOG_COMPRESS = '' # Compression of completed segments: '', 'gzip' or 'xz'
+LOG_COMPRESSIONS = {'gzip': '.gz', 'xz': '.xz'}
+LOG_READ_CHUNK = 1 << 26 # Bytes of a CSV log parsed at a time by read_csv_log
+LOG_INDEX_ROWS = 10000 # Rows between entries of the time index written next to each logfile; 0 writes none
+LOG_INDEX_EXTENSION = '.idx'
+# Time index entry: time of a row, its byte offset in the logfile and the number of rows before it in that file
+LOG_INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8'), ('row', '<u8')])
+
+
+def format_row(timestamp: float, values) -> str:
+    """[summary]
+    Formats one sample in the CSV layout written by logWorker: ISO timestamp followed by the values.
+
+    Args:
+        timestamp (float): Unix time of the sample, as returned by time.time().
+        values (iterable): Counts, coincidences or histogram bins.
+    """
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    return datetime.fromtimestamp(timestamp).isoformat() + ',' + ','.join(map(str, values)) + '\n'
+
+
+def log_segment_name(file_name: str, index: int):
+    """[summary]
+    Name of segment `index` (from 1) of a rotated log, eg. run.csv -> run_0001.csv.
+    """
+    stem, ext = os.path.splitext(file_name)
+    return f'{stem}_{index:04d}{ext}'
+
+
+def _segment_index(file_name: str, name: str):
+    # Index of `name` if it is a segment of the log file_name (compressed or not), else None
+    stem, ext = os.path.splitext(os.path.basename(file_name))
+    suffixes = '|'.join(re.escape(s) for s in LOG_COMPRESSIONS.values())
+    match = re.fullmatch(re.escape(stem) + r'_(\d{4,})' + re.escape(ext) + f'({suffixes})?', os.path.basename(name))
+    return int(match.group(1)) if match else None
+
+
+def log_files(file_name: str):
+    """[summary]
+    Files holding the log written to file_name, in order: file_name itself if it exists, then its segments if it was
+    rotated. Where a segment exists both compressed and not (compression was interrupted), the compressed file is used.
+    """
+    folder = os.path.dirname(file_name)
+    segments = {}
+    for name in os.listdir(folder or '.') if os.path.isdir(folder or '.') else []:
+        index = _segment_index(file_name, name)
+        if index is not None and (index not in segments or name.endswith(tuple(LOG_COMPRESSIONS.values()))):
+            segments[index] = os.path.join(folder, name)
+    return ([file_name] if os.path.exists(file_name) else []) + [segments[i] for i in sorted(segments)]
+
+
+def open_log(file_name: str, mode: str = 'rb'):
+    """[summary]
+    Opens a logfile or log segment for reading, decompressing '.gz' and '.xz' files on the fly. mode is 'rb' or 'rt'.
+    """
+    if file_name.endswith(LOG_COMPRESSIONS['gzip']):
+        return gzip.open(file_name, mode)
+    if file_name.endswith(LOG_COMPRESSIONS['xz']):
+        return lzma.open(file_name, mode)
+    return open(file_name, mode)
+
+
+def log_index_name(file_name: str):
+    """[summary]
+    Time index of a logfile or segment, compressed or not, eg. run_0001.csv.gz -> run_0001.csv.idx.
+    """
+    if file_name.endswith(tuple(LOG_COMPRESSIONS.values())):
+        file_name = os.path.splitext(file_name)[0]
+    return file_name + LOG_INDEX_EXTENSION
+
+
+def read_log_index(file_name: str):
+    """[summary]
+    Reads the time index of a logfile (see LOG_INDEX_DTYPE). An incomplete last entry (eg. after a crash) is ignored.
+
+    Returns:
+        np.ndarray: Entries in file order, empty if the logfile has no index.
+    """
+    index_name = log_index_name(file_name)
+    if not os.path.exists(index_name):
+        return np.empty(0, dtype=LOG_INDEX_DTYPE)
+    data = np.fromfile(index_name, dtype=np.uint8)
+    return data[:len(data) - len(data) % LOG_INDEX_DTYPE.itemsize].view(LOG_INDEX_DTYPE)
+
+
+def compress_log(file_name: str, compression: str):
+    """[summary]
+    Compresses a completed logfile or segment to file_name + '.gz' or '.xz' and removes the original. The compressed
+    file only appears once it is complete, so an interrupted compression leaves the original in place.
+
+    Returns:
+        str: Name of the compressed file.
+    """
+    compressed_name = file_name + LOG_COMPRESSIONS[compression]
+    opener = gzip.open if compression == 'gzip' else lzma.open
+    with METRICS.timer('log_compress'):
+        with open(file_name, 'rb') as src, opener(compressed_name + '.part', 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(compressed_name + '.part', compressed_name)
+    os.remove(file_name)
+    return compressed_name
+
+
+class LogWriter(threading.Thread):
+    """[summary]
+    Writer stage for the logfiles. The acquisition loop hands samples over through a queue and carries on with the next
+    window straight away; this thread keeps the file open, formats the rows and writes them out in batches.
+
+    A batch is flushed when flush_rows rows are waiting or flush_interval seconds have passed, whichever comes first.
+    If the file cannot be written to (e.g. it is open in Excel on Windows, the disk is full or a network share has gone
+    away), rows are spooled in memory, then to a temporary file, and the write is retried every retry_interval seconds.
+    Nothing is dropped.
+
+    Every index_rows rows, the time and byte offset of the next batch's first row are added to a time index next to
+    the file (log_index_name), so readers can start close to a given time instead of at the top (see read_log).
+
+    With rotate_bytes or rotate_interval, rows go to numbered segments (log_segment_name) instead of file_name, each
+    with its own header. A new segment is started at the first flush after the current one reaches rotate_bytes, or
+    after a multiple of rotate_interval seconds of wall-clock time (eg. on the hour for 3600). If compress is set,
+    every completed segment, and the last one on close, is compressed by a background thread (compress_log).
+
+    Args:
+        file_name (str): Path of the logfile. Rows are appended; header is written if the file is new or empty.
+            When rotating, writing carries on in the last uncompressed segment, or starts the next one.
+        header (str): Header line, e.g. '#time_stamp,counts'.
+        on_error (callable): Optional callback taking a message string. Called once when spooling starts and once
+            when the file becomes writable again.
+        rotate_bytes (int): Size at which a new segment is started; 0 never.
+        rotate_interval (float): Seconds between new segments, aligned to the clock; 0 never.
+        compress (str): '', 'gzip' or 'xz'. Only used when rotating.
+        index_rows (int): Rows between time index entries; 0 writes no index.
+    """
+    binary = False # Subclasses writing bytes instead of text set this to True
+
+    def __init__(self, file_name: str, header: str, flush_rows: int = LOG_FLUSH_ROWS, \
+        flush_interval: float = LOG_FLUSH_INTERVAL, fsync: bool = LOG_FSYNC, spool_rows: int = LOG_SPOOL_ROWS, \
+        retry_interval: float = LOG_RETRY_INTERVAL, on_error=None, rotate_bytes: int = LOG_ROTATE_BYTES, \
+        rotate_interval: float = LOG_ROTATE_INTERVAL, compress: str = LOG_COMPRESS, index_rows: int = LOG_INDEX_ROWS):
+        super(LogWriter, self).__init__(daemon=True)
+        if compress and compress not in LOG_COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compress}'.")
+        self.base_name = file_name
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.index_rows = index_rows
+        self.file_name = file_name
+        self._index = None # Time index of the open file
+        self._file_rows = None # Rows in the open file, counted when it is first opened
+        self._index_rows = None # Rows since the last index entry; None adds one with the next batch
+        self._unwritten_rows = 0 # file_rows() of what has been encoded but not written yet
+        self._segment = 0
+        self._segment_bytes = 0
+        self._segment_period = None
+        self._segment_used = False # Rows have been written to the current segment
+        self._compressing = [] # Compression threads of completed segments
+        if self.rotating:
+            files = log_files(file_name)
+            last = files[-1] if files else ''
+            self._segment = _segment_index(file_name, last) or 0
+            if self._segment == 0 or last.endswith(tuple(LOG_COMPRESSIONS.values())):
+                self._segment += 1
+            self.file_name = log_segment_name(file_name, self._segment)
+            self._segment_period = self._period()
+        self.header = header
+        self.flush_rows = max(1, int(flush_rows))
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.spool_rows = spool_rows
+        self.retry_interval = retry_interval
+        self.on_error = on_error
+        self.rows_written = 0
+        self.bytes_written = 0
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._pending = [] # Samples taken off the queue, not yet encoded
+        self._backlog = [] # Encoded batches that could not be written yet
+        self._backlog_rows = 0
+        self._spool_file = None # Overflow for _backlog while the logfile is unavailable
+        self._spool_rows = 0
+        self._spooling = False
+        self._spool_failed = False # The temporary file could not be written either
+        self._next_retry = 0.0
+
+    def put(self, timestamp: float, values):
+        """[summary]
+        Queues one sample. Safe to call from any thread and never blocks.
+        """
+        self._queue.put((timestamp, values))
+
+    def put_metadata(self, **metadata):
+        """[summary]
+        Queues a change of acquisition settings (bin width, offset, ...). Applies to the samples put after it.
+        The CSV layout has nowhere to record these, so only the binary writer keeps them.
+        """
+        self._queue.put((None, metadata))
+
+    def close(self):
+        """[summary]
+        Writes out everything still queued and stops the thread. Blocks until done.
+        """
+        self._queue.put(None)
+        if self.is_alive():
+            self.join()
+
+    @property
+    def rotating(self):
+        return bool(self.rotate_bytes or self.rotate_interval)
+
+    def run(self):
+        try:
+            self._open_file()
+        except OSError as e:
+            self._close_file()
+            self._start_spooling(e)
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+                while item is not None:
+                    self._pending.append(item)
+                    if len(self._pending) >= self.flush_rows:
+                        break
+                    item = self._queue.get_nowait()
+                if item is None:
+                    running = False
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if not running or len(self._pending) >= self.flush_rows or now - last_flush >= self.flush_interval:
+                self._flush(force=not running)
+                last_flush = now
+        for _ in range(LOG_CLOSE_RETRIES):
+            # Shutting down while the file is still unavailable; give it a few more chances.
+            if not self._spooling:
+                break
+            time.sleep(self.retry_interval)
+            self._flush(force=True)
+        if self._spooling:
+            self._recover()
+        self._close_file()
+        if self.rotating and self.compress and os.path.exists(self.file_name):
+            self._compress_segment(self.file_name)
+        for thread in self._compressing:
+            thread.join()
+
+    def encode(self, items: list):
+        """[summary]
+        Turns a batch of (timestamp, values) items into the text written to the file. Items with a None timestamp
+        carry metadata and are skipped here.
+        """
+        return ''.join([format_row(t, values) for t, values in items if t is not None])
+
+    def _flush(self, force: bool = False):
+        if self._pending and self._rotation_due():
+            self._rotate()
+        index_time = None
+        if self._pending and self._index_due():
+            # Readers start at the entry's offset, so it must be a place the file can be read from on its own
+            self.start_segment()
+            index_time = next((t for t, _ in self._pending if t is not None), None)
+        if self._pending:
+            # Encode once, so that a failed write never encodes the same rows twice
+            self._backlog.append(self.encode(self._pending))
+            self._backlog_rows += sum(1 for t, _ in self._pending if t is not None)
+            self._unwritten_rows += self.file_rows(self._pending)
+            self._pending = []
+        if not self._backlog and self._spool_file is None:
+            return
+        if self._spooling and not force and time.monotonic() < self._next_retry:
+            self._spill()
+            return
+        written = None # Size of the file before this write, to undo a partial one
+        try:
+            if self._file is None:
+                self._open_file()
+            written = self._file.tell()
+            if self._spool_file is not None:
+                self._spool_file.seek(0)
+                shutil.copyfileobj(self._spool_file, self._file)
+            data = (b'' if self.binary else '').join(self._backlog)
+            offset = self._file.tell()
+            with METRICS.timer('log_write'):
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+        except OSError as e:
+            # Eg. PermissionError while the file is open in Excel, ENOSPC on a full disk, EIO on a network share
+            self._close_file()
+            self._undo_write(written)
+            self._start_spooling(e)
+            self._spill()
+            return
+        if index_time is not None:
+            self._add_index_entry(index_time, offset)
+        if self._index_rows is not None:
+            self._index_rows += self._unwritten_rows
+        self._file_rows += self._unwritten_rows
+        self._unwritten_rows = 0
+        self.rows_written += self._backlog_rows + self._spool_rows
+        self.bytes_written += len(data)
+        self._segment_bytes += len(data)
+        self._segment_used = True
+        self._backlog = []
+        self._backlog_rows = 0
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+            self._spool_rows = 0
+        if self._spooling:
+            self._spooling = False
+            self._report(f'{self.file_name} is writable again. Buffered rows have been written.')
+
+    def file_rows(self, items: list):
+        """[summary]
+        Rows a batch of items adds to the file, as counted by count_log_rows.
+        """
+        return sum(1 for t, _ in items if t is not None)
+
+    def _index_due(self):
+        # Only for a batch written straight after the rows before it, so that its offset is known
+        if not self.index_rows or self._spooling or self._backlog or self._spool_file:
+            return False
+        return self._index_rows is None or self._index_rows >= self.index_rows
+
+    def _add_index_entry(self, t: float, offset: int):
+        try:
+            if self._index is None:
+                self._index = open(log_index_name(self.file_name), 'ab')
+            self._index.write(np.array([(t, offset, self._file_rows)], dtype=LOG_INDEX_DTYPE).tobytes())
+            self._index.flush()
+        except OSError as e:
+            # The log itself is fine without it; the index can be rebuilt with build_log_index
+            self._report(f'Cannot write the time index of {self.file_name} ({e.strerror}).')
+            self.index_rows = 0
+            return
+        self._index_rows = 0
+
+    def _period(self):
+        return int(time.time() // self.rotate_interval) if self.rotate_interval else None
+
+    def _rotation_due(self):
+        # Only between batches, with the current segment open and nothing held back
+        if not self.rotating or self._file is None or self._spooling or self._backlog:
+            return False
+        if not self._segment_used:
+            # Never leave a segment without rows
+            self._segment_period = self._period()
+            return False
+        return (self.rotate_bytes and self._segment_bytes >= self.rotate_bytes) or \
+            (self.rotate_interval and self._period() != self._segment_period)
+
+    def _rotate(self):
+        self._close_file()
+        if self.compress:
+            self._compress_segment(self.file_name)
+        self._segment += 1
+        self.file_name = log_segment_name(self.base_name, self._segment)
+        self._segment_period = self._period()
+        self._segment_used = False
+        self._file_rows = None
+        self._index_rows = None
+        self.start_segment()
+
+    def start_segment(self):
+        """[summary]
+        Called when a new segment is started, before anything is encoded for it.
+        """
+
+    def _compress_segment(self, file_name: str):
+        def compress():
+            try:
+                compress_log(file_name, self.compress)
+            except OSError as e:
+                self._report(f'Cannot compress {file_name} ({e}). It is kept uncompressed.')
+        self._compressing = [t for t in self._compressing if t.is_alive()]
+        thread = threading.Thread(target=compress, daemon=True)
+        thread.start()
+        self._compressing.append(thread)
+
+    def _undo_write(self, size: int):
+        # Cuts off what a failed write left in the file, so the retry does not write those rows twice. If not even the
+        # header made it, the file is emptied so that _open_file writes it again.
+        if size is None:
+            return
+        try:
+            if os.path.getsize(self.file_name) > size:
+                os.truncate(self.file_name, size)
+            elif os.path.getsize(self.file_name) < size:
+                os.truncate(self.file_name, 0)
+        except OSError:
+            pass
+
+    def _start_spooling(self, e: OSError):
+        self._next_retry = time.monotonic() + self.retry_interval
+        if not self._spooling:
+            self._spooling = True
+            self._report(f'Cannot write to {self.file_name} ({e.strerror}). Buffering rows until it is available.')
+
+    def _spill(self):
+        # Move the backlog to the temp file once there are too many rows to keep in memory
+        if self._backlog_rows < self.spool_rows:
+            return
+        size = None
+        try:
+            if self._spool_file is None:
+                self._spool_file = tempfile.TemporaryFile('w+b' if self.binary else 'w+')
+            self._spool_file.seek(0, os.SEEK_END)
+            size = self._spool_file.tell()
+            for data in self._backlog:
+                self._spool_file.write(data)
+            self._spool_file.flush()
+        except OSError as e:
+            # Nowhere to spool to either (eg. the temp folder is on the same full disk); the rows stay in memory
+            if size is not None:
+                try:
+                    self._spool_file.seek(size)
+                    self._spool_file.truncate()
+                except OSError:
+                    pass
+            if not self._spool_failed:
+                self._spool_failed = True
+                self._report(f'Cannot buffer rows in a temporary file ({e.strerror}). Keeping them in memory.')
+            return
+        self._spool_failed = False
+        self._spool_rows += self._backlog_rows
+        self._backlog = []
+        self._backlog_rows = 0
+
+    def _recover(self):
+        # Last resort on close: dump the buffered rows next to the system temp files so they are not lost
+        recovery_name = os.path.join(tempfile.gettempdir(), os.path.basename(self.file_name) + '.recovered')
+        rows = self._backlog_rows + self._spool_rows
+        try:
+            with open(recovery_name, 'ab' if self.binary else 'a') as f:
+                if self._spool_file is not None:
+                    self._spool_file.seek(0)
+                    shutil.copyfileobj(self._spool_file, f)
+                for data in self._backlog:
+                    f.write(data)
+        except OSError as e:
+            self._report(f'{self.file_name} is still unavailable and {recovery_name} cannot be written either ' \
+                f'({e.strerror}). {rows} buffered rows were lost.')
+        else:
+            self._report(f'{self.file_name} is still unavailable. Buffered rows were saved to {recovery_name}.')
+        if self._spool_file is not None:
+            self._spool_file.close()
+            self._spool_file = None
+        self._backlog = []
+        self._unwritten_rows = 0
+
+    def _open_file(self):
+        new_file = not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0
+        if self._file_rows is None:
+            self._file_rows = 0 if new_file else count_log_rows(self.file_name)
+        self._file = open(self.file_name, 'ab' if self.binary else 'a')
+        if new_file:
+            self.write_header(self._file)
+        self._segment_bytes = self._file.tell()
+
+    def write_header(self, f):
+        f.write(self.header + '\n')
+
+    def _close_file(self):
+        for f in (self._file, self._index):
+            if f is not None:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._file = None
+        self._index = None
+
+    def _report(self, message: str):
+        print(message)
+        if self.on_error:
+            self.on_error(message)
+
+
+#---------Binary logs---------#
+
+# A binary log is the 16-byte file header (BINARY_LOG_MAGIC, version, reserved) followed by chunks. Every chunk starts
+# with a 16-byte chunk header: 4-byte tag, uint32 row count and uint64 payload length, all little-endian.
+#   META chunk: JSON describing the rows that follow (mode, channels, bin_width, offset, int_time, columns, dtype),
+#               padded with spaces to a multiple of 8 bytes. Written at the start of every run and whenever the
+#               settings or the row width change. A META chunk with "resync": true only repeats the settings, so the
+#               file can be read from there on its own (time index entries, the start of a rotated file); readers
+#               carry on the segment before it rather than starting a new one.
+#   DATA chunk: row count fixed-width records of float64 unix time followed by `columns` int64 values.
+#   RAWT chunk: raw 32-bit timestamp words exactly as read from the TDC1 in timestamp mode, row count = words.
+# Chunks are only ever appended, so a log cut short by a crash is readable up to its last complete chunk.
+
+BINARY_LOG_EXTENSION = '.tdc1log'
+BINARY_LOG_MAGIC = b'TDC1LOG\x00'
+BINARY_LOG_VERSION = 1
+_FILE_HEADER = struct.Struct('<8sHHI')
+_CHUNK_HEADER = struct.Struct('<4sIQ')
+_META_TAG = b'META'
+_DATA_TAG = b'DATA'
+_RAW_TAG = b'RAWT'
+RAW_LOG_EXTENSION = '.tdc1raw'
+
+LOG_HEADERS = {'singles': '#time_stamp,counts', 'pairs': '#time_stamp,coincidences', 'g2': '#time_stamp,g2'}
+
+
+def record_dtype(columns: int, dtype: str = '<i8'):
+    """[summary]
+    NumPy dtype of one binary log row: unix time and `columns` values.
+    """
+    return np.dtype([('time', '<f8'), ('values', dtype, (columns,))])
+
+
+class BinaryLogWriter(LogWriter):
+    """[summary]
+    LogWriter producing the chunked binary layout described above instead of CSV. Each flushed batch becomes one
+    DATA chunk, so the file can be memory-mapped by read_binary_log without any parsing.
+
+    Args:
+        file_name (str): Path of the logfile. Must be empty or an existing binary log.
+        metadata (dict): Settings recorded in the first META chunk, e.g. mode, channels, bin_width, offset, int_time.
+        **kwargs: Passed on to LogWriter (flush_rows, flush_interval, fsync, on_error, ...).
+    """
+    binary = True
+    value_dtype = '<i8'
+
+    def __init__(self, file_name: str, metadata: dict, **kwargs):
+        super(BinaryLogWriter, self).__init__(file_name, '', **kwargs)
+        if os.path.exists(self.file_name) and os.path.getsize(self.file_name) > 0:
+            with open(self.file_name, 'rb') as f:
+                if f.read(len(BINARY_LOG_MAGIC)) != BINARY_LOG_MAGIC:
+                    raise ValueError(f'{self.file_name} exists and is not a TDC1 binary log.')
+        self.metadata = dict(metadata)
+        self._columns = None # Row width of the last META chunk written
+        self._meta_written = False
+        self._resync = False # The next META chunk only repeats the settings
+
+    def start_segment(self):
+        # Every segment starts with the settings, so it can be read on its own. Within a run they are marked as a
+        # resync, not a new run
+        self._columns = None
+        self._resync = self._meta_written
+
+    def write_header(self, f):
+        f.write(_FILE_HEADER.pack(BINARY_LOG_MAGIC, BINARY_LOG_VERSION, 0, 0))
+
+    def encode(self, items: list):
+        chunks = []
+        rows = []
+        for t, values in items:
+            if t is None:
+                chunks.append(self._data_chunk(rows))
+                rows = []
+                self.metadata.update(values)
+                self._columns = None
+                continue
+            if self._columns != len(values):
+                chunks.append(self._data_chunk(rows))
+                rows = []
+                self._columns = len(values)
+                chunks.append(self._meta_chunk())
+            rows.append((t, values))
+        chunks.append(self._data_chunk(rows))
+        return b''.join(chunks)
+
+    def _meta_chunk(self):
+        meta = dict(self.metadata, columns=self._columns, dtype=self.value_dtype)
+        if self._resync:
+            meta['resync'] = True
+        self._resync = False
+        self._meta_written = True
+        payload = json.dumps(meta).encode()
+        payload += b' ' * (-len(payload) % 8)
+        return _CHUNK_HEADER.pack(_META_TAG, 0, len(payload)) + payload
+
+    def _data_chunk(self, rows: list):
+        if not rows:
+            return b''
+        records = np.empty(len(rows), dtype=record_dtype(self._columns))
+        records['time'] = [t for t, _ in rows]
+        records['values'] = [values for _, values in rows]
+        return _CHUNK_HEADER.pack(_DATA_TAG, len(rows), records.nbytes) + records.tobytes()
+
+
+class RawTimestampWriter(BinaryLogWriter):
+    """[summary]
+    BinaryLogWriter for the continuous timestamp stream. put() takes the raw bytes read from the serial port (whole
+    32-bit words) and every flushed batch becomes one RAWT chunk, so the events can be re-analysed later with any
+    channels, bin width and offset (see tdc1_analysis.g2_from_raw_log).
+    """
+    value_dtype = '<u4'
+
+    def file_rows(self, items: list):
+        # Rows of a raw log are timestamp words
+        return sum(len(values) for t, values in items if t is not None) // 4
+
+    def encode(self, items: list):
+        chunks = []
+        words = []
+        for t, values in items:
+            if t is None:
+                self.metadata.update(values)
+                self._columns = None
+            elif values:
+                if self._columns is None:
+                    chunks.append(self._raw_chunk(words))
+                    words = []
+                    self._columns = 1
+                    chunks.append(self._meta_chunk())
+                words.append(values)
+        chunks.append(self._raw_chunk(words))
+        return b''.join(chunks)
+
+    def _raw_chunk(self, words: list):
+        if not words:
+            return b''
+        payload = b''.join(words)
+        return _CHUNK_HEADER.pack(_RAW_TAG, len(payload) // 4, len(payload)) + payload
+
+
+class BinaryLogSegment:
+    """[summary]
+    Rows of a binary log sharing one META chunk. time and values are read-only views into the memory-mapped file
+    when the segment is a single DATA chunk; otherwise the chunks are concatenated (a plain memory copy).
+
+    Attributes:
+        meta (dict): Settings from the META chunk.
+        chunks (list): Structured arrays, one per DATA chunk, viewing the memory map.
+    """
+
+    def __init__(self, meta: dict):
+        self.meta = meta
+        self.chunks = []
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks)
+
+    def _field(self, name: str):
+        if len(self.chunks) == 1:
+            return self.chunks[0][name]
+        if not self.chunks:
+            return np.empty(0, dtype=record_dtype(self.meta['columns'], self.meta['dtype']))[name]
+        return np.concatenate([c[name] for c in self.chunks])
+
+    @property
+    def time(self):
+        return self._field('time')
+
+    def words(self):
+        """[summary]
+        Raw timestamp words of a RAWT segment.
+        """
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        return np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype='<u4')
+
+    @property
+    def values(self):
+        return self._field('values')
+
+
+def read_binary_log(file_name: str, start: float = None, stop: float = None):
+    """[summary]
+    Memory-maps a binary log and returns its segments (see BinaryLogSegment). Only the chunk headers are read; the
+    rows themselves are not touched until used. A truncated last chunk (e.g. after a crash) is ignored.
+    A rotated log is read from all its files (log_files) in order. Compressed files are decompressed into memory
+    instead of being mapped.
+
+    Args:
+        file_name (str): Path of the binary log, one of its segments, or a compressed segment.
+        start (float): Unix time of the first row wanted, None for no limit. With start or stop, only the part of
+            each file given by its time index (see read_log_index) is read, and the rows are cut to start <= time <
+            stop. Raw timestamp chunks have no row times and are kept whole.
+        stop (float): Unix time the rows wanted end before, None for no limit.
+
+    Returns:
+        list: BinaryLogSegment objects in file order.
+    """
+    segments = _join_resyncs([segment for name, begin, end in _indexed_ranges(file_name, start, stop) \
+        for segment in _read_binary_file(name, begin, end)])
+    if start is None and stop is None:
+        return segments
+    for segment in segments:
+        segment.chunks = [c if c.dtype.names is None else _time_slice(c, start, stop) for c in segment.chunks]
+        segment.chunks = [c for c in segment.chunks if len(c)]
+    return [segment for segment in segments if segment.chunks]
+
+
+def _join_resyncs(segments: list):
+    # Rows after a resync META chunk carry on the segment before it when the settings are the same
+    joined = []
+    for segment in segments:
+        resync = segment.meta.pop('resync', False)
+        if resync and joined and joined[-1].meta == segment.meta:
+            joined[-1].chunks.extend(segment.chunks)
+        else:
+            joined.append(segment)
+    return joined
+
+
+def _indexed_ranges(file_name: str, start: float = None, stop: float = None):
+    # Files of a log, each with the byte range (begin, end or None) holding its rows from start to stop, as far as
+    # their time indexes tell. Files wholly outside the range are left out.
+    files = log_files(file_name)
+    if not files:
+        raise FileNotFoundError(f'{file_name} does not exist.')
+    if start is None and stop is None:
+        return [(name, 0, None) for name in files]
+    indexes = [read_log_index(name) for name in files]
+    # Where the first entry is the first row, it gives the file's start time
+    first = [index['time'][0] if len(index) and index['row'][0] == 0 else None for index in indexes]
+    ranges = []
+    for i, (name, index) in enumerate(zip(files, indexes)):
+        if stop is not None and first[i] is not None and first[i] >= stop:
+            break
+        if start is not None and i + 1 < len(files) and first[i + 1] is not None and first[i + 1] < start:
+            continue
+        begin, end = 0, None
+        if start is not None and len(index):
+            j = np.searchsorted(index['time'], start, side='left') - 1
+            begin = int(index['offset'][j]) if j >= 0 else 0
+        if stop is not None and len(index):
+            j = np.searchsorted(index['time'], stop, side='left')
+            end = int(index['offset'][j]) if j < len(index) else None
+        ranges.append((name, begin, end))
+    return ranges
+
+
+def _time_slice(records: np.ndarray, start: float, stop: float):
+    # Rows of time-ordered records with start <= time < stop (None for no limit), as a view
+    times = records['time']
+    lo = 0 if start is None else np.searchsorted(times, start, side='left')
+    hi = len(records) if stop is None else np.searchsorted(times, stop, side='left')
+    return records[lo:hi]
+
+
+def _read_binary_file(file_name: str, begin: int = 0, end: int = None):
+    segments = []
+    if file_name.endswith(tuple(LOG_COMPRESSIONS.values())):
+        with open_log(file_name) as f:
+            mm = np.frombuffer(f.read(), dtype=np.uint8)
+    elif os.path.getsize(file_name) >= _FILE_HEADER.size:
+        mm = np.memmap(file_name, dtype=np.uint8, mode='r')
+    else:
+        mm = np.empty(0, dtype=np.uint8)
+    if len(mm) < _FILE_HEADER.size:
+        raise ValueError(f'{file_name} is not a TDC1 binary log.')
+    magic, version, _, _ = _FILE_HEADER.unpack(mm[:_FILE_HEADER.size].tobytes())
+    if magic != BINARY_LOG_MAGIC:
+        raise ValueError(f'{file_name} is not a TDC1 binary log.')
+    if version > BINARY_LOG_VERSION:
+        raise ValueError(f'{file_name} was written by a newer version (format {version}).')
+    # A time index entry (begin, end) is where a batch starting with a META chunk was written
+    pos = max(begin, _FILE_HEADER.size)
+    limit = len(mm) if end is None else min(end, len(mm))
+    while pos + _CHUNK_HEADER.size <= limit:
+        tag, rows, length = _CHUNK_HEADER.unpack(mm[pos:pos + _CHUNK_HEADER.size].tobytes())
+        pos += _CHUNK_HEADER.size
+        if pos + length > len(mm):
+            break
+        if tag == _META_TAG:
+            segments.append(BinaryLogSegment(json.loads(mm[pos:pos + length].tobytes())))
+        elif tag == _DATA_TAG and segments:
+            meta = segments[-1].meta
+            segments[-1].chunks.append(mm[pos:pos + length].view(record_dtype(meta['columns'], meta['dtype'])))
+        elif tag == _RAW_TAG and segments:
+            segments[-1].chunks.append(mm[pos:pos + length].view('<u4'))
+        pos += length
+    return segments
+
+
+# Byte translation for parse_csv_rows: the separators of the ISO timestamp, and line ends, become commas
+_CSV_SEPARATORS = bytes.maketrans(b'-T:.\n\r', b',,,,, ')
+
+
+def _local_to_unix(naive: np.ndarray):
+    # Unix times of local wall-clock times given as seconds since 1970-01-01 00:00 (local). The UTC offset is looked
+    # up once per distinct hour, so a run across a daylight saving change is still converted right.
+    hours, inverse = np.unique(naive // 3600, return_inverse=True)
+    offsets = np.array([time.mktime(time.gmtime(h * 3600)[:8] + (-1,)) - h * 3600 for h in hours.tolist()])
+    return naive + offsets[inverse.ravel()]
+
+
+def _csv_lines(block: np.ndarray):
+    # Start and end (newline) offsets of the lines in block, and which of them are rows (not header or blank lines)
+    ends = np.flatnonzero(block == ord('\n'))
+    if len(block) and block[-1] != ord('\n'):
+        ends = np.append(ends, len(block))
+    starts = np.concatenate(([0], ends[:-1] + 1))[:len(ends)]
+    rows = ends > starts
+    rows[rows] = (block[starts[rows]] != ord('#')) & (block[starts[rows]] != ord('\r'))
+    return starts, ends, rows
+
+
+def parse_csv_rows(block: np.ndarray):
+    """[summary]
+    Parses whole lines of a CSV log (ISO timestamp then integer values, as written by LogWriter) with NumPy, without
+    a Python loop over the rows: the timestamp separators and line ends are turned into commas, so the whole block is
+    read by one np.fromstring call, and the rows are then picked out by their number of fields. Header ('#...') and
+    blank lines are skipped.
+
+    Args:
+        block (np.ndarray): uint8 bytes of the lines; the last one need not end with a newline.
+
+    Returns:
+        list: (times, values) per run of rows with the same number of values; times are unix times, values are int64
+            arrays of shape (rows, columns).
+    """
+    text = bytearray(block.tobytes().translate(_CSV_SEPARATORS))
+    starts, ends, rows = _csv_lines(block)
+    for start, end in zip(starts[~rows].tolist(), ends[~rows].tolist()):
+        text[start:end + 1] = b' ' * (end + 1 - start) # Header and blank lines are whitespace to np.fromstring
+    starts, ends = starts[rows], ends[rows]
+    if len(starts) == 0:
+        return []
+    text[ends[-1]:] = b' ' * (len(text) - ends[-1])
+    # Fields per row: Y, M, D, h, m, s, microseconds if not 0 (left out by isoformat), then the values
+    commas = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord(','))
+    fields = np.searchsorted(commas, ends) - np.searchsorted(commas, starts) + 1
+    fraction = (block[np.minimum(starts + 19, len(block) - 1)] == ord('.')).astype(np.int64)
+    columns = fields - 6 - fraction
+    with warnings.catch_warnings():
+        warnings.simplefilter('error') # Unparsable text is only a warning to np.fromstring
+        try:
+            flat = np.fromstring(bytes(text), dtype=np.int64, sep=',')
+        except (DeprecationWarning, ValueError):
+            flat = None
+    if flat is None or len(flat) != fields.sum() or columns.min() < 1:
+        raise ValueError('Rows are not an ISO timestamp followed by integers.')
+    first = np.concatenate(([0], np.cumsum(fields)[:-1]))
+    months = (flat[first] - 1970).astype('datetime64[Y]').astype('datetime64[M]') + flat[first + 1] - 1
+    days = (months.astype('datetime64[D]') + flat[first + 2] - 1).astype(np.int64)
+    naive = days * 86400 + flat[first + 3] * 3600 + flat[first + 4] * 60 + flat[first + 5]
+    times = _local_to_unix(naive) + np.where(fraction == 1, flat[first + 6], 0) * 1e-6
+    first += 6 + fraction # First value of each row
+    runs = []
+    breaks = np.flatnonzero(np.diff(columns)) + 1
+    for run_start, run_end in zip(np.concatenate(([0], breaks)).tolist(), np.append(breaks, len(columns)).tolist()):
+        width = int(columns[run_start])
+        runs.append((times[run_start:run_end], flat[first[run_start:run_end, None] + np.arange(width)]))
+    return runs
+
+
+def _csv_blocks(file_name: str, chunk_bytes: int, begin: int = 0, end: int = None):
+    # (offset, block) of whole lines of a CSV log file from byte begin to end (None: the end of the file), about
+    # chunk_bytes at a time. Plain files are memory-mapped; compressed ones are read, with offsets into the
+    # decompressed data.
+    if file_name.endswith(tuple(LOG_COMPRESSIONS.values())):
+        with open_log(file_name) as f:
+            f.seek(begin)
+            pos = begin
+            leftover = b''
+            while end is None or pos < end:
+                data = f.read(chunk_bytes if end is None else min(chunk_bytes, end - pos))
+                if not data:
+                    break
+                pos += len(data)
+                data = leftover + data
+                whole = data.rfind(b'\n') + 1
+                leftover = data[whole:]
+                if whole:
+                    yield pos - len(data), np.frombuffer(data[:whole], dtype=np.uint8)
+            if leftover:
+                yield pos - len(leftover), np.frombuffer(leftover, dtype=np.uint8)
+        return
+    size = os.path.getsize(file_name) if end is None else min(end, os.path.getsize(file_name))
+    if size <= begin:
+        return
+    mm = np.memmap(file_name, dtype=np.uint8, mode='r')
+    pos = begin
+    while pos < size:
+        block = mm[pos:min(pos + chunk_bytes, size)]
+        if pos + len(block) < size:
+            newlines = np.flatnonzero(block == ord('\n'))
+            if len(newlines) == 0:
+                chunk_bytes *= 2 # A line longer than a chunk (eg. g2 with many bins)
+                continue
+            block = block[:newlines[-1] + 1]
+        yield pos, block
+        pos += len(block)
+
+
+def read_csv_log(file_name: str, start: float = None, stop: float = None, chunk_bytes: int = LOG_READ_CHUNK):
+    """[summary]
+    Reads a CSV log ('#time_stamp,counts', '#time_stamp,coincidences' or '#time_stamp,g2') into the same segments as
+    read_binary_log, so both formats can be handled alike. The file is parsed chunk_bytes at a time with
+    parse_csv_rows. A new segment starts wherever the number of values per row changes (eg. g2 bins). A rotated log
+    is read from all its files (log_files) in order, compressed or not. start and stop limit the rows to a time
+    range as for read_binary_log, using the time index where there is one.
+
+    Returns:
+        list: BinaryLogSegment objects, with meta holding 'mode' and 'columns'.
+    """
+    modes = {header: mode for mode, header in LOG_HEADERS.items()}
+    segments = []
+    for name, begin, end in _indexed_ranges(file_name, start, stop):
+        with open_log(name, 'rt') as f:
+            header = f.readline().strip()
+        if header not in modes:
+            raise ValueError(f'{name} is not a TDC1 CSV log.')
+        for _, block in _csv_blocks(name, chunk_bytes, begin, end):
+            try:
+                runs = parse_csv_rows(block)
+            except ValueError as e:
+                raise ValueError(f'{name} is not a TDC1 CSV log ({e}).')
+            for times, values in runs:
+                if start is not None or stop is not None:
+                    lo = 0 if start is None else np.searchsorted(times, start, side='left')
+                    hi = len(times) if stop is None else np.searchsorted(times, stop, side='left')
+                    times, values = times[lo:hi], values[lo:hi]
+                    if len(times) == 0:
+                        continue
+                meta = segments[-1].meta if segments else {}
+                if meta.get('mode') != modes[header] or meta.get('columns') != values.shape[1]:
+                    segments.append(BinaryLogSegment({'mode': modes[header], 'columns': values.shape[1], 'dtype': '<i8'}))
+                records = np.empty(len(times), dtype=record_dtype(values.shape[1]))
+                records['time'] = times
+                records['values'] = values
+                segments[-1].chunks.append(records)
+    return segments
+
+
+def read_log(file_name: str, start: float = None, stop: float = None):
+    """[summary]
+    Reads a CSV or binary log (read_csv_log or read_binary_log, by its extension), rotated and compressed or not.
+    With start and/or stop (unix times), only the rows from start to before stop are returned, and with a time
+    index next to the files only the part of the log around them is read.
+    """
+    if _is_binary_log(file_name):
+        return read_binary_log(file_name, start, stop)
+    return read_csv_log(file_name, start, stop)
+
+
+def _is_binary_log(file_name: str):
+    if file_name.endswith(tuple(LOG_COMPRESSIONS.values())):
+        file_name = os.path.splitext(file_name)[0]
+    return file_name.endswith((BINARY_LOG_EXTENSION, RAW_LOG_EXTENSION))
+
+
+def count_log_rows(file_name: str):
+    """[summary]
+    Rows in one logfile or segment: rows of values of a CSV log, DATA rows of a binary log, words of a raw log.
+    """
+    with open_log(file_name) as f:
+        binary = f.read(len(BINARY_LOG_MAGIC)) == BINARY_LOG_MAGIC
+    if binary:
+        return sum(len(chunk) for segment in _read_binary_file(file_name) for chunk in segment.chunks)
+    return sum(int(np.count_nonzero(_csv_lines(block)[2])) for _, block in _csv_blocks(file_name, LOG_READ_CHUNK))
+
+
+def build_log_index(file_name: str, index_rows: int = LOG_INDEX_ROWS):
+    """[summary]
+    Writes the time index of a CSV log that has none or an incomplete one (eg. written before indexes existed), as
+    LogWriter would have: an entry every index_rows rows, starting with the first. Every file of a rotated log is
+    indexed. Binary logs get their index as they are written, as only the start of a batch can be read on its own.
+
+    Returns:
+        int: Number of entries written.
+    """
+    files = log_files(file_name)
+    if not files:
+        raise FileNotFoundError(f'{file_name} does not exist.')
+    entries = 0
+    for name in files:
+        if _is_binary_log(name):
+            raise ValueError(f'{name} is a binary log; those are indexed as they are written.')
+        index = []
+        row = 0
+        for offset, block in _csv_blocks(name, LOG_READ_CHUNK):
+            starts, ends, rows = _csv_lines(block)
+            starts, ends = starts[rows], ends[rows]
+            # Rows of this block that are a multiple of index_rows into the file
+            for i in range(-row % index_rows, len(starts), index_rows):
+                timestamp = block[starts[i]:ends[i]].tobytes().split(b',', 1)[0].decode()
+                index.append((datetime.fromisoformat(timestamp).timestamp(), offset + starts[i], row + i))
+            row += len(starts)
+        with open(log_index_name(name) + '.part', 'wb') as f:
+            f.write(np.array(index, dtype=LOG_INDEX_DTYPE).tobytes())
+        os.replace(log_index_name(name) + '.part', log_index_name(name))
+        entries += len(index)
+    return entries
+
+
+def log_time_range(file_name: str):
+    """[summary]
+    Time span of a log from its time indexes: the first entry of its first file and the last entry of its last file
+    (so rows after the last entry are not included). None if the log has no index.
+    """
+    files = log_files(file_name)
+    first, last = (read_log_index(files[0]), read_log_index(files[-1])) if files else ((), ())
+    if not len(first) or not len(last):
+        return None
+    return float(first['time'][0]), float(last['time'][-1])
+
+
+def binary_to_csv(binary_name: str, csv_name: str):
+    """[summary]
+    Converts a binary log to the CSV layout written by logWorker ('#time_stamp,<counts|coincidences|g2>' header, ISO
+    timestamp then values on each row). Segments of a different mode than the first are skipped, as the CSV layout
+    has one header per file. Rotated and compressed logs are read as read_binary_log does.
+
+    Returns:
+        int: Number of rows written.
+    """
+    segments = read_binary_log(binary_name)
+    if not segments:
+        raise ValueError(f'{binary_name} contains no data.')
+    mode = segments[0].meta.get('mode', 'singles')
+    if mode == 'timestamps':
+        raise ValueError(f'{binary_name} holds raw timestamps, which have no CSV layout.')
+    rows = 0
+    with open(csv_name, 'w') as f:
+        f.write(LOG_HEADERS.get(mode, '#time_stamp,' + mode) + '\n')
+        for segment in segments:
+            if segment.meta.get('mode', 'singles') != mode:
+                print(f'Skipping {len(segment)} {segment.meta.get("mode")} rows in {binary_name}.')
+                continue
+            for chunk in segment.chunks:
+                values = chunk['values'].tolist()
+                f.writelines([format_row(t, v) for t, v in zip(chunk['time'].tolist(), values)])
+                rows += len(chunk)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a TDC1 binary log (' + BINARY_LOG_EXTENSION + ') to CSV.')
+    parser.add_argument('binary_log')
+    parser.add_argument('csv_file', nargs='?', help='Defaults to the binary log name with a .csv extension.')
+    parser.add_argument('--index', action='store_true', help='Instead, (re)build the time index of a CSV log.')
+    args = parser.parse_args()
+    if args.index:
+        print(f'Wrote {build_log_index(args.binary_log)} entries to the time index of {args.binary_log}.')
+        sys.exit(0)
+    binary_log = args.binary_log
+    if binary_log.endswith(tuple(LOG_COMPRESSIONS.values())):
+        binary_log = os.path.splitext(binary_log)[0]
+    csv_file = args.csv_file or os.path.splitext(binary_log)[0] + '.csv'
+    print(f'Wrote {binary_to_csv(args.binary_log, csv_file)} rows to {csv_file}.')
@@ -0,0 +1,209 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Lightweight timing of the processing stages (device reads, logfile writes, signal delivery, rendering, ...) shared
+    by all threads of the process. Nothing in here imports Qt.
+
+    Usage:
+    with METRICS.timer('acquire'):
+        counts = tdc1_dev.get_counts(int_time)
+    METRICS.record('handoff', seconds)  # For durations measured elsewhere
+    METRICS.increment('dropped_frames')
+    METRICS.summary() gives rates, busy fractions and percentiles per stage; prometheus_text() the same in Prometheus
+    exposition format, which MetricsExporter writes to a file periodically (eg. for node_exporter's textfile collector).
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+METRICS_SAMPLES = 1024 # Durations kept per stage for the percentiles
+METRICS_RATE_WINDOW = 10.0 # Seconds over which rates are computed
+METRICS_EXPORT_INTERVAL = 10.0 # Seconds between writes of the metrics file
+
+
+class _Stage:
+    # Ring of the latest durations and their end times, plus all-time totals
+    def __init__(self, samples: int):
+        self.durations = np.zeros(samples, dtype=np.float64)
+        self.ends = np.zeros(samples, dtype=np.float64)
+        self.next = 0
+        self.count = 0
+        self.total = 0.0
+        self.first = None # Start of the first duration
+
+    def add(self, seconds: float, end: float):
+        if self.first is None:
+            self.first = end - seconds
+        i = self.next
+        self.durations[i] = seconds
+        self.ends[i] = end
+        self.next = (i + 1) % len(self.durations)
+        self.count += 1
+        self.total += seconds
+
+
+class _Timer:
+    # Context manager returned by Metrics.timer
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics: object, name: str):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self._metrics.record(self._name, end - self._start, end)
+        return False
+
+
+class Metrics:
+    """[summary]
+    Registry of stage durations and counters. record(), timer() and increment() may be called from any thread and
+    cost about a microsecond; summaries are only computed when asked for.
+
+    Args:
+        samples (int): Durations kept per stage for the percentiles.
+        rate_window (float): Rates are events per second over this many seconds.
+    """
+
+    def __init__(self, samples: int = METRICS_SAMPLES, rate_window: float = METRICS_RATE_WINDOW):
+        self.samples = samples
+        self.rate_window = rate_window
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+
+    def timer(self, name: str):
+        return _Timer(self, name)
+
+    def record(self, name: str, seconds: float, end: float = None):
+        """[summary]
+        Adds one duration (in s) to a stage.
+        """
+        if not self.enabled:
+            return
+        end = time.perf_counter() if end is None else end
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = _Stage(self.samples)
+            stage.add(seconds, end)
+
+    def increment(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def summary(self):
+        """[summary]
+        Returns ({stage: {'count', 'rate', 'busy', 'p50', 'p99', 'max', 'total'}}, {counter: value}). rate is per second
+        and busy the fraction of the time spent in the stage, both over the last rate_window seconds; p50/p99/max (in s)
+        are over the last `samples` durations. The busy fraction of the 'window' stage is the acquisition duty cycle.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            stages = {name: (stage.durations[:min(stage.count, self.samples)].copy(), \
+                stage.ends[:min(stage.count, self.samples)].copy(), stage.count, stage.total, stage.first) \
+                for name, stage in self._stages.items()}
+            counters = dict(self._counters)
+        result = {}
+        for name, (durations, ends, count, total, first) in sorted(stages.items()):
+            recent = ends > now - self.rate_window
+            # If the ring or the stage's history only covers part of the window, rates are over the time they do cover
+            span = self.rate_window if count <= self.samples or not len(ends) else min(self.rate_window, now - ends.min())
+            span = max(min(span, now - first), 1e-9)
+            p50, p99 = np.percentile(durations, [50, 99]) if len(durations) else (0.0, 0.0)
+            result[name] = {'count': count, 'rate': np.count_nonzero(recent) / span, \
+                'busy': float(durations[recent].sum()) / span, 'p50': float(p50), 'p99': float(p99), \
+                'max': float(durations.max()) if len(durations) else 0.0, 'total': total}
+        return result, counters
+
+    def prometheus_text(self, prefix: str = 'tdc1'):
+        """[summary]
+        The summary in Prometheus text exposition format: one summary metric with a 'stage' label (quantiles 0.5 and
+        0.99, _sum and _count), a gauge of each stage's busy fraction and one counter per counter.
+        """
+        stages, counters = self.summary()
+        lines = [f'# HELP {prefix}_stage_seconds Duration of each processing stage.', \
+            f'# TYPE {prefix}_stage_seconds summary']
+        for name, s in stages.items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.5"}} {s["p50"]:.9g}')
+            lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="0.99"}} {s["p99"]:.9g}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {s["total"]:.9g}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+        lines.append(f'# HELP {prefix}_stage_busy_ratio Fraction of the recent time spent in each stage (for the '
+            'window stage, the duty cycle).')
+        lines.append(f'# TYPE {prefix}_stage_busy_ratio gauge')
+        for name, s in stages.items():
+            lines.append(f'{prefix}_stage_busy_ratio{{stage="{name}"}} {s["busy"]:.9g}')
+        for name, value in sorted(counters.items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics() # Shared by the whole process
+
+
+class MetricsExporter(threading.Thread):
+    """[summary]
+    Writes metrics.prometheus_text() to file_name every `interval` seconds until stop() is called. The file is
+    replaced in one step, so readers never see a partly written file.
+    """
+
+    def __init__(self, file_name: str, interval: float = METRICS_EXPORT_INTERVAL, metrics: Metrics = METRICS):
+        super(MetricsExporter, self).__init__(daemon=True)
+        self.file_name = file_name
+        self.interval = interval
+        self.metrics = metrics
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            self.write()
+            if self._stop_event.wait(self.interval):
+                break
+        self.write()
+
+    def write(self):
+        temp_name = self.file_name + '.tmp'
+        try:
+            with open(temp_name, 'w') as f:
+                f.write(self.metrics.prometheus_text())
+            os.replace(temp_name, self.file_name)
+        except OSError as e:
+            print(f'Cannot write metrics to {self.file_name}: {e}')
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
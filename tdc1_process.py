@@ -0,0 +1,386 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Runs the acquisition loop (device I/O and logging) in a child process, so that plotting in the GUI, which holds
+    Python's GIL, cannot delay serial reads and logfile writes. Nothing in here imports Qt.
+
+    Usage:
+    proc = AcquisitionProcess(dev_path, dev_mode, level)
+    proc.stream = True # Settings as on Acquisition; changed while running, they are sent to the child
+    proc.start(int_time, file_name, log_flag, ch_start, ch_stop, offset, bin_width)
+    proc.counts.swap(), proc.g2.swap() # Once per frame, as DoubleBuffer.swap()
+    for kind, value in proc.events(): ... # ('message', text) and ('finished', None)
+    proc.stop(); proc.close()
+
+    Counts come back through a shared-memory ring (SharedSampleRing) and g2 histograms as running totals in shared
+    memory (SharedHistogram). Settings and the stop request go to the child over a multiprocessing Pipe. The stage
+    timings of the child (tdc1_metrics) stay in the child.
+"""
+
+import multiprocessing
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tdc1_acquisition import Acquisition
+from tdc1_analysis import CHANNEL_PAIRS
+from tdc1_buffers import SampleBlock, HistogramBlock
+from tdc1_metrics import METRICS
+from tdc1_sim import open_device
+
+# Acquisition attributes that may be set on an AcquisitionProcess
+ACQUISITION_SETTINGS = ('int_time', 'ch_start', 'ch_stop', 'bin_width', 'bins', 'offset', 'runtime', 'stream', \
+    'pipelined', 'pair_delays', 'log_flush_rows', 'log_flush_interval', 'log_fsync', 'log_rotate_bytes', \
+    'log_rotate_interval', 'log_compress')
+RING_SAMPLES = 65536 # Counts samples the GUI may fall behind by before losing some
+MAX_BINS = 65535 # Largest Plot Samples setting
+
+
+class _SharedArrays:
+    # One shared memory block holding several arrays, created or attached to by name
+    def __init__(self, name: str, layout: list):
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in layout)
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.arrays = {}
+        offset = 0
+        for key, shape, dtype in layout:
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self, unlink: bool = False):
+        self.arrays = {} # The views must go before the memory can be released
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class SharedSampleRing(_SharedArrays):
+    """[summary]
+    Ring of counts samples (a time plus up to `channels` values) in shared memory, written by one process and read by
+    another. The writer stores a sample and then increments the write count; the reader takes everything up to the
+    count it sees. If the reader falls more than `capacity` samples behind, the oldest are lost and counted as
+    'lost_samples' in METRICS.
+
+    Args:
+        name (str): Name of an existing ring to attach to. None creates a new one.
+        capacity (int): Number of samples kept.
+        channels (int): Values per sample.
+    """
+
+    def __init__(self, name: str = None, capacity: int = RING_SAMPLES, channels: int = 8):
+        super(SharedSampleRing, self).__init__(name, [('count', (1,), np.int64), ('start', (1,), np.float64), \
+            ('times', (capacity,), np.float64), ('values', (channels, capacity), np.int64)])
+        self.capacity = capacity
+        self._read = 0
+        self._block = SampleBlock(channels=channels)
+
+    def write(self, start: float, t: float, values):
+        a = self.arrays
+        n = int(a['count'][0])
+        i = n % self.capacity
+        a['times'][i] = t
+        a['values'][:len(values), i] = values
+        a['start'][0] = start
+        a['count'][0] = n + 1 # Publishes the sample
+
+    def swap(self):
+        """[summary]
+        Returns a SampleBlock with the samples written since the last call, or None if there are none. Same use as
+        DoubleBuffer.swap(); the block is reused by the next call.
+        """
+        a = self.arrays
+        n = int(a['count'][0])
+        if n == self._read:
+            return None
+        if n - self._read > self.capacity:
+            METRICS.increment('lost_samples', n - self._read - self.capacity)
+            self._read = n - self.capacity
+        block = self._block
+        block.clear()
+        block.start = float(a['start'][0])
+        first = self._read % self.capacity
+        count = n - self._read
+        head = min(count, self.capacity - first)
+        block.extend(a['times'][first:first + head], a['values'][:, first:first + head])
+        if count > head:
+            block.extend(a['times'][:count - head], a['values'][:, :count - head])
+        self._read = n
+        return block
+
+
+class SharedHistogram(_SharedArrays):
+    """[summary]
+    Running totals of g2 histograms in shared memory, added to by one process and read by another. The reader gets what
+    was added since its last read as a HistogramBlock, as through a DoubleBuffer of HistogramBlocks. The header's
+    sequence number is odd while the writer is busy, so a read that overlapped a write is detected and retried on the
+    next call (a seqlock).
+
+    Args:
+        name (str): Name of existing totals to attach to. None creates new ones.
+        rows (int): Most histograms per acquisition (one per channel pair for the continuous g2).
+        bins (int): Most bins per histogram.
+    """
+
+    def __init__(self, name: str = None, rows: int = len(CHANNEL_PAIRS), bins: int = MAX_BINS):
+        # header: sequence, rows, bins, bin width, acquisitions
+        super(SharedHistogram, self).__init__(name, [('header', (5,), np.int64), ('time', (1,), np.float64), \
+            ('totals', (rows, bins), np.int64)])
+        self._seen = 0
+        self._settings = None
+        self._acquisitions = 0
+        self._previous = np.zeros((0, 0), dtype=np.int64)
+        self._snapshot = np.zeros((0, 0), dtype=np.int64)
+        self._block = HistogramBlock(rows=0, bins=0)
+
+    def add(self, histograms, bin_width: int, t: float):
+        a = self.arrays
+        header = a['header']
+        histograms = np.asarray(histograms)
+        if histograms.ndim == 1:
+            histograms = histograms[np.newaxis]
+        rows, bins = histograms.shape
+        header[0] += 1 # Odd: being written
+        if rows != header[1] or bins != header[2] or bin_width != header[3]:
+            a['totals'][:header[1], :header[2]] = 0
+            header[1:5] = (rows, bins, bin_width, 0)
+        a['totals'][:rows, :bins] += histograms
+        header[4] += 1
+        a['time'][0] = t
+        header[0] += 1
+
+    def swap(self):
+        """[summary]
+        Returns a HistogramBlock with the acquisitions added since the last call, or None if there are none (or the
+        writer was busy). The block is reused by the next call.
+        """
+        a = self.arrays
+        header = a['header']
+        sequence = int(header[0])
+        if sequence == self._seen or sequence % 2:
+            return None
+        rows, bins, bin_width, acquisitions = (int(x) for x in header[1:5])
+        t = float(a['time'][0])
+        if self._snapshot.shape != (rows, bins):
+            self._snapshot = np.zeros((rows, bins), dtype=np.int64)
+        np.copyto(self._snapshot, a['totals'][:rows, :bins])
+        if int(header[0]) != sequence:
+            return None
+        self._seen = sequence
+        if self._settings != (rows, bins, bin_width):
+            # The totals restarted with the new settings
+            self._settings = (rows, bins, bin_width)
+            self._previous = np.zeros((rows, bins), dtype=np.int64)
+            self._acquisitions = 0
+        block = self._block
+        if block.histograms.shape != (rows, bins):
+            block.histograms = np.zeros((rows, bins), dtype=np.int64)
+        np.subtract(self._snapshot, self._previous, out=block.histograms)
+        block.bin_width = bin_width
+        block.acquisitions = acquisitions - self._acquisitions
+        block.first = t
+        self._previous, self._snapshot = self._snapshot, self._previous
+        self._acquisitions = acquisitions
+        return block
+
+
+class _SharedMemoryAcquisition(Acquisition):
+    # Runs in the child: the hooks write to shared memory and the pipe, and commands from the pipe change settings
+    def __init__(self, ring: SharedSampleRing, histogram: SharedHistogram, conn: object):
+        super(_SharedMemoryAcquisition, self).__init__()
+        self.ring = ring
+        self.histogram = histogram
+        self.conn = conn
+        self._send_lock = threading.Lock() # on_message is also called from the logfile writer's thread
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            self.conn.send(message)
+
+    def on_counts(self, start: float, now: float, data: tuple, dev_mode: str):
+        self.ring.write(start, now, data)
+
+    def on_histogram(self, g2_dict: dict, bins: int, bin_width: int):
+        histograms = g2_dict['pairs'] if 'pairs' in g2_dict else g2_dict['histogram']
+        self.histogram.add(histograms, bin_width, time.time())
+
+    def on_message(self, message: str):
+        self.send(('message', message))
+
+    def on_finished(self, tdc1_dev: object):
+        self.send(('finished', None))
+
+    def listen(self):
+        while True:
+            try:
+                command = self.conn.recv()
+            except (EOFError, OSError):
+                command = ('stop',) # The GUI has gone
+            if command[0] == 'set':
+                setattr(self, command[1], command[2])
+            elif command[0] == 'stop':
+                self.active_flag = False
+                break
+
+
+def _child_main(dev_path: str, dev_mode: str, level: str, settings: dict, run: tuple, ring_name: str, \
+    histogram_name: str, conn: object):
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C in the GUI's terminal is for the GUI
+    ring = SharedSampleRing(ring_name)
+    histogram = SharedHistogram(histogram_name)
+    acquisition = _SharedMemoryAcquisition(ring, histogram, conn)
+    for name, value in settings.items():
+        setattr(acquisition, name, value)
+    try:
+        tdc1_dev = open_device(dev_path)
+        tdc1_dev.mode = 'timestamp' if dev_mode == 'g2' else dev_mode
+        if level:
+            tdc1_dev.level = level
+        tdc1_dev._com.reset_input_buffer()
+    except Exception as e:
+        acquisition.on_message(f'Cannot open {dev_path}: {e}')
+        acquisition.on_finished(None)
+    else:
+        threading.Thread(target=acquisition.listen, daemon=True).start()
+        int_time, file_name, log_flag, ch_start, ch_stop, offset, bin_width = run
+        acquisition.log_which_data(int_time, file_name, dev_path, log_flag, dev_mode, tdc1_dev, ch_start, ch_stop, \
+            offset, bin_width)
+        tdc1_dev._com.close()
+    ring.close()
+    histogram.close()
+
+
+class AcquisitionProcess:
+    """[summary]
+    Acquisition of one device in a child process. The settings in ACQUISITION_SETTINGS are attributes, as on
+    Acquisition, and are sent to the child when changed while it runs. Setting active_flag to False asks the child to
+    stop after the current acquisition, so the GUI can use this wherever it uses a logWorker.
+
+    The device must not be open in this process: the child opens it (and closes it when done).
+
+    Args:
+        dev_path (str): Device path, eg. 'COM4', or 'simulator'.
+        dev_mode (str): 'singles', 'pairs' or 'g2'.
+        level (str): 'NIM' or 'TTL'; '' leaves the device's level as it is.
+    """
+
+    def __init__(self, dev_path: str, dev_mode: str, level: str = ''):
+        self.dev_path = dev_path
+        self.dev_mode = dev_mode
+        self.level = level
+        self.radio_flags = [0, 0, 0, 0]
+        self.counts = SharedSampleRing()
+        self.g2 = SharedHistogram()
+        self._settings = {name: value for name, value in vars(Acquisition()).items() if name in ACQUISITION_SETTINGS}
+        self._conn = None
+        self._process = None
+        self._stopping = False
+        self._finished = False
+
+    def __getattr__(self, name: str):
+        # Only called for names that are not ordinary attributes
+        if name in ACQUISITION_SETTINGS:
+            return self._settings[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value):
+        if name in ACQUISITION_SETTINGS:
+            self._settings[name] = value
+            self._send(('set', name, value))
+            if name == 'offset':
+                # The GUI changes the pair's entry of its pair_delays in place and then sets offset
+                self._send(('set', 'pair_delays', np.array(self._settings['pair_delays'])))
+        elif name == 'active_flag':
+            if not value:
+                self._stopping = True
+                self._send(('stop',))
+        else:
+            object.__setattr__(self, name, value)
+
+    @property
+    def active_flag(self):
+        return self._process is not None and self._process.is_alive() and not self._stopping
+
+    def _send(self, message: tuple):
+        if self._conn is not None and self._process.is_alive():
+            try:
+                self._conn.send(message)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def start(self, int_time: float, file_name: str, log_flag: bool, ch_start: int, ch_stop: int, offset: int, \
+        bin_width: int):
+        """[summary]
+        Starts the child process; arguments as for Acquisition.log_which_data, without the device.
+        """
+        context = multiprocessing.get_context('spawn') # Never fork a process that runs Qt
+        self._conn, child_conn = context.Pipe()
+        self._stopping = False
+        self._finished = False
+        settings = dict(self._settings)
+        settings['pair_delays'] = np.array(settings['pair_delays'])
+        self._process = context.Process(target=_child_main, args=(self.dev_path, self.dev_mode, self.level, \
+            settings, (int_time, file_name, log_flag, ch_start, ch_stop, offset, bin_width), self.counts.name, \
+            self.g2.name, child_conn), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def events(self):
+        """[summary]
+        Yields the (kind, value) messages the child has sent so far, without waiting. A child that died without
+        saying so is reported as finished.
+        """
+        while self._conn is not None:
+            try:
+                if not self._conn.poll():
+                    return
+                event = self._conn.recv()
+            except (EOFError, OSError):
+                self._conn = None
+                event = None if self._finished else ('finished', None)
+            if event is not None:
+                self._finished = self._finished or event[0] == 'finished'
+                yield event
+
+    def stop(self, timeout: float = 10.0):
+        """[summary]
+        Asks the child to stop and waits for it (and so for its logfile and device to be closed).
+        """
+        self.active_flag = False
+        if self._process is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+
+    def close(self):
+        """[summary]
+        Stops the child and frees the shared memory. Anything not yet read is lost.
+        """
+        self.stop()
+        self.counts.close(unlink=True)
+        self.g2.close(unlink=True)
@@ -0,0 +1,305 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Simulated TDC1 for running the GUI, tdc1_headless and the benchmarks without hardware. Nothing in here imports Qt.
+
+    Usage:
+    Select 'simulator' in the GUI's device list, or pass --device simulator to tdc1_headless. The source is set with
+    the TDC1_SIMULATOR environment variable, eg. TDC1_SIMULATOR="rate=1e6,pair_rate=5e4,delay=30,jitter=0.5".
+    Keys are the SimulatedTDC1 arguments; realtime=0 returns data as fast as it can be generated.
+"""
+
+import collections
+import os
+import re
+import time
+
+import numpy as np
+
+from tdc1_analysis import TIMESTAMP_RESOLUTION, g2_histogram
+
+SIMULATED_DEVICES = ['simulator', 'simulator2'] # Listed after the real devices
+_COUNTER_BITS = 27
+
+
+def is_simulator(dev_path: str):
+    return dev_path in SIMULATED_DEVICES
+
+
+def simulate_events(duration: float, rates, pair_rate: float = 0, pair_channels = (1, 3), delay: float = 20, \
+    jitter: float = 1, rng = None):
+    """[summary]
+    Events of an SPDC-like source during `duration` seconds: Poissonian singles on every channel plus pairs, whose
+    second photon arrives `delay` ns after the first with Gaussian jitter. Times are rounded down to the 2 ns
+    resolution of the TDC1 and partners falling outside the interval are dropped, so consecutive calls can be
+    concatenated into one stream.
+
+    Args:
+        duration (float): Length of the interval in s.
+        rates (sequence): Uncorrelated singles rate of channels 1-4 in counts/s.
+        pair_rate (float): Pairs per second.
+        pair_channels (tuple): (first, second) channel of each pair.
+        delay (float): Mean delay of the second photon in ns.
+        jitter (float): Standard deviation of the delay in ns.
+        rng (np.random.Generator): Random source.
+
+    Returns:
+        (np.ndarray, np.ndarray): Event times in ns from the start of the interval (int64) and channel patterns (uint8),
+        sorted by time.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    span = duration * 1e9
+    times = []
+    channels = []
+    for ch, rate in enumerate(rates, 1):
+        n = rng.poisson(rate * duration)
+        times.append(rng.uniform(0, span, n))
+        channels.append(np.full(n, ch, dtype=np.uint8))
+    n = rng.poisson(pair_rate * duration)
+    first = rng.uniform(0, span, n)
+    times += [first, first + delay + rng.normal(0, jitter, n) if jitter > 0 else first + delay]
+    channels += [np.full(n, pair_channels[0], dtype=np.uint8), np.full(n, pair_channels[1], dtype=np.uint8)]
+    t = np.concatenate(times)
+    ch = np.concatenate(channels)
+    inside = (t >= 0) & (t < span)
+    t = (t[inside] // TIMESTAMP_RESOLUTION).astype(np.int64) * TIMESTAMP_RESOLUTION
+    ch = ch[inside]
+    order = np.argsort(t, kind='stable')
+    return t[order], (1 << (ch[order] - 1)).astype(np.uint8)
+
+
+def encode_timestamps(times, patterns):
+    """[summary]
+    Raw TDC1 timestamp words (little-endian bytes) for event times in ns, as read from the serial port.
+    """
+    ticks = (times // TIMESTAMP_RESOLUTION) & ((1 << _COUNTER_BITS) - 1)
+    return ((ticks.astype('<u4') << 5) | patterns).astype('<u4').tobytes()
+
+
+class _SimulatedPort:
+    # Stands in for the serial port. In timestamp mode, after 'counts?' words become available at the simulated event
+    # rate, in real time, until 'abort'. In singles and pairs mode, 'time N;counts?' is answered with a line of counts
+    # once the window has passed; requests sent during a window wait for it to end, as on the device. Only what
+    # TimestampStream, CountsPipeline and logWorker use is provided.
+    MAX_SPAN = 0.1 # Longest interval generated at once, in s
+
+    def __init__(self, device: object):
+        self._device = device
+        self._streaming = False
+        self._pending = bytearray()
+        self._clock = 0 # Stream time in ns
+        self._last = 0.0
+        self._replies = collections.deque() # (due, mode, int_time) of each counts request
+        self._busy_until = 0.0
+        self.timeout = 0.01
+
+    def write(self, data: bytes):
+        match = re.search(rb'time (\d+)', data)
+        if match:
+            self._device.int_time = int(match.group(1)) * 1e-3
+        if b'counts?' in data and self._device.mode in ('singles', 'pairs'):
+            now = time.monotonic()
+            duration = self._device.int_time
+            self._busy_until = max(now, self._busy_until) + duration if self._device.realtime else now
+            self._replies.append((self._busy_until, self._device.mode, duration))
+        elif b'counts?' in data:
+            self._streaming = True
+            self._last = time.monotonic()
+        if b'abort' in data:
+            self._streaming = False
+
+    def _deliver(self):
+        now = time.monotonic()
+        while self._replies and self._replies[0][0] <= now:
+            _, mode, duration = self._replies.popleft()
+            counts = self._device.singles(duration) if mode == 'singles' else self._device.pairs(duration)
+            self._pending += (' '.join(str(c) for c in counts) + '\r\n').encode()
+
+    def _generate(self):
+        self._deliver()
+        now = time.monotonic()
+        span = min(now - self._last, self.MAX_SPAN)
+        if not self._streaming or span < 1e-3:
+            return
+        self._last = now
+        times, patterns = self._device.events(span)
+        self._pending += encode_timestamps(times + self._clock, patterns)
+        self._clock += int(span * 1e9) // TIMESTAMP_RESOLUTION * TIMESTAMP_RESOLUTION
+
+    @property
+    def in_waiting(self):
+        self._generate()
+        return len(self._pending)
+
+    def read(self, size: int = 1):
+        self._generate()
+        if not self._pending:
+            time.sleep(self.timeout)
+            self._generate()
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        self._deliver()
+        while b'\n' not in self._pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(max(0.0, min(deadline, self._replies[0][0] if self._replies else deadline) - now))
+            self._deliver()
+        end = self._pending.find(b'\n') + 1 or len(self._pending)
+        data = bytes(self._pending[:end])
+        del self._pending[:end]
+        return data
+
+    def reset_input_buffer(self):
+        self._deliver() # Answers still to come are not in the buffer yet
+        self._pending.clear()
+
+    def close(self):
+        self._streaming = False
+        self._replies.clear()
+
+
+class SimulatedTDC1:
+    """[summary]
+    Drop-in replacement for S15lib's TimeStampTDC1 (mode, level, get_counts, get_counts_and_coincidences, count_g2 and
+    the timestamp stream and counts requests on _com) with a photon pair source on pair_channels.
+
+    Singles and coincidence counts are drawn from their Poisson distributions, so any rate is cheap. count_g2 and the
+    timestamp stream generate the individual events. Pairs count as coincidences as if their delay were compensated.
+
+    Args:
+        device_path (str): Name shown in the GUI.
+        rate (float): Uncorrelated singles rate per channel in counts/s.
+        pair_rate (float): Pairs per second.
+        pair_channels (tuple): (first, second) channel of each pair.
+        delay (float): Delay of the second photon in ns.
+        jitter (float): Standard deviation of the delay in ns.
+        coincidence_window (float): Window for accidental coincidences in pairs mode, in ns.
+        realtime (bool): Take as long as the real device (the integration time). If False, return immediately.
+        seed (int): Random seed.
+    """
+    DEVICE_IDENTIFIER = 'TDC1'
+
+    def __init__(self, device_path: str = 'simulator', rate: float = 20000, pair_rate: float = 2000, \
+        pair_channels = (1, 3), delay: float = 20, jitter: float = 1, coincidence_window: float = 2, \
+        realtime: bool = True, seed: int = None):
+        self._device_path = device_path
+        self.rates = [rate] * 4
+        self.pair_rate = pair_rate
+        self.pair_channels = tuple(pair_channels)
+        self.delay = delay
+        self.jitter = jitter
+        self.coincidence_window = coincidence_window
+        self.realtime = realtime
+        self.mode = 'singles'
+        self.level = 'NIM'
+        self.int_time = 0.1 # Set by 'time N' on _com; get_counts without a duration uses it
+        self._rng = np.random.default_rng(seed)
+        self._com = _SimulatedPort(self)
+
+    @classmethod
+    def from_env(cls, device_path: str = 'simulator', variable: str = 'TDC1_SIMULATOR'):
+        """[summary]
+        SimulatedTDC1 configured from an environment variable of 'key=value' pairs separated by commas.
+        pair_channels is written as eg. '1-3'.
+        """
+        kwargs = {}
+        for item in os.environ.get(variable, '').split(','):
+            if '=' not in item:
+                continue
+            key, value = (s.strip() for s in item.split('=', 1))
+            if key == 'pair_channels':
+                kwargs[key] = tuple(int(c) for c in value.split('-'))
+            elif key in ('realtime',):
+                kwargs[key] = value.lower() not in ('0', 'false', 'no')
+            elif key == 'seed':
+                kwargs[key] = int(value)
+            else:
+                kwargs[key] = float(value)
+        return cls(device_path, **kwargs)
+
+    def _wait(self, duration: float):
+        if self.realtime:
+            time.sleep(duration)
+
+    def singles_rates(self):
+        # Pair photons add to the singles of their channels
+        rates = np.array(self.rates, dtype=np.float64)
+        for ch in self.pair_channels:
+            rates[ch - 1] += self.pair_rate
+        return rates
+
+    def events(self, duration: float):
+        return simulate_events(duration, self.rates, self.pair_rate, self.pair_channels, self.delay, self.jitter, \
+            self._rng)
+
+    def singles(self, duration: float):
+        return tuple(int(c) for c in self._rng.poisson(self.singles_rates() * duration))
+
+    def pairs(self, t_acq: float):
+        """[summary]
+        Singles of channels 1-4 followed by coincidences 1-3, 1-4, 2-3 and 2-4, like TimeStampTDC1.
+        """
+        rates = self.singles_rates()
+        singles = self._rng.poisson(rates * t_acq)
+        coincidences = []
+        for a, b in ((1, 3), (1, 4), (2, 3), (2, 4)):
+            mean = 2 * rates[a - 1] * rates[b - 1] * self.coincidence_window * 1e-9 * t_acq
+            if {a, b} == set(self.pair_channels):
+                mean += self.pair_rate * t_acq
+            coincidences.append(self._rng.poisson(mean))
+        return tuple(int(c) for c in np.concatenate((singles, coincidences)))
+
+    def get_counts(self, duration_seconds: float = None):
+        duration = self.int_time if duration_seconds is None else duration_seconds
+        self._wait(duration)
+        return self.singles(duration)
+
+    def get_counts_and_coincidences(self, t_acq: float = 1):
+        self._wait(t_acq)
+        return self.pairs(t_acq)
+
+    def count_g2(self, t_acq: float, bin_width: int = 2, bins: int = 500, ch_start: int = 1, ch_stop: int = 2, \
+        ch_stop_delay: float = 0):
+        """[summary]
+        Same arguments and result as TimeStampTDC1.count_g2, from simulated events.
+        """
+        self._wait(t_acq)
+        times, patterns = self.events(t_acq)
+        histogram = g2_histogram(times, patterns, ch_start, ch_stop, bin_width, bins, int(ch_stop_delay))
+        return {
+            'channel1': int(np.count_nonzero(patterns & (1 << (ch_start - 1)))),
+            'channel2': int(np.count_nonzero(patterns & (1 << (ch_stop - 1)))),
+            'total_time': times[-1] * 1e-9 if len(times) else t_acq,
+            'time_bins': np.arange(0, bins * bin_width, bin_width),
+            'histogram': histogram,
+        }
+
+
+def open_device(dev_path: str):
+    """[summary]
+    Opens a TDC1, or a SimulatedTDC1 for the simulator entries of the device list.
+    """
+    if is_simulator(dev_path):
+        return SimulatedTDC1.from_env(dev_path)
+    from S15lib.instruments import usb_counter_fpga
+    return usb_counter_fpga.TimeStampTDC1(dev_path)
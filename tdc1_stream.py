@@ -0,0 +1,247 @@
+# This file is part of the GUI for S-Fifteen Instruments' TimeStamp unit (TDC1).
+# Copyright (C) 2021 Gan Jun Herng.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""[summary]
+    Acquisition from the TDC1 without gaps. Instead of one blocking count_g2 call per acquisition (losing the
+    events in between), the device is put in timestamp mode once and its output is drained without gaps. Singles and
+    pairs counts are requested ahead, so the next window runs while the last one is handled.
+
+    Usage:
+    TimestampStream reads raw words from the serial port; StreamAnalyser turns them into g2 histograms for every channel
+    pair, once per integration time, in its own thread. See logWorker.log_g2_stream.
+    CountsPipeline keeps counts requests queued on the device; see Acquisition.log_counts_pipelined.
+    capture_timestamps takes one batch of events, eg. for tdc1_analysis.find_stop_delay.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+from tdc1_analysis import TimestampDecoder, StreamingAllPairs, CHANNEL_PAIRS
+from tdc1_metrics import METRICS
+
+
+class TimestampStream:
+    """[summary]
+    Raw timestamp stream from a TimeStampTDC1 that is already in timestamp mode. Starts one acquisition with no time
+    limit ('time 0', as S15lib's get_timestamps does for long acquisitions) and stops it with 'abort'. If the device
+    ends the acquisition anyway, read() re-arms it, which is the only gap in the stream.
+
+    Args:
+        tdc1_dev (TimeStampTDC1): Device object; only its _com serial port is used.
+    """
+    START_CMD = b'time 0;counts?\r\n'
+    STOP_CMD = b'abort\r\n'
+    REARM_AFTER = 1.0 # Seconds without data after which the acquisition is assumed to have ended
+
+    def __init__(self, tdc1_dev: object):
+        self._com = tdc1_dev._com
+        self._leftover = b'' # Bytes of an incomplete word
+        self._last_data = 0.0
+        self.bytes_read = 0
+        self.rearms = 0
+
+    def start(self):
+        self._com.reset_input_buffer()
+        self._com.write(self.START_CMD)
+        self._last_data = time.monotonic()
+
+    def read(self):
+        """[summary]
+        Returns whatever whole words have arrived (possibly b''). Blocks for at most the serial port timeout.
+        """
+        waiting = self._com.in_waiting
+        data = self._com.read(waiting if waiting else 4)
+        now = time.monotonic()
+        if not data:
+            if now - self._last_data > self.REARM_AFTER:
+                self._com.write(self.START_CMD)
+                self._last_data = now
+                self.rearms += 1
+            return b''
+        self._last_data = now
+        self.bytes_read += len(data)
+        data = self._leftover + data
+        whole = len(data) - len(data) % 4
+        self._leftover = data[whole:]
+        return data[:whole]
+
+    def stop(self):
+        self._com.write(self.STOP_CMD)
+        time.sleep(0.1)
+        self._com.reset_input_buffer()
+        self._leftover = b''
+
+
+def capture_timestamps(tdc1_dev: object, duration: float):
+    """[summary]
+    One batch of events from a TimeStampTDC1 that is already in timestamp mode, streamed for `duration` seconds.
+
+    Returns:
+        (np.ndarray, np.ndarray): Event times in ns and channel patterns, as TimestampDecoder.decode.
+    """
+    stream = TimestampStream(tdc1_dev)
+    chunks = []
+    stream.start()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        raw = stream.read()
+        if raw:
+            chunks.append(raw)
+    stream.stop()
+    return TimestampDecoder().decode(b''.join(chunks))
+
+
+class CountsPipeline:
+    """[summary]
+    Counts from a TimeStampTDC1 in singles or pairs mode with `depth` windows requested at a time. The next window is
+    already queued on the device when an answer arrives, so the device starts it straight away instead of waiting for
+    the answer to be handled and the next get_counts call. Sends 'time N;counts?' itself, as S15lib's get_counts does.
+
+    Args:
+        tdc1_dev (TimeStampTDC1): Device object in singles or pairs mode; only its _com serial port is used.
+        depth (int): Requests kept in flight.
+    """
+    REPLY_MARGIN = 0.5 # Seconds past the expected end of the queued windows after which an answer is taken as lost
+
+    def __init__(self, tdc1_dev: object, depth: int = 2):
+        self._com = tdc1_dev._com
+        self.depth = depth
+        self.lost = 0
+        self._requests = collections.deque() # Integration time of each request in flight
+        self._timeout = None
+
+    def _request(self, int_time: float):
+        self._com.write(b'time %d;counts?\r\n' % max(1, round(int_time * 1e3)))
+        self._requests.append(int_time)
+
+    def start(self, int_time: float):
+        self._timeout = self._com.timeout
+        self._com.reset_input_buffer()
+        for _ in range(self.depth):
+            self._request(int_time)
+
+    def read(self, int_time: float):
+        """[summary]
+        Waits for the oldest window and requests the next one (of int_time seconds) before returning. Returns the
+        counts and the window's integration time, or (None, None) if its answer did not come. The pipeline is then
+        drained and started afresh, as a late answer would otherwise be taken for the next window and shift every
+        window after it; the windows in flight are counted as lost too.
+        """
+        self._com.timeout = sum(self._requests) + self.REPLY_MARGIN
+        line = self._com.readline()
+        window = self._requests.popleft()
+        try:
+            counts = tuple(int(c) for c in line.split())
+        except ValueError:
+            counts = ()
+        if not counts:
+            self.lost += 1 + len(self._requests)
+            self._requests.appendleft(window) # Its answer is waited for once more, with the others
+            self.stop()
+            self.start(int_time)
+            return None, None
+        self._request(int_time)
+        return counts, window
+
+    def stop(self):
+        """[summary]
+        Waits for the windows still in flight and drops them, so their answers cannot be taken for a later request.
+        """
+        while self._requests:
+            self._com.timeout = sum(self._requests) + self.REPLY_MARGIN
+            self._com.readline()
+            self._requests.popleft()
+        self._com.timeout = self._timeout
+
+
+class StreamAnalyser(threading.Thread):
+    """[summary]
+    Live analysis stage for a TimestampStream. Raw words are handed over with put(); this thread decodes them, fills
+    the histograms of all 12 channel pairs at once (StreamingAllPairs) and calls on_histogram(g2_dict) every
+    params.int_time seconds. g2_dict has the keys TimeStampTDC1.count_g2 returns, for the selected start/stop pair,
+    plus 'pairs' (12 x bins, in CHANNEL_PAIRS order) and 'channel_counts' (events per channel).
+
+    Args:
+        params (object): Anything with ch_start, ch_stop, bin_width, bins, pair_delays and int_time attributes (the
+            logWorker). Read every window, so changes apply while running.
+        on_histogram (callable): Called from this thread with each window's g2_dict.
+    """
+
+    def __init__(self, params: object, on_histogram):
+        super(StreamAnalyser, self).__init__(daemon=True)
+        self.params = params
+        self.on_histogram = on_histogram
+        self.events = 0
+        self._queue = queue.SimpleQueue()
+        self._decoder = TimestampDecoder()
+        self._g2 = StreamingAllPairs()
+
+    def put(self, raw: bytes):
+        self._queue.put(raw)
+
+    def close(self):
+        self._queue.put(None)
+        if self.is_alive():
+            self.join()
+
+    def _settings(self):
+        p = self.params
+        return (max(1, p.bin_width), p.bins, np.array(p.pair_delays).tolist())
+
+    def run(self):
+        settings = self._settings()
+        self._g2.configure(*settings)
+        hist = np.zeros((len(CHANNEL_PAIRS), self._g2.bins), dtype=np.int64)
+        counts = np.zeros(4, dtype=np.int64)
+        window_start = time.monotonic()
+        running = True
+        while running:
+            timeout = max(0.0, window_start + self.params.int_time - time.monotonic())
+            try:
+                raw = self._queue.get(timeout=timeout)
+                if raw is None:
+                    running = False
+                else:
+                    with METRICS.timer('correlate'):
+                        times, patterns = self._decoder.decode(raw)
+                        self.events += len(times)
+                        hist += self._g2.push(times, patterns)
+                        for c in range(4):
+                            counts[c] += np.count_nonzero(patterns & (1 << c))
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if not running:
+                hist += self._g2.flush()
+            if now - window_start >= self.params.int_time or not running:
+                pair = (self.params.ch_start, self.params.ch_stop)
+                selected = hist[CHANNEL_PAIRS.index(pair)] if pair in CHANNEL_PAIRS else np.zeros(self._g2.bins, dtype=np.int64)
+                self.on_histogram({'channel1': int(counts[pair[0] - 1]), 'channel2': int(counts[pair[1] - 1]), \
+                    'total_time': now - window_start, 'time_bins': np.arange(self._g2.bins) * self._g2.bin_width, \
+                    'histogram': selected, 'pairs': hist, 'channel_counts': counts})
+                window_start = now
+                counts = np.zeros(4, dtype=np.int64)
+                if self._settings() != settings:
+                    # New bins/delays: the held-back starts were taken with the old ones, drop them and switch
+                    settings = self._settings()
+                    self._g2.flush()
+                    self._g2.configure(*settings)
+                hist = np.zeros((len(CHANNEL_PAIRS), self._g2.bins), dtype=np.int64)